@@ -1,69 +1,111 @@
+import sys
+from pathlib import Path
+from time import perf_counter
 from typing import Union, List, Dict
 
 from pymodaq.control_modules.move_utility_classes import DAQ_Move_base, comon_parameters_fun, main, DataActuatorType,\
     DataActuator  # common set of parameters for all actuators
 from pymodaq.utils.daq_utils import ThreadCommand # object used to send info back to the main thread
 from pymodaq.utils.parameter import Parameter
-from telemetrix import telemetrix
 
-from ..hardware.Thermistor_Reader import ThermistorReader
+# The hardware modules import each other as top-level modules
+HARDWARE_PATH = str(Path(__file__).resolve().parent.parent.joinpath('hardware'))
+if HARDWARE_PATH not in sys.path:
+    sys.path.append(HARDWARE_PATH)
 
-class PythonWrapperOfYourInstrument:
-    #  TODOk Replace this fake class with the import of the real python wrapper of your instrument
-    def __init__(self):
-        # Initialize the Telemetrix instance
-        self.controller = telemetrix.Telemetrix()
+from Thermistor_Reader import SERIES_MODES
+from Sample_Filters import FILTER_TYPES, make_filter
+from Temperature_Controller import ControllerType
+from Heater_Station import HeaterStation, OUTPUT_TYPES
+
+THERMISTOR_TABLE = str(Path(__file__).resolve().parents[3].joinpath('Thermistor_R_vs_T.csv'))
+THERMISTOR_TYPES = ['Type 8016', 'Type 8018', 'Type 1008', 'Type 2901']  # Resistance columns of the table
+MOVE_TIMEOUT = 3600  # Default timeout of a move in s, temperatures settling much slower than stages
 
 
-# TODOk:
-# (1) change the name of the following class to DAQ_Move_TheNameOfYourChoice
-# (2) change the name of this file to daq_move_TheNameOfYourChoice ("TheNameOfYourChoice" should be the SAME
-#     for the class name and the file name.)
-# (3) this file should then be put into the right folder, namely IN THE FOLDER OF THE PLUGIN YOU ARE DEVELOPING:
-#     pymodaq_plugins_my_plugin/daq_move_plugins
 class DAQ_Move_Heater(DAQ_Move_base):
-    """ Instrument plugin class for an actuator.
-    
-    This object inherits all functionalities to communicate with PyMoDAQ’s DAQ_Move module through inheritance via
-    DAQ_Move_base. It makes a bridge between the DAQ_Move module and the Python wrapper of a particular instrument.
-
-    TODO Complete the docstring of your plugin with:
-        * The set of controllers and actuators that should be compatible with this instrument plugin.
-        * With which instrument and controller it has been tested.
-        * The version of PyMoDAQ during the test.
-        * The version of the operating system.
-        * Installation instructions: what manufacturer’s drivers should be installed to make it run?
+    """ Temperature actuator: closed-loop heater (or cooler) driven by a Telemetrix Arduino board.
+
+    The position is the temperature of a thermistor read on an analog pin, and moving sets the setpoint of a PID
+    loop driving a PWM output (SSR, MOSFET) or a time-proportioned digital output (relays). The loop runs in the
+    background (see hardware/Heater_Station.py), so the temperature keeps being regulated between moves, and
+    get_actuator_value only returns the value cached by the thermistor reader, without serial I/O.
+
+    A move is done once the temperature has stayed within the settle band around the setpoint for the dwell
+    time, so that DAQ_Scan steps start as soon as the temperature is stable.
+
+    Each axis is a temperature zone, whose thermistor and output pins are set in the settings of its actuator.
+    Several zones of a board are set up as one Master actuator and Slave actuators of other axes (in a preset of
+    the dashboard): the Master creates the HeaterStation, with the board connection, and the Slaves add their
+    loop to it, so that all the zones share one serial link and one control thread. The board settings of the
+    Slaves are not used.
+
+    Tested with PyMoDAQ 4.4 on the simulated board only (Simulated setting), not yet on hardware. It is meant
+    for an Arduino flashed with the Telemetrix4Arduino firmware, NTC thermistors in a voltage divider and
+    heaters or coolers driven by PWM (SSR, MOSFET) or relays. Besides PyMoDAQ, it requires the telemetrix
+    package.
 
     Attributes:
     -----------
-    controller: object
-        The particular object that allow the communication with the hardware, in general a python wrapper around the
-         hardware library.
-         
-    # TODO add your particular attributes here if any
-
+    controller: HeaterStation
+        The temperature loops of the board, shared by the actuators of its zones.
     """
-    is_multiaxes = False  # TODO for your plugin set to True if this plugin is controlled for a multiaxis controller
-    _axis_names: Union[List[str], Dict[str, int]] = ['Axis1', 'Axis2']  # TODO for your plugin: complete the list
-    _controller_units: Union[str, List[str]] = 'mm'  # TODO for your plugin: put the correct unit here, it could be
-    # TODO  a single str (the same one is applied to all axes) or a list of str (as much as the number of axes)
-    _epsilon: Union[float, List[float]] = 0.1  # TODO replace this by a value that is correct depending on your controller
-    # TODO it could be a single float of a list of float (as much as the number of axes)
-    data_actuator_type = DataActuatorType.DataActuator  # wether you use the new data style for actuator otherwise set this
-    # as  DataActuatorType.float  (or entirely remove the line)
-
-    params = [   # TODO for your custom plugin: elements to be added here as dicts in order to control your custom stage
-                ] + comon_parameters_fun(is_multiaxes, axis_names=_axis_names, epsilon=_epsilon)
-    # _epsilon is the initial default value for the epsilon parameter allowing pymodaq to know if the controller reached
-    # the target value. It is the developer responsibility to put here a meaningful value
+    is_multiaxes = True
+    _axis_names: Union[List[str], Dict[str, int]] = ['Zone1', 'Zone2', 'Zone3', 'Zone4', 'Zone5', 'Zone6']
+    _controller_units: Union[str, List[str]] = '°C'
+    _epsilon: Union[float, List[float]] = 0.5
+    data_actuator_type = DataActuatorType.DataActuator
+
+    params = [
+        {'title': 'Board:', 'name': 'board', 'type': 'group', 'children': [
+            {'title': 'COM port:', 'name': 'com_port', 'type': 'str', 'value': '',
+             'tip': 'Serial port of the Arduino, empty for auto-detection'},
+            {'title': 'IP port:', 'name': 'ip_port', 'type': 'int', 'value': 31335},
+            {'title': 'Simulated:', 'name': 'simulated', 'type': 'bool', 'value': False,
+             'tip': 'Use a simulated board with a thermal model instead of the Arduino'},
+        ]},
+        {'title': 'Thermistor:', 'name': 'thermistor', 'type': 'group', 'children': [
+            {'title': 'Analog pin:', 'name': 'pin', 'type': 'int', 'value': 0, 'min': 0},
+            {'title': 'R(T) table:', 'name': 'table', 'type': 'browsepath', 'value': THERMISTOR_TABLE,
+             'filetype': True},
+            {'title': 'Type:', 'name': 'type', 'type': 'list', 'limits': THERMISTOR_TYPES, 'value': 'Type 8016'},
+            {'title': 'R at 25°C (Ohm):', 'name': 'ref_R', 'type': 'float', 'value': 10000.},
+            {'title': 'Series resistor (Ohm):', 'name': 'series_resistor', 'type': 'float', 'value': 13000.},
+            {'title': 'Series mode:', 'name': 'series_mode', 'type': 'list', 'limits': list(SERIES_MODES),
+             'value': 'VCC_R_Rth_GND'},
+            {'title': 'Filter:', 'name': 'filter', 'type': 'list', 'limits': list(FILTER_TYPES),
+             'value': 'moving_average'},
+        ]},
+        {'title': 'Output:', 'name': 'output', 'type': 'group', 'children': [
+            {'title': 'Pin:', 'name': 'pin', 'type': 'int', 'value': 3, 'min': 0},
+            {'title': 'Type:', 'name': 'output_type', 'type': 'list', 'limits': list(OUTPUT_TYPES), 'value': 'pwm'},
+            {'title': 'Window (s):', 'name': 'window', 'type': 'float', 'value': 10., 'min': 0.,
+             'tip': 'Period of the time-proportional output'},
+            {'title': 'Heater/Cooler:', 'name': 'controller_type', 'type': 'list',
+             'limits': [controller_type.value for controller_type in ControllerType], 'value': 'Heater'},
+        ]},
+        {'title': 'PID:', 'name': 'pid', 'type': 'group', 'children': [
+            {'title': 'Kp (1/°C):', 'name': 'kp', 'type': 'float', 'value': 0.1},
+            {'title': 'Ki (1/°C/s):', 'name': 'ki', 'type': 'float', 'value': 0.002},
+            {'title': 'Kd (s/°C):', 'name': 'kd', 'type': 'float', 'value': 0.},
+            {'title': 'Control period (s):', 'name': 'control_period', 'type': 'float', 'value': 0.5, 'min': 0.01},
+        ]},
+        {'title': 'Settling:', 'name': 'settling', 'type': 'group', 'children': [
+            {'title': 'Settle band (°C):', 'name': 'settle_band', 'type': 'float', 'value': 0.5, 'min': 0.,
+             'tip': 'Maximum distance to the setpoint of a settled temperature'},
+            {'title': 'Dwell time (s):', 'name': 'dwell_time', 'type': 'float', 'value': 30., 'min': 0.,
+             'tip': 'Time the temperature must stay within the settle band before the move is done'},
+        ]},
+        {'title': 'Home setpoint (°C):', 'name': 'home_setpoint', 'type': 'float', 'value': 25.},
+    ] + comon_parameters_fun(is_multiaxes, axis_names=_axis_names, epsilon=_epsilon)
+    for param in params:
+        if param['name'] == 'timeout':
+            param['value'] = MOVE_TIMEOUT
 
     def ini_attributes(self):
-        #  TODO declare the type of the wrapper (and assign it to self.controller) you're going to use for easy
-        #  autocompletion
-        self.controller: PythonWrapperOfYourInstrument = None
-
-        #TODO declare here attributes you want/need to init with a default value
-        pass
+        self.controller: HeaterStation = None
+        self._settle_start = None  # Time at which the temperature entered the settle band
+        self._zone = None  # Loop of the actuator in the HeaterStation, the axis chosen at initialization
 
     def get_actuator_value(self):
         """Get the current value from the hardware with scaling conversion.
@@ -72,31 +114,49 @@ class DAQ_Move_Heater(DAQ_Move_base):
         -------
         float: The position obtained after scaling conversion.
         """
-        ## TODO for your custom plugin
-        raise NotImplemented  # when writing your own plugin remove this line
-        pos = DataActuator(data=self.controller.your_method_to_get_the_actuator_value())  # when writing your own plugin replace this line
+        temperature = self.controller.get_temperature(self._zone)
+        self._update_settling(temperature)
+        pos = DataActuator(data=temperature)
         pos = self.get_position_with_scaling(pos)
         return pos
 
+    def _update_settling(self, temperature):
+        """Restart the dwell time whenever the temperature is out of the settle band, on every poll: PyMoDAQ only
+        calls user_condition_to_reach_target once the temperature is within epsilon of the target.
+
+        Returns
+        -------
+        bool: True if the temperature is within the settle band around the setpoint
+        """
+        setpoint = self.controller.get_setpoint(self._zone)
+        if setpoint is None or not abs(temperature - setpoint) <= self.settings['settling', 'settle_band']:
+            self._settle_start = None  # Also when the temperature is undefined (NaN)
+            return False
+        return True
+
     def user_condition_to_reach_target(self) -> bool:
-        """ Implement a condition for exiting the polling mechanism and specifying that the
-        target value has been reached
+        """ The target is reached once the temperature has stayed within the settle band around the setpoint
+        for the dwell time.
 
-       Returns
+        Returns
         -------
         bool: if True, PyMoDAQ considers the target value has been reached
         """
-        # TODO either delete this method if the usual polling is fine with you, but if need you can
-        #  add here some other condition to be fullfilled either a completely new one or
-        #  using or/and operations between the epsilon_bool and some other custom booleans
-        #  for a usage example see DAQ_Move_brushlessMotor from the Thorlabs plugin
-        return True
+        if not self._update_settling(self.controller.get_temperature(self._zone)):
+            return False
+        now = perf_counter()
+        if self._settle_start is None:
+            self._settle_start = now
+        return now - self._settle_start >= self.settings['settling', 'dwell_time']
 
     def close(self):
         """Terminate the communication protocol"""
-        ## TODO for your custom plugin
-        raise NotImplemented  # when writing your own plugin remove this line
-        #  self.controller.your_method_to_terminate_the_communication()  # when writing your own plugin replace this line
+        if self.controller is None or self._zone is None:
+            return
+        if self.is_master:
+            self.controller.close()
+        elif self._zone in self.controller.loops:  # The Master may be closed first
+            self.controller.remove_loop(self._zone)
 
     def commit_settings(self, param: Parameter):
         """Apply the consequences of a change of value in the detector settings
@@ -106,17 +166,15 @@ class DAQ_Move_Heater(DAQ_Move_base):
         param: Parameter
             A given parameter (within detector_settings) whose value has been changed by the user
         """
-        ## TODO for your custom plugin
-        if param.name() == 'axis':
-            self.axis_unit = self.controller.your_method_to_get_correct_axis_unit()
-            # do this only if you can and if the units are not known beforehand, for instance
-            # if the motors connected to the controller are of different type (mm, µm, nm, , etc...)
-            # see BrushlessDCMotor from the thorlabs plugin for an exemple
-
-        elif param.name() == "a_parameter_you've_added_in_self.params":
-           self.controller.your_method_to_apply_this_param_change()
-        else:
-            pass
+        if param.name() in ('kp', 'ki', 'kd'):
+            self.controller.set_gains(self._zone, self.settings['pid', 'kp'], self.settings['pid', 'ki'],
+                                      self.settings['pid', 'kd'])
+        elif param.name() in ('settle_band', 'dwell_time', 'home_setpoint'):
+            pass  # Read when needed
+        elif param.parent() is not None and param.parent().name() in ('board', 'thermistor', 'output') \
+                or param.name() == 'control_period':
+            self.emit_status(ThreadCommand('Update_Status', [f'{param.title()} will be applied at the next '
+                                                             f'initialization']))
 
     def ini_stage(self, controller=None):
         """Actuator communication initialization
@@ -132,18 +190,42 @@ class DAQ_Move_Heater(DAQ_Move_base):
         initialized: bool
             False if initialization failed otherwise True
         """
-        raise NotImplemented  # TODO when writing your own plugin remove this line and modify the ones below
         self.ini_stage_init(slave_controller=controller)  # will be useful when controller is slave
 
         if self.is_master:  # is needed when controller is master
-            self.controller = PythonWrapperOfYourInstrument(arg1, arg2, ...) #  arguments for instantiation!)
-            # todo: enter here whatever is needed for your controller initialization and eventual
-            #  opening of the communication channel
-
-        info = "Whatever info you want to log"
-        initialized = self.controller.a_method_or_atttribute_to_check_if_init()  # todo
+            self.controller = HeaterStation(com_port=self.settings['board', 'com_port'] or None,
+                                            ip_port=self.settings['board', 'ip_port'],
+                                            control_period=self.settings['pid', 'control_period'],
+                                            simulated=self.settings['board', 'simulated'])
+        self._zone = self.axis_name
+        try:
+            self._add_loop()
+        except Exception as e:  # Bad R(T) table, pins already used...
+            if self.is_master:
+                self.controller.close()  # Stops the control thread and the simulated board
+            return f"Could not create the {self._zone} loop: {e}", False
+
+        info = f"{self._zone} loop on analog pin {self.settings['thermistor', 'pin']} and output pin " \
+               f"{self.settings['output', 'pin']}"
+        initialized = self._zone in self.controller.loops
         return info, initialized
 
+    def _add_loop(self):
+        """Create the closed loop of the axis from the settings."""
+        thR_model = self.controller.get_model(self.settings['thermistor', 'table'], self.settings['thermistor', 'ref_R'],
+                                              self.settings['thermistor', 'type'])
+        self.controller.add_loop(self._zone, thR_model,
+                                 thermistor_pin=self.settings['thermistor', 'pin'],
+                                 output_pin=self.settings['output', 'pin'],
+                                 series_resistor=self.settings['thermistor', 'series_resistor'],
+                                 series_mode=self.settings['thermistor', 'series_mode'],
+                                 output_type=self.settings['output', 'output_type'],
+                                 window=self.settings['output', 'window'],
+                                 controller_type=ControllerType(self.settings['output', 'controller_type']),
+                                 kp=self.settings['pid', 'kp'], ki=self.settings['pid', 'ki'],
+                                 kd=self.settings['pid', 'kd'],
+                                 sample_filter=make_filter(self.settings['thermistor', 'filter']))
+
     def move_abs(self, value: DataActuator):
         """ Move the actuator to the absolute target defined by value
 
@@ -155,10 +237,9 @@ class DAQ_Move_Heater(DAQ_Move_base):
         value = self.check_bound(value)  #if user checked bounds, the defined bounds are applied here
         self.target_value = value
         value = self.set_position_with_scaling(value)  # apply scaling if the user specified one
-        ## TODO for your custom plugin
-        raise NotImplemented  # when writing your own plugin remove this line
-        self.controller.your_method_to_set_an_absolute_value(value.value())  # when writing your own plugin replace this line
-        self.emit_status(ThreadCommand('Update_Status', ['Some info you want to log']))
+        self._settle_start = None
+        self.controller.set_setpoint(self._zone, value.value())
+        self.emit_status(ThreadCommand('Update_Status', [f'{self._zone} setpoint: {value.value():.2f}°C']))
 
     def move_rel(self, value: DataActuator):
         """ Move the actuator to the relative target actuator value defined by value
@@ -167,30 +248,18 @@ class DAQ_Move_Heater(DAQ_Move_base):
         ----------
         value: (float) value of the relative target positioning
         """
-        value = self.check_bound(self.current_position + value) - self.current_position
-        self.target_value = value + self.current_position
-        value = self.set_position_relative_with_scaling(value)
-
-        ## TODO for your custom plugin
-        raise NotImplemented  # when writing your own plugin remove this line
-        self.controller.your_method_to_set_a_relative_value(value.value())  # when writing your own plugin replace this line
-        self.emit_status(ThreadCommand('Update_Status', ['Some info you want to log']))
+        # Computed on the values: pint refuses to add offset units such as °C
+        self.move_abs(DataActuator(data=self.current_value.value() + value.value()))
 
     def move_home(self):
-        """Call the reference method of the controller"""
-
-        ## TODO for your custom plugin
-        raise NotImplemented  # when writing your own plugin remove this line
-        self.controller.your_method_to_get_to_a_known_reference()  # when writing your own plugin replace this line
-        self.emit_status(ThreadCommand('Update_Status', ['Some info you want to log']))
+        """Regulate to the home setpoint"""
+        self.move_abs(DataActuator(data=self.settings['home_setpoint']))
 
     def stop_motion(self):
-      """Stop the actuator and emits move_done signal"""
-
-      ## TODO for your custom plugin
-      raise NotImplemented  # when writing your own plugin remove this line
-      self.controller.your_method_to_stop_positioning()  # when writing your own plugin replace this line
-      self.emit_status(ThreadCommand('Update_Status', ['Some info you want to log']))
+        """Stop the actuator and emits move_done signal"""
+        self.controller.hold(self._zone)  # Regulate to the current temperature
+        self.move_done()
+        self.emit_status(ThreadCommand('Update_Status', [f'{self._zone} held at the current temperature']))
 
 
 if __name__ == '__main__':
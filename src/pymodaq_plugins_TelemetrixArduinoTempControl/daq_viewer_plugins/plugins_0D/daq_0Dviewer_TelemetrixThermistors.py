@@ -0,0 +1,193 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+from pymodaq.utils.daq_utils import ThreadCommand
+from pymodaq.utils.data import DataFromPlugins, DataToExport
+from pymodaq.control_modules.viewer_utility_classes import DAQ_Viewer_base, comon_parameters, main
+from pymodaq.utils.parameter import Parameter
+
+# The hardware modules import each other as top-level modules
+HARDWARE_PATH = str(Path(__file__).resolve().parents[2].joinpath('hardware'))
+if HARDWARE_PATH not in sys.path:
+    sys.path.append(HARDWARE_PATH)
+
+from thermistor_model import ThermistorModel
+from Thermistor_Reader import ThermistorReader, SERIES_MODES
+from Sample_Filters import FILTER_TYPES, make_filter
+
+THERMISTOR_TABLE = str(Path(__file__).resolve().parents[4].joinpath('Thermistor_R_vs_T.csv'))
+THERMISTOR_TYPES = ['Type 8016', 'Type 8018', 'Type 1008', 'Type 2901']  # Resistance columns of the table
+
+# Thermal zones of the thermistors on a simulated board, one per pin, warmer with the pin number
+SIMULATED_AMBIENT = 20.0
+SIMULATED_STEP = 5.0
+SIMULATED_NOISE = 0.2  # Standard deviation of the ADC noise, in counts
+
+
+def parse_pins(pins):
+    """Analog pins of a comma separated list, such as '0, 1, 3'."""
+    return [int(pin) for pin in pins.replace(';', ',').split(',') if pin.strip()]
+
+
+class DAQ_0DViewer_TelemetrixThermistors(DAQ_Viewer_base):
+    """ Temperatures of the thermistors connected to the analog pins of a Telemetrix Arduino board.
+
+    A ThermistorReader is created for each pin of the channel list. Their temperatures are updated by the analog
+    reports the board streams in the background, so grab_data only emits the values cached by the readers, as
+    one Data0D with a channel per pin (NaN until the first sample), without any serial I/O: grabs never wait
+    for the board, and many channels can be logged at a high rate. The board connection is pooled with the other
+    instruments of the process using the same port, such as the zones of DAQ_Move_Heater.
+
+    Tested with PyMoDAQ 4.4 on the simulated board only (Simulated setting), not yet on hardware. It is meant
+    for an Arduino flashed with the Telemetrix4Arduino firmware and NTC thermistors in a voltage divider.
+    Besides PyMoDAQ, it requires the telemetrix package.
+
+    Attributes:
+    -----------
+    controller: list of ThermistorReader
+        The readers of the channels, shared with Slave viewers.
+    """
+    params = comon_parameters + [
+        {'title': 'Board:', 'name': 'board', 'type': 'group', 'children': [
+            {'title': 'COM port:', 'name': 'com_port', 'type': 'str', 'value': '',
+             'tip': 'Serial port of the Arduino, empty for auto-detection'},
+            {'title': 'IP port:', 'name': 'ip_port', 'type': 'int', 'value': 31335},
+            {'title': 'Simulated:', 'name': 'simulated', 'type': 'bool', 'value': False,
+             'tip': 'Use a simulated board, with a thermal zone per thermistor, instead of the Arduino'},
+        ]},
+        {'title': 'Analog pins:', 'name': 'pins', 'type': 'str', 'value': '0, 1',
+         'tip': 'Comma separated list of the analog pins of the thermistors'},
+        {'title': 'Thermistors:', 'name': 'thermistor', 'type': 'group', 'children': [
+            {'title': 'R(T) table:', 'name': 'table', 'type': 'browsepath', 'value': THERMISTOR_TABLE,
+             'filetype': True},
+            {'title': 'Type:', 'name': 'type', 'type': 'list', 'limits': THERMISTOR_TYPES, 'value': 'Type 8016'},
+            {'title': 'R at 25°C (Ohm):', 'name': 'ref_R', 'type': 'float', 'value': 10000.},
+            {'title': 'Series resistor (Ohm):', 'name': 'series_resistor', 'type': 'float', 'value': 13000.},
+            {'title': 'Series mode:', 'name': 'series_mode', 'type': 'list', 'limits': list(SERIES_MODES),
+             'value': 'VCC_R_Rth_GND'},
+            {'title': 'Filter:', 'name': 'filter', 'type': 'list', 'limits': list(FILTER_TYPES),
+             'value': 'moving_average'},
+        ]},
+    ]
+
+    def ini_attributes(self):
+        self.controller: list = None
+        self._simulated_board = None
+        self._labels = []
+
+    def commit_settings(self, param: Parameter):
+        """Apply the consequences of a change of value in the detector settings
+
+        Parameters
+        ----------
+        param: Parameter
+            A given parameter (within detector_settings) whose value has been changed by the user
+        """
+        if param.name() == 'pins' or param.parent() is not None and param.parent().name() in ('board', 'thermistor'):
+            self.emit_status(ThreadCommand('Update_Status', [f'{param.title()} will be applied at the next '
+                                                             f'initialization']))
+
+    def ini_detector(self, controller=None):
+        """Detector communication initialization
+
+        Parameters
+        ----------
+        controller: (object)
+            custom object of a PyMoDAQ plugin (Slave case). None if only one actuator/detector by controller
+            (Master case)
+
+        Returns
+        -------
+        info: str
+        initialized: bool
+            False if initialization failed otherwise True
+        """
+        self.ini_detector_init(slave_controller=controller)
+
+        if self.is_master:
+            try:
+                pins = parse_pins(self.settings['pins'])
+            except ValueError:
+                return f"Invalid analog pins: {self.settings['pins']}", False
+            if not pins:
+                return "No analog pin given", False
+            thR_model = ThermistorModel(self.settings['thermistor', 'table'], ref_R=self.settings['thermistor', 'ref_R'],
+                                        resistance_col_label=self.settings['thermistor', 'type'])
+            if thR_model.temp_from_resistance is None:
+                return (f"Could not load the {self.settings['thermistor', 'type']} column of the R(T) table "
+                        f"{self.settings['thermistor', 'table']}, see the log"), False
+            com_port = self.settings['board', 'com_port'] or None
+            self.controller = []
+            try:
+                board_factory = None
+                if self.settings['board', 'simulated']:
+                    board_factory = self._use_simulated_board(pins, thR_model)
+                for pin in pins:
+                    self.controller.append(ThermistorReader(
+                        pin, thR_model, com_port, self.settings['board', 'ip_port'],
+                        series_mode=self.settings['thermistor', 'series_mode'],
+                        series_resistor=self.settings['thermistor', 'series_resistor'],
+                        sample_filter=make_filter(self.settings['thermistor', 'filter']),
+                        board_factory=board_factory))
+            except Exception as e:  # Bad series mode, board not found...
+                self.close()  # Releases the readers created and the simulated board
+                return f"Could not create the thermistor readers: {e}", False
+
+        self._labels = [f'Pin {reader.pin}' for reader in self.controller]
+        self.dte_signal_temp.emit(DataToExport(name='TelemetrixThermistors',
+                                               data=[self._data([None] * len(self.controller))]))
+
+        info = f"Thermistors on analog pins {', '.join(str(reader.pin) for reader in self.controller)}"
+        initialized = len(self.controller) > 0
+        return info, initialized
+
+    def _use_simulated_board(self, pins, thR_model):
+        """Start a simulated board of this viewer, with a zone per pin, and return its factory."""
+        from Simulated_Telemetrix_Board import SimulatedTelemetrix
+        self._simulated_board = SimulatedTelemetrix()
+        for pin in pins:
+            zone = f'Pin {pin}'
+            self._simulated_board.add_zone(zone, ambient=SIMULATED_AMBIENT,
+                                           temperature=SIMULATED_AMBIENT + SIMULATED_STEP * pin)
+            self._simulated_board.add_thermistor(pin, zone, thR_model, self.settings['thermistor', 'series_resistor'],
+                                                 self.settings['thermistor', 'series_mode'], noise=SIMULATED_NOISE)
+        self._simulated_board.start()
+        return self._simulated_board.open
+
+    def _data(self, temperatures):
+        """Temperatures of the channels, NaN when undefined."""
+        return DataFromPlugins(name='Temperatures', dim='Data0D', labels=self._labels, units='°C',
+                               data=[np.array([np.nan if temperature is None else temperature])
+                                     for temperature in temperatures])
+
+    def close(self):
+        """Terminate the communication protocol"""
+        if self.is_master and self.controller is not None:
+            for reader in self.controller:
+                reader.disconnect()
+            self.controller = []
+        if self._simulated_board is not None:
+            self._simulated_board.stop()
+            self._simulated_board = None
+
+    def grab_data(self, Naverage=1, **kwargs):
+        """Emit the latest temperatures of the channels, without waiting for the board
+
+        Parameters
+        ----------
+        Naverage: int
+            Not used, the readers filter the samples themselves (see the Filter setting)
+        kwargs: dict
+            others optionals arguments
+        """
+        self.dte_signal.emit(DataToExport(name='TelemetrixThermistors', data=[self._data(
+            [reader.get_temperature() for reader in self.controller])]))
+
+    def stop(self):
+        """Stop the current grab hardware wise if necessary"""
+        return ''
+
+
+if __name__ == '__main__':
+    main(__file__)
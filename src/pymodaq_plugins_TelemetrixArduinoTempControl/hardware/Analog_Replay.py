@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Capture of the raw analog reports of ThermistorReaders, and their offline replay through readers and
+controllers.
+
+AnalogCapture appends the telemetrix reports (time stamp, pin, ADC count) of the readers it is attached to, as
+binary records (CAPTURE_DTYPE) written in chunks. AnalogReplay pushes the records of such a file into the
+_analog_callback of ThermistorReaders, as fast as possible or at the recorded pace, while controllers run on
+the recorded time, either periodically or, for event-driven ones, on each sample. Their decisions are returned
+as a structured array (DECISION_DTYPE), so that filters and control laws can be tuned on field data.
+
+The instruments of a replay are not connected to a real board: create them on a simulated board (see
+Simulated_Telemetrix_Board.use_simulated_board), the replay feeding the readers itself.
+"""
+import math
+import time
+import logging
+import threading
+
+import numpy as np
+from telemetrix.private_constants import PrivateConstants
+
+from Control_Scheduler import ControlScheduler
+
+logger = logging.getLogger(__name__)
+
+# Record layout of the capture files
+CAPTURE_DTYPE = np.dtype([('time', '<f8'), ('pin', '<i2'), ('value', '<i4')])
+
+CONTROLLER_NAME_SIZE = 32  # Maximum length of the controller names, in bytes
+
+# Controller decisions of a replay
+DECISION_DTYPE = np.dtype([
+    ('time', '<f8'),            # Time from the first record, in s
+    ('controller', f'S{CONTROLLER_NAME_SIZE}'),
+    ('temperature', '<f8'),     # Temperature read by the controller, NaN if undefined
+    ('output', '<f8'),          # Output state (0/1) or duty cycle after the decision
+])
+
+
+class AnalogCapture:
+    """
+    Records the raw analog reports of ThermistorReaders in a capture file.
+
+    :param file_path: Capture file, overwritten.
+    :param chunk: Number of records written to the file at once.
+    """
+
+    def __init__(self, file_path, chunk=1024):
+        self.file_path = file_path
+        self._batch = np.zeros(chunk, dtype=CAPTURE_DTYPE)
+        self._count = 0
+        self._lock = threading.Lock()
+        self._readers = []
+        self.records_written = 0
+        open(file_path, 'wb').close()
+
+    def attach(self, thermistor_reader):
+        """Record the reports of a reader, from now on."""
+        thermistor_reader.set_raw_recorder(self.record)
+        self._readers.append(thermistor_reader)
+
+    def record(self, data):
+        """Add a telemetrix analog report ([pin_type, pin, value, time_stamp])."""
+        with self._lock:
+            self._batch[self._count] = (data[3], data[1], data[2])
+            self._count += 1
+            if self._count == len(self._batch):
+                self._write_batch()
+
+    def _write_batch(self):
+        if self._count:
+            with open(self.file_path, 'ab') as capture_file:
+                self._batch[:self._count].tofile(capture_file)
+            self.records_written += self._count
+            self._count = 0
+
+    def flush(self):
+        with self._lock:
+            self._write_batch()
+
+    def close(self):
+        """Detach the readers and write the pending records."""
+        for thermistor_reader in self._readers:
+            thermistor_reader.set_raw_recorder(None)
+        self._readers = []
+        self.flush()
+        logger.info(f"Analog capture saved in {self.file_path} ({self.records_written} records).")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def load_capture(file_path):
+    """Records of a capture file, as a structured array (see CAPTURE_DTYPE)."""
+    return np.fromfile(file_path, dtype=CAPTURE_DTYPE)
+
+
+def _output_level(output):
+    duty_cycle = getattr(output, 'duty_cycle', None)
+    return float(output.is_on()) if duty_cycle is None else duty_cycle
+
+
+class AnalogReplay:
+    """
+    Replays captured analog reports through ThermistorReaders and controllers.
+
+    :param records: Capture records (see load_capture), or the path of a capture file.
+    """
+
+    def __init__(self, records):
+        self.records = load_capture(records) if isinstance(records, str) else records
+        self.time = 0.0  # Replay time, from the first record, in s
+
+    def clock(self):
+        return self.time
+
+    def run(self, readers, controllers=(), control_period=1.0, min_time=0.0, speed=None):
+        """
+        Feed the records to the readers of their pins, running the controllers every control_period seconds
+        of recorded time. Event-driven controllers (see TemperatureController.start_event_driven) rather run on
+        each sample of their reader, with their own min_time, timed by the recorded time instead of the
+        wall clock during the replay.
+
+        The readers and controllers start from their initial state (filters emptied, controllers reset, outputs
+        off), so that a capture gives the same decisions whatever ran before.
+
+        :param readers: ThermistorReaders, whose pins select the records they receive.
+        :param controllers: Objects with a control(current_time, min_time) method, such as TemperatureController.
+        :param speed: None to replay as fast as possible, else the speed relative to the recorded pace.
+        :return: The decisions of the controllers after each control step, as a structured array
+            (see DECISION_DTYPE).
+        """
+        readers = {reader.pin: reader for reader in readers}
+        for reader in readers.values():
+            reader.reset()
+        decisions = []
+        self.time = 0.0
+        scheduler = ControlScheduler(clock=self.clock)
+        event_subscriptions = []
+        for controller in controllers:
+            reset = getattr(controller, 'reset', None)
+            if reset is not None:
+                reset()  # E.g. the integral and derivative state of a PIDTemperatureController
+            controller.controller.turn_off()
+            if hasattr(controller, 'last_toggle_time'):
+                controller.last_toggle_time = -math.inf  # Times of the live run are on another clock
+            if getattr(controller, 'event_driven', False):
+                event_min_time = controller.event_min_time
+                controller.stop_event_driven()
+                subscription = lambda temperature, controller=controller, event_min_time=event_min_time: \
+                    self._control(controller, self.time, event_min_time, decisions)
+                controller.thermistor_reader.subscribe(subscription)
+                event_subscriptions.append((controller, subscription, event_min_time))
+            else:
+                scheduler.add(lambda now, controller=controller: self._control(controller, now, min_time, decisions),
+                              control_period, name=getattr(controller, 'name', None))
+        try:
+            self._feed(readers, scheduler, speed)
+        finally:
+            for controller, subscription, event_min_time in event_subscriptions:
+                controller.thermistor_reader.unsubscribe(subscription)
+                controller.start_event_driven(event_min_time)
+        return np.array(decisions, dtype=DECISION_DTYPE)
+
+    def _feed(self, readers, scheduler, speed):
+        if len(self.records) == 0:
+            return
+        first_time = self.records['time'][0]
+        start = time.monotonic()
+        skipped = 0
+        for time_stamp, pin, value in zip(self.records['time'].tolist(), self.records['pin'].tolist(),
+                                          self.records['value'].tolist()):
+            self.time = time_stamp - first_time
+            if speed is not None:
+                delay = start + self.time / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            scheduler.run_pending()  # Control steps due before this sample
+            reader = readers.get(pin)
+            if reader is None:
+                skipped += 1
+                continue
+            reader._analog_callback([PrivateConstants.ANALOG_REPORT, pin, value, time_stamp])
+        scheduler.run_pending()
+        if skipped:
+            logger.info(f"{skipped} records of pins without reader skipped.")
+
+    @staticmethod
+    def _control(controller, now, min_time, decisions):
+        controller.control(now, min_time)
+        temperature = controller.thermistor_reader.get_temperature()
+        decisions.append((now, str(controller.name).encode()[:CONTROLLER_NAME_SIZE],
+                          np.nan if temperature is None else temperature, _output_level(controller.controller)))
+
+
+if __name__ == '__main__':
+    import sys
+    from thermistor_model import ThermistorModel
+    from Thermistor_Reader import ThermistorReader
+    from Digital_Output_Controller import Digital_PinController
+    from Temperature_Controller import TemperatureController, ControllerType
+    from Simulated_Telemetrix_Board import use_simulated_board
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.WARNING)
+    # Replay a capture of Simple_Thermostat through its heater thermistor (pin 0) and threshold controller
+    thR_model = ThermistorModel("../../../Thermistor_R_vs_T.csv", ref_R=10000, resistance_col_label='Type 8016')
+    use_simulated_board()
+    with ThermistorReader(0, thR_model, series_resistor=13000, series_mode='VCC_R_Rth_GND') as reader, \
+         Digital_PinController(4) as output:
+        controller = TemperatureController(reader, output, 60.0, ControllerType.HEATER)
+        start = time.perf_counter()
+        decisions = AnalogReplay(sys.argv[1]).run([reader], [controller], control_period=0.5, min_time=5.0)
+        print(f"{len(decisions)} control steps replayed in {time.perf_counter() - start:.2f} s, "
+              f"output switched {np.count_nonzero(np.diff(decisions['output']))} times.")
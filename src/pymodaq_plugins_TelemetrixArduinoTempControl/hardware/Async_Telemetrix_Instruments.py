@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio variants of the Telemetrix instruments and of the temperature controller, built on telemetrix_aio.
+
+A single event loop can drive several boards and control loops, without a thread per device: the analog
+reports are handled by coroutines, writes are awaitable and the controllers can wake up on each new sample
+instead of polling. Instruments are connected with `async with` (or connect()/disconnect()).
+"""
+import asyncio
+import logging
+import threading
+import time
+
+from telemetrix_aio import telemetrix_aio
+
+from Thermistor_Reader import AdcTemperatureLUT, ANALOG_SCAN_INTERVAL_RANGE, check_differential
+from Sample_Filters import MovingAverageFilter
+from Proportional_Output_Controller import ARDUINO_PWM_MAX
+from Temperature_Controller import ControllerType, TemperatureController
+from Instrument_Logging import RateLimitedLogger, SampledDebugLogger
+
+logger = logging.getLogger(__name__)
+rate_limited = RateLimitedLogger(logger)  # Warnings that may be raised on every sample
+control_debug = SampledDebugLogger(logger)  # Per-step debug messages, see Instrument_Logging
+
+
+class AsyncBase_Telemetrix_Instrument:
+    """Base class sharing the telemetrix_aio boards between instruments.
+
+    One AsyncConnectionManager is pooled per (event loop, com_port, ip_port): a telemetrix_aio board is bound
+    to the loop it was opened in, so that several asyncio.run() of a process each open their own board. As in
+    the synchronous pool, a manager leaves the pool when its last instrument disconnects, the next instrument
+    opening the board again.
+    """
+
+    _connection_managers = {}  # Pool of AsyncConnectionManager instances, keyed by (loop, com_port, ip_port)
+    _pool_lock = threading.Lock()  # The event loops of several threads may share the pool
+
+    class AsyncConnectionManager:
+        """Manages the connection to a telemetrix_aio board, in the event loop creating the manager."""
+
+        def __init__(self, loop, com_port, ip_port):
+            self.board = None
+            self.reference_count = 0
+            self.loop = loop
+            self.com_port = com_port
+            self.ip_port = ip_port
+            self.retired = False  # Out of the pool: the instruments must get a new manager
+            self._lock = asyncio.Lock()
+
+        async def connect(self):
+            """Return the board, opening it if needed, or None if the manager left the pool meanwhile."""
+            async with self._lock:
+                if self.retired:
+                    return None
+                if self.reference_count == 0:
+                    logger.debug('Establishing connection with Arduino (com_port=%s, ip_port=%s)...', self.com_port, self.ip_port)
+                    self.board = telemetrix_aio.TelemetrixAIO(com_port=self.com_port, ip_port=self.ip_port,
+                                                             autostart=False, loop=self.loop,
+                                                             close_loop_on_shutdown=False)
+                    await self.board.start_aio()
+                self.reference_count += 1
+                logger.debug('Current connection reference count: %d', self.reference_count)
+                return self.board
+
+        async def disconnect(self):
+            async with self._lock:
+                if self.reference_count > 0:
+                    self.reference_count -= 1
+                    logger.debug('Decreasing reference count: %d', self.reference_count)
+                    if self.reference_count == 0:
+                        self.retired = True
+                        AsyncBase_Telemetrix_Instrument._remove_connection_manager(self)
+                        if self.board is not None:
+                            logger.debug('Closing Arduino connection...')
+                            await self.board.shutdown()
+                            self.board = None
+
+    @classmethod
+    def get_connection_manager(cls, com_port, ip_port):
+        """Return the pooled connection manager of a board in the running event loop, creating it on first use."""
+        loop = asyncio.get_running_loop()
+        key = (loop, com_port, ip_port)
+        with cls._pool_lock:
+            manager = cls._connection_managers.get(key)
+            if manager is None:
+                manager = cls._connection_managers[key] = cls.AsyncConnectionManager(loop, com_port, ip_port)
+            return manager
+
+    @classmethod
+    def _remove_connection_manager(cls, manager):
+        with AsyncBase_Telemetrix_Instrument._pool_lock:
+            key = (manager.loop, manager.com_port, manager.ip_port)
+            if AsyncBase_Telemetrix_Instrument._connection_managers.get(key) is manager:
+                del AsyncBase_Telemetrix_Instrument._connection_managers[key]
+
+    def __init__(self, com_port=None, ip_port=31335):
+        self.com_port = com_port
+        self.ip_port = ip_port
+        self.connection_manager = None  # Pooled manager of the event loop of connect()
+        self.board = None
+        self._connected = False
+
+    async def connect(self):
+        """Connect to the board (shared with the other instruments of the event loop) and configure the pin."""
+        if self._connected:
+            return
+        # With a new manager if the pooled one has just been released by its last instrument
+        while self.board is None:
+            self.connection_manager = self.get_connection_manager(self.com_port, self.ip_port)
+            self.board = await self.connection_manager.connect()
+        self._connected = True
+        try:
+            await self._setup()
+        except Exception:
+            await self.disconnect()
+            raise
+
+    async def _setup(self):
+        """Pin configuration, once connected."""
+        pass
+
+    async def disconnect(self):
+        """Release the board connection; only the first call has an effect."""
+        if not self._connected:
+            return
+        self._connected = False
+        logger.debug('Disconnecting the Telemetrix board for pin %s.', getattr(self, 'pin', None))
+        await self.connection_manager.disconnect()
+        self.board = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.disconnect()
+
+
+class AsyncThermistorReader(AsyncBase_Telemetrix_Instrument):
+    """Asyncio counterpart of ThermistorReader, using the same lookup tables and sample filters."""
+
+    def __init__(self, pin, thR_model, com_port=None, ip_port=31335, buffer_size=4, series_mode='VCC_Rth_R_GND',
+                 series_resistor=1e4, lut_oversampling=1, sample_filter=None, differential=0, scan_interval=None):
+        if scan_interval is not None and not ANALOG_SCAN_INTERVAL_RANGE[0] <= scan_interval <= ANALOG_SCAN_INTERVAL_RANGE[1]:
+            raise ValueError(f"Analog scan interval must be in {ANALOG_SCAN_INTERVAL_RANGE} ms, got {scan_interval}.")
+        differential = check_differential(differential)
+        super().__init__(com_port, ip_port)
+        self.pin = pin
+        self.thR_model = thR_model
+        self.series_resistor = series_resistor
+        self.series_mode = series_mode
+        self.differential = differential
+        self.scan_interval = scan_interval
+        self._lut = AdcTemperatureLUT.get(thR_model, series_resistor, series_mode, lut_oversampling)
+        self._filter = sample_filter if sample_filter is not None else MovingAverageFilter(buffer_size)
+        self._temperature = None
+        self._sample_count = 0
+        self._sample_event = None
+
+    async def _setup(self):
+        self._sample_event = asyncio.Event()
+        if self.scan_interval is not None:
+            await self.set_scan_interval(self.scan_interval)
+        await self.board.set_pin_mode_analog_input(self.pin, differential=self.differential,
+                                                   callback=self._analog_callback)
+
+    async def set_scan_interval(self, interval):
+        """Set the analog scan interval of the board, in ms."""
+        interval = int(interval)
+        if not ANALOG_SCAN_INTERVAL_RANGE[0] <= interval <= ANALOG_SCAN_INTERVAL_RANGE[1]:
+            raise ValueError(f"Analog scan interval must be in {ANALOG_SCAN_INTERVAL_RANGE} ms, got {interval}.")
+        await self.board.set_analog_scan_interval(interval)
+        self.scan_interval = interval
+
+    async def set_differential(self, differential):
+        """Set the minimum change of the ADC count before the board reports a new value on this pin."""
+        differential = check_differential(differential)
+        await self.board.set_pin_mode_analog_input(self.pin, differential=differential, callback=self._analog_callback)
+        self.differential = differential
+
+    async def _analog_callback(self, data):
+        self._sample_count += 1
+        self._filter.update(data[2], data[3])
+        temperature = self._lut.lookup(self._filter.value)
+        self._temperature = None if temperature != temperature else temperature  # NaN: outside of the model domain
+
+        # Wake up the coroutines waiting for this sample
+        event, self._sample_event = self._sample_event, asyncio.Event()
+        event.set()
+
+    def get_temperature(self):
+        """Last converted temperature, without waiting."""
+        if self._temperature is None:
+            rate_limited.warning('Temperature from thermistor on pin %s is undefined', self.pin, key=self.pin)
+        return self._temperature
+
+    async def read_temperature(self, timeout=None):
+        """Wait for the next analog report and return the resulting temperature."""
+        if self._sample_event is None:
+            raise RuntimeError("The thermistor reader is not connected.")
+        await asyncio.wait_for(self._sample_event.wait(), timeout)
+        return self.get_temperature()
+
+
+class AsyncDigital_PinController(AsyncBase_Telemetrix_Instrument):
+    """Asyncio counterpart of Digital_PinController, with the same redundant write suppression."""
+
+    def __init__(self, pin, com_port=None, ip_port=31335, suppress_redundant=True, refresh_interval=10.0):
+        super().__init__(com_port, ip_port)
+        self.pin = pin
+        self.suppress_redundant = suppress_redundant
+        self.refresh_interval = refresh_interval
+        self.writes_issued = 0
+        self.writes_suppressed = 0
+        self._last_write_time = None
+        self.state = False
+
+    async def _setup(self):
+        logger.debug('Setting pin %s as digital output.', self.pin)
+        await self.board.set_pin_mode_digital_output(self.pin)
+
+    async def set_state(self, state, force=False):
+        """Drive the pin high (True) or low (False), unless it is known to be in this state already."""
+        state = bool(state)
+        if self.board is None:
+            logger.warning('Cannot turn %s pin %s: board is not connected.', 'on' if state else 'off', self.pin)
+            return
+        now = time.monotonic()
+        if (self.suppress_redundant and not force and state == self.state and self._last_write_time is not None
+                and (self.refresh_interval is None or now - self._last_write_time < self.refresh_interval)):
+            self.writes_suppressed += 1
+            return
+        await self.board.digital_write(self.pin, 1 if state else 0)
+        self.state = state
+        self.writes_issued += 1
+        self._last_write_time = now
+
+    async def turn_on(self):
+        await self.set_state(True)
+
+    async def turn_off(self):
+        await self.set_state(False)
+
+    def is_on(self):
+        return self.state
+
+    def get_write_statistics(self):
+        return {'issued': self.writes_issued, 'suppressed': self.writes_suppressed}
+
+
+class AsyncPWM_PinController(AsyncBase_Telemetrix_Instrument):
+    """Asyncio counterpart of PWM_PinController."""
+
+    def __init__(self, pin, com_port=None, ip_port=31335):
+        super().__init__(com_port, ip_port)
+        self.pin = pin
+        self.duty_cycle = 0.0
+        self._value = None
+
+    async def _setup(self):
+        await self.board.set_pin_mode_analog_output(self.pin)
+        await self.set_duty_cycle(0.0)
+
+    async def set_duty_cycle(self, duty_cycle):
+        """Set the duty cycle in [0, 1], values outside being clipped."""
+        duty_cycle = min(max(float(duty_cycle), 0.0), 1.0)
+        value = round(duty_cycle * ARDUINO_PWM_MAX)
+        self.duty_cycle = duty_cycle
+        if self.board is not None and value != self._value:
+            await self.board.analog_write(self.pin, value)
+            self._value = value
+
+    async def turn_on(self):
+        await self.set_duty_cycle(1.0)
+
+    async def turn_off(self):
+        await self.set_duty_cycle(0.0)
+
+    def is_on(self):
+        return self.duty_cycle > 0
+
+
+class AsyncTemperatureController:
+    """
+    Asyncio counterpart of TemperatureController (threshold control with a minimum time between toggles).
+
+    run() either reacts to every new sample of the thermistor reader, or runs on a fixed period with
+    deadlines taken from the event loop clock.
+    """
+
+    def __init__(self, thermistor_reader, controller, threshold, controller_type, name=None):
+        if not isinstance(thermistor_reader, AsyncThermistorReader):
+            raise TypeError("thermistor_reader must be an instance of AsyncThermistorReader.")
+        if not isinstance(controller, (AsyncDigital_PinController, AsyncPWM_PinController)):
+            raise TypeError("controller must be an instance of AsyncDigital_PinController or AsyncPWM_PinController.")
+
+        # Assign a default name if none is provided, sharing the numbering of TemperatureController
+        if not name:
+            if controller_type == ControllerType.HEATER:
+                name = f"heater{TemperatureController.heater_counter}"
+                TemperatureController.heater_counter += 1
+            elif controller_type == ControllerType.COOLER:
+                name = f"cooler{TemperatureController.cooler_counter}"
+                TemperatureController.cooler_counter += 1
+
+        self.name = name
+        self.thermistor_reader = thermistor_reader
+        self.controller = controller
+        self.threshold = threshold
+        self.controller_type = controller_type
+        self.last_toggle_time = None
+
+    async def __aenter__(self):
+        logger.info(f"Initializing {self.name}")
+        await self.controller.turn_off()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        logger.info(f"Exiting {self.name}")
+        await self.controller.turn_off()
+
+    async def control(self, current_time=None, min_time=0.0):
+        """One threshold control step, current_time defaulting to time.monotonic()."""
+        current_time = time.monotonic() if current_time is None else current_time
+        temperature = self.thermistor_reader.get_temperature()
+        if temperature is None:
+            return
+        if control_debug.enabled:
+            control_debug("%s - Temperature: %.2f°C", self.name, temperature, temperature=temperature)
+        if self.last_toggle_time is not None and current_time - self.last_toggle_time < min_time:
+            return
+
+        if self.controller_type == ControllerType.HEATER:
+            required_state = temperature < self.threshold
+        else:
+            required_state = temperature > self.threshold
+        if required_state != self.controller.is_on():
+            await (self.controller.turn_on() if required_state else self.controller.turn_off())
+            logger.debug("%s - %s %s", self.name, self.controller_type.value, 'ON' if required_state else 'OFF')
+            self.last_toggle_time = current_time
+
+    async def run(self, period=None, min_time=0.0):
+        """
+        Run the control loop until cancelled.
+
+        :param period: Control period in s, or None to run a control step on every new sample.
+        :param min_time: Minimum time between two output toggles, in s.
+        """
+        loop = asyncio.get_running_loop()
+        if period is None:
+            while True:
+                await self.thermistor_reader.read_temperature()
+                await self.control(time.monotonic(), min_time)
+
+        deadline = loop.time()
+        while True:
+            await self.control(time.monotonic(), min_time)
+            deadline += period
+            delay = deadline - loop.time()
+            if delay < 0:
+                # Late by more than a period: skip the missed deadlines instead of bursting
+                deadline += period * (-delay // period + 1)
+                delay = deadline - loop.time()
+            await asyncio.sleep(delay)
+
+
+if __name__ == '__main__':
+    from thermistor_model import ThermistorModel
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    THERMISTOR_PIN = 0  # Analog pin where thermistor is connected
+    DIGITAL_PIN = 4  # Digital pin controlling the heater
+    THERMISTOR_25C = 10000  # Resistance at 25°C
+    SERIES_RESISTOR = 13000  # Known resistor in ohms
+    TEMP_THRESHOLD = 30.0  # Heater threshold in °C
+    MIN_TIME = 5.0  # Minimum time interval between pin state changes in seconds
+
+    thR_model = ThermistorModel("../../../Thermistor_R_vs_T.csv", ref_R=THERMISTOR_25C, resistance_col_label='Type 8016')
+
+    async def main():
+        async with AsyncThermistorReader(THERMISTOR_PIN, thR_model, series_resistor=SERIES_RESISTOR) as reader, \
+                AsyncDigital_PinController(DIGITAL_PIN) as heater, \
+                AsyncTemperatureController(reader, heater, TEMP_THRESHOLD, ControllerType.HEATER) as controller:
+            await controller.run(min_time=MIN_TIME)
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Session ended.")
@@ -5,65 +5,131 @@ Created on Tue Nov  5 17:18:43 2024
 @author: gaignebet
 """
 import time
+import threading
 from telemetrix import telemetrix
 import logging
 
-# Setup logging
-logging.basicConfig(level=logging.DEBUG)  # Set to DEBUG level for detailed output
 logger = logging.getLogger(__name__)
 
 class Base_Telemetrix_Instrument:
-    """Base class to manage the connection to the Telemetrix board as a singleton."""
+    """Base class to share the connections to Telemetrix boards between instruments.
+
+    One ConnectionManager is pooled per (com_port, ip_port), so that several boards can be driven from the
+    same process, each of them being opened once whatever the number of instruments using it. A manager
+    leaves the pool when its last instrument disconnects, the next instrument opening the board again.
+
+    The boards are telemetrix.Telemetrix instances, unless the instrument is given a board_factory, e.g. the
+    open method of a SimulatedTelemetrix board for tests and simulations without hardware. The managers are
+    pooled per factory too, so that instruments given different factories never share a board. The
+    process-wide default factory (see set_board_factory) is only meant for standalone scripts: code sharing the
+    process with other instruments, such as the PyMoDAQ plugins, passes its factory explicitly.
+    """
     
-    _connection_manager = None  # Singleton instance of ConnectionManager
+    _connection_managers = {}  # Pool of ConnectionManager instances, keyed by (board_factory, com_port, ip_port)
+    _pool_lock = threading.Lock()
+    board_factory = None  # Default callable(com_port, ip_port) returning a board, None for telemetrix.Telemetrix
 
     class ConnectionManager:
         """Manages the connection to the Telemetrix board."""
         
-        def __init__(self, com_port, ip_port):
+        def __init__(self, com_port, ip_port, factory=None):
             self.board = None
             self.reference_count = 0
             self.com_port = com_port
             self.ip_port = ip_port
+            self.factory = factory  # Opens the board, None for telemetrix.Telemetrix
+            self.retired = False  # Out of the pool: the instruments must get a new manager
+            self._lock = threading.Lock()
 
         def connect(self):
-            if self.reference_count == 0:
-                logger.debug('Establishing connection with Arduino...')
-                self.board = telemetrix.Telemetrix(com_port=self.com_port, ip_port=self.ip_port)
-            self.reference_count += 1
-            logger.debug(f'Current connection reference count: {self.reference_count}')
+            """Return the board, opening it if needed, or None if the manager left the pool meanwhile."""
+            with self._lock:
+                if self.retired:
+                    return None
+                if self.reference_count == 0:
+                    logger.debug('Establishing connection with Arduino (com_port=%s, ip_port=%s)...', self.com_port, self.ip_port)
+                    if self.factory is None:
+                        self.board = telemetrix.Telemetrix(com_port=self.com_port, ip_port=self.ip_port)
+                    else:
+                        self.board = self.factory(com_port=self.com_port, ip_port=self.ip_port)
+                self.reference_count += 1
+                logger.debug('Current connection reference count: %d', self.reference_count)
+                return self.board
 
         def disconnect(self):
-            if self.reference_count > 0:
-                self.reference_count -= 1
-                logger.debug(f'Decreasing reference count: {self.reference_count}')
-                if self.reference_count == 0 and self.board is not None:
-                    logger.debug('Closing Arduino connection...')
-                    self.board.shutdown()
-                    self.board = None
-
-    def __init__(self, com_port, ip_port):
-        # Initialize the connection manager if it doesn't exist
-        if Base_Telemetrix_Instrument._connection_manager is None:
-            Base_Telemetrix_Instrument._connection_manager = Base_Telemetrix_Instrument.ConnectionManager(com_port, ip_port)
-        self.connection_manager = Base_Telemetrix_Instrument._connection_manager
-        self.connection_manager.connect()  # Automatically connect upon base class initialization
-        self.board = self.connection_manager.board
+            with self._lock:
+                if self.reference_count > 0:
+                    self.reference_count -= 1
+                    logger.debug('Decreasing reference count: %d', self.reference_count)
+                    if self.reference_count == 0:
+                        self.retired = True
+                        Base_Telemetrix_Instrument._remove_connection_manager(self)
+                        if self.board is not None:
+                            logger.debug('Closing Arduino connection...')
+                            self.board.shutdown()
+                            self.board = None
+
+    @classmethod
+    def set_board_factory(cls, factory):
+        """
+        Select the boards opened from now on by the instruments created without board_factory, in the whole
+        process: factory(com_port=..., ip_port=...) returns a board with the telemetrix API, None restores
+        telemetrix.Telemetrix. The instruments already connected keep their board.
+        """
+        Base_Telemetrix_Instrument.board_factory = factory  # Shared by all the subclasses, like the pool
+
+    @classmethod
+    def get_connection_manager(cls, com_port, ip_port, board_factory=None):
+        """
+        Return the pooled connection manager of a board, creating it on first use.
+
+        :param board_factory: Factory opening the board, None for the default one (see set_board_factory).
+        """
+        with cls._pool_lock:
+            factory = Base_Telemetrix_Instrument.board_factory if board_factory is None else board_factory
+            key = (factory, com_port, ip_port)
+            manager = cls._connection_managers.get(key)
+            if manager is None:
+                manager = cls._connection_managers[key] = cls.ConnectionManager(com_port, ip_port, factory)
+            return manager
+
+    @classmethod
+    def _remove_connection_manager(cls, manager):
+        with Base_Telemetrix_Instrument._pool_lock:
+            key = (manager.factory, manager.com_port, manager.ip_port)
+            if Base_Telemetrix_Instrument._connection_managers.get(key) is manager:
+                del Base_Telemetrix_Instrument._connection_managers[key]
+
+    def __init__(self, com_port, ip_port, board_factory=None):
+        # Automatically connect upon base class initialization, with a new manager if the pooled one has just
+        # been released by its last instrument
+        self.board = None
+        while self.board is None:
+            self.connection_manager = self.get_connection_manager(com_port, ip_port, board_factory)
+            self.board = self.connection_manager.connect()
+        self._connected = True
 
     def __del__(self):
         self.disconnect()  # Ensure disconnection upon deletion of the object
     
     def __enter__(self):
-        logger.debug(f'Entering context with Base_Telemetrix_Instrument for pin {self.pin}.')
+        logger.debug('Entering context with Base_Telemetrix_Instrument for pin %s.', self.pin)
         return self  # Return the instance itself for use within the context
 
     def __exit__(self, exc_type, exc_value, traceback):
-        logger.debug(f'Exiting context with Base_Telemetrix_Instrument for pin {self.pin}.')
+        logger.debug('Exiting context with Base_Telemetrix_Instrument for pin %s.', self.pin)
         self.disconnect()  # Disconnect when exiting the context
 
     def disconnect(self):
-        """Explicitly disconnect the connection without relying on context manager."""
-        logger.debug(f'Disconnecting the Telemetrix board for pin {self.pin}.')
+        """Explicitly disconnect the connection without relying on context manager.
+
+        Only the first call releases the connection, so that an explicit disconnection followed by the
+        garbage collection does not release the board twice.
+        """
+        if not getattr(self, '_connected', False):
+            return
+        self._connected = False
+        logger.debug('Disconnecting the Telemetrix board for pin %s.', getattr(self, 'pin', None))
         self.connection_manager.disconnect()
 
 
@@ -74,9 +140,7 @@ if __name__ == '__main__':
     from Thermistor_Reader import ThermistorReader  
     
     # Setup logging
-    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s')
-    logger = logging.getLogger(__name__)
-    logger.setLevel(logging.INFO)
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
     
     
     # Define pins and constants
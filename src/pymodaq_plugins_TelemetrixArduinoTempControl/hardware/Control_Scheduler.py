@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Deadline based scheduling of several control loops in a single thread.
+
+Each loop has its own period and its deadlines are computed from its start time (start + k * period), so
+the period does not drift with the time spent in the loops. Late starts (jitter) and missed periods
+(overruns) are accounted for per loop.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledTask:
+    """A control loop registered in a ControlScheduler, with its timing statistics."""
+
+    def __init__(self, target, period, min_time=0.0, name=None):
+        if period <= 0:
+            raise ValueError("period must be positive.")
+        self.target = target
+        self.period = period
+        self.min_time = min_time
+        self.name = name or getattr(target, 'name', None) or repr(target)
+        self.next_deadline = None
+        self.runs = 0
+        self.overruns = 0  # Number of periods skipped because the loop was late by more than a period
+        self.max_jitter = 0.0
+        self.total_jitter = 0.0
+        self.max_duration = 0.0
+
+    def run(self, now):
+        """Run one iteration: controllers get control(now, min_time), plain callables get target(now)."""
+        control = getattr(self.target, 'control', None)
+        if control is not None:
+            control(now, self.min_time)
+        else:
+            self.target(now)
+
+    def get_statistics(self):
+        return {'name': self.name, 'period': self.period, 'runs': self.runs, 'overruns': self.overruns,
+                'mean_jitter': self.total_jitter / self.runs if self.runs else 0.0,
+                'max_jitter': self.max_jitter, 'max_duration': self.max_duration}
+
+
+class ControlScheduler:
+    """
+    Runs any number of controllers (objects with a control(current_time, min_time) method, such as
+    TemperatureController) or callables (called with the current time), each with its own period.
+
+    The loops run in the thread calling run(), or in a background thread with start()/stop(). Times are
+    given by `clock`, time.monotonic by default.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._heap = []  # (deadline, sequence, task)
+        self._sequence = itertools.count()
+        self._tasks = []
+        self._lock = threading.Lock()
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add(self, target, period, min_time=0.0, name=None, phase=0.0):
+        """
+        Register a loop, whose first iteration is due `phase` seconds from now.
+
+        :return: The ScheduledTask, giving access to the loop statistics.
+        """
+        task = ScheduledTask(target, period, min_time, name)
+        task.next_deadline = self.clock() + phase
+        with self._lock:
+            self._tasks.append(task)
+            heapq.heappush(self._heap, (task.next_deadline, next(self._sequence), task))
+        self._wake_event.set()
+        return task
+
+    def remove(self, target):
+        """Unregister the loops of a controller or callable."""
+        with self._lock:
+            self._tasks = [task for task in self._tasks if task.target is not target]
+            self._heap = [entry for entry in self._heap if entry[2].target is not target]
+            heapq.heapify(self._heap)
+
+    @property
+    def tasks(self):
+        return list(self._tasks)
+
+    def run_pending(self):
+        """
+        Run the loops whose deadline is reached.
+
+        :return: The time until the next deadline in s (None without any loop).
+        """
+        while True:
+            with self._lock:
+                if not self._heap:
+                    return None
+                deadline, _, task = self._heap[0]
+                now = self.clock()
+                if deadline > now:
+                    return deadline - now
+                heapq.heappop(self._heap)
+
+            jitter = now - deadline
+            try:
+                task.run(now)
+            except Exception as e:
+                logger.error(f"Error in control loop {task.name}: {e}")
+            duration = self.clock() - now
+
+            task.runs += 1
+            task.total_jitter += jitter
+            task.max_jitter = max(task.max_jitter, jitter)
+            task.max_duration = max(task.max_duration, duration)
+
+            # Next deadline on the period grid, skipping the periods already missed
+            next_deadline = deadline + task.period
+            end = now + duration
+            if next_deadline <= end:
+                missed = int((end - next_deadline) // task.period) + 1
+                task.overruns += missed
+                next_deadline += missed * task.period
+                logger.debug("Control loop %s overran by %d period(s).", task.name, missed)
+            task.next_deadline = next_deadline
+
+            with self._lock:
+                if task in self._tasks:
+                    heapq.heappush(self._heap, (next_deadline, next(self._sequence), task))
+
+    def run(self, duration=None):
+        """Run the loops until stop() is called, or for `duration` seconds."""
+        self._stop_event.clear()
+        self._run_loop(duration)
+
+    def _run_loop(self, duration=None):
+        end = None if duration is None else self.clock() + duration
+        while not self._stop_event.is_set():
+            timeout = self.run_pending()
+            if end is not None:
+                remaining = end - self.clock()
+                if remaining <= 0:
+                    break
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            # Sleep until the next deadline, a stop request or a newly added loop
+            self._wake_event.wait(timeout)
+            self._wake_event.clear()
+
+    def start(self):
+        """Run the loops in a background thread."""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True, name='ControlScheduler')
+        self._thread.start()
+
+    def stop(self):
+        """Stop run(), and join the background thread if any."""
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def get_statistics(self):
+        """Timing statistics of every loop (runs, overruns, jitter and duration in s)."""
+        return [task.get_statistics() for task in self._tasks]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
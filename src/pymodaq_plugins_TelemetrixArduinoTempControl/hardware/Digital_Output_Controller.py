@@ -6,42 +6,72 @@ Created on Tue Nov  5 17:18:43 2024
 """
 import time
 import logging
+import threading
 
 from Base_Telemetrix_Instrument import Base_Telemetrix_Instrument
-# Setup logging
-logging.basicConfig(level=logging.DEBUG)  # Set to DEBUG level for detailed output
+from Latency_Probes import latency_probes
+
 logger = logging.getLogger(__name__)
 
 
 class Digital_PinController(Base_Telemetrix_Instrument):
     """Controls a digital_pin connected to an Arduino through telemetrix."""
     
-    def __init__(self, pin, com_port=None, ip_port=31335):
-        super().__init__(com_port, ip_port)  # Call the parent constructor
+    def __init__(self, pin, com_port=None, ip_port=31335, suppress_redundant=True, refresh_interval=10.0,
+                 board_factory=None):
+        """
+        :param suppress_redundant: If True, a write requesting the cached state is not sent to the board.
+        :param refresh_interval: Time in s after which a request of the cached state is written anyway, to
+            recover from a missed write or a board reset. There is no timer: the refresh only happens on the
+            next set_state() call (or refresh()) after this time. None to never refresh.
+        :param board_factory: Factory opening the board (see Base_Telemetrix_Instrument), None for the default.
+        """
+        super().__init__(com_port, ip_port, board_factory)  # Call the parent constructor
         self.pin = pin
+        self.suppress_redundant = suppress_redundant
+        self.refresh_interval = refresh_interval
+        self.writes_issued = 0  # Number of digital_write sent to the board
+        self.writes_suppressed = 0  # Number of redundant writes not sent
+        self._last_write_time = None
         
-        logger.debug(f'Setting pin {self.pin} as digital output.')
+        logger.debug('Setting pin %s as digital output.', self.pin)
         self.board.set_pin_mode_digital_output(self.pin)  # Set the pin as digital output
         self.state = False  # Track the state of the digital_pin (True for ON, False for OFF)
         
     def turn_on(self):
-        if self.board is not None:
-            logger.debug(f'Turning on digital pin {self.pin}.')
-            self.board.digital_write(self.pin, 1)  # Set pin high
-            self.state = True
-        else:
-            logger.warning('Cannot turn on: board is not connected.')
+        self.set_state(True)
 
     def turn_off(self):
-        if self.board is not None:
-            logger.debug(f'Turning off digital pin {self.pin}.')
-            self.board.digital_write(self.pin, 0)  # Set pin low
-            self.state = False
-        else:
-            logger.warning('Cannot turn off: board is not connected.')
+        self.set_state(False)
+
+    def set_state(self, state, force=False):
+        """Drive the pin high (True) or low (False), unless it is known to be in this state already."""
+        state = bool(state)
+        if self.board is None:
+            logger.warning('Cannot turn %s pin %s: board is not connected.', 'on' if state else 'off', self.pin)
+            return
+        now = time.monotonic()
+        if (self.suppress_redundant and not force and state == self.state and self._last_write_time is not None
+                and (self.refresh_interval is None or now - self._last_write_time < self.refresh_interval)):
+            self.writes_suppressed += 1
+            return
+        logger.debug('Turning %s digital pin %s.', 'on' if state else 'off', self.pin)
+        self.board.digital_write(self.pin, 1 if state else 0)
+        if latency_probes.enabled:
+            latency_probes.record_write()
+        self.state = state
+        self.writes_issued += 1
+        self._last_write_time = now
+
+    def refresh(self):
+        """Write the cached state to the board again."""
+        self.set_state(self.state, force=True)
+
+    def get_write_statistics(self):
+        """Counts of the writes sent to the board and of the redundant ones suppressed."""
+        return {'issued': self.writes_issued, 'suppressed': self.writes_suppressed}
 
     def is_on(self):
-        logger.debug(f'Checking if digital pin {self.pin} is ON: {self.state}')
         return self.state
     
     def __exit__(self, exc_type, exc_value, traceback):
@@ -49,7 +79,68 @@ class Digital_PinController(Base_Telemetrix_Instrument):
         # self.turn_off()
         super().__exit__(exc_type, exc_value, traceback)  # Call the parent method
 
+
+class DigitalOutputGroup:
+    """Queues state changes of several Digital_PinController and applies them together.
+
+    Changes of the same pin are coalesced (the last one wins), and each controller decides whether its write
+    is redundant (see Digital_PinController.set_state), so a flush sends one digital_write per pin that
+    actually changes or is due for a refresh, back to back. The telemetrix firmware has no port-level write,
+    so this is the minimum number of messages.
+
+    Used as a context manager, the queued changes are flushed on exit.
+    """
+
+    def __init__(self, controllers=()):
+        self.controllers = list(controllers)
+        self._pending = {}  # Requested state per controller, in request order
+        self._lock = threading.Lock()
+
+    def add(self, controller):
+        if not isinstance(controller, Digital_PinController):
+            raise TypeError("controller must be an instance of Digital_PinController.")
+        with self._lock:  # set_all() may iterate over the controllers from another thread
+            if controller not in self.controllers:
+                self.controllers.append(controller)
+
+    def set_state(self, controller, state):
+        """Queue a state for one controller of the group, added to the group if needed."""
+        self.add(controller)
+        with self._lock:
+            self._pending[controller] = bool(state)
+
+    def turn_on(self, controller):
+        self.set_state(controller, True)
+
+    def turn_off(self, controller):
+        self.set_state(controller, False)
+
+    def set_all(self, state):
+        """Queue the same state for all the controllers of the group."""
+        with self._lock:
+            for controller in self.controllers:
+                self._pending[controller] = bool(state)
+
+    def flush(self):
+        """Write the queued changes, and return the number of digital_write messages sent."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        writes = 0
+        for controller, state in pending.items():
+            issued = controller.writes_issued
+            controller.set_state(state)  # Suppresses the redundant writes, unless a refresh is due
+            writes += controller.writes_issued - issued
+        logger.debug('Flushed %d digital writes (%d skipped).', writes, len(pending) - writes)
+        return writes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
 if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
     RELAY_PIN_1 = 4  # Digital pin where digital_pin 1 is connected
     RELAY_PIN_2 = 2  # Digital pin where digital_pin 2 is connected
     
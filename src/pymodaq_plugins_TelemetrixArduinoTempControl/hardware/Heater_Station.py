@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Closed temperature loops of a Telemetrix board, run in the background, for the PyMODAQ plugins.
+
+A HeaterStation owns the instruments of its loops (ThermistorReader, proportional output and
+PIDTemperatureController) and runs them all in a single ControlScheduler thread, the instruments sharing the
+pooled connection to the board, so that several zones only use one serial link. Reading a temperature only returns the
+value cached by the reader callback, so it never waits for the serial link. A loop only drives its output once
+a setpoint has been given.
+"""
+import math
+import logging
+import threading
+
+from thermistor_model import ThermistorModel
+from Thermistor_Reader import ThermistorReader
+from Digital_Output_Controller import Digital_PinController
+from Proportional_Output_Controller import PWM_PinController, TimeProportional_PinController
+from Temperature_Controller import PIDTemperatureController, ControllerType
+from Control_Scheduler import ControlScheduler
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_TYPES = ('pwm', 'time_proportional')
+
+# Thermal zone and actuator power of the loops on a simulated board
+SIMULATED_ZONE = {'heat_capacity': 200.0, 'thermal_resistance': 2.0, 'ambient': 20.0}
+SIMULATED_POWER = 30.0  # W, negative for coolers
+
+
+class TemperatureLoop:
+    """Instruments of one closed loop of a HeaterStation."""
+
+    def __init__(self, name, reader, output, output_pin, pid, pin_controller=None):
+        self.name = name
+        self.reader = reader
+        self.output = output
+        self.output_pin = output_pin
+        self.pid = pid
+        self.pin_controller = pin_controller  # Digital pin driven by a time-proportional output
+        self.enabled = False  # True once a setpoint is given
+        self.control_target = None  # Callable scheduled while enabled
+
+    def close(self):
+        self.output.turn_off()
+        for instrument in (self.reader, self.output, self.pin_controller):
+            if instrument is not None and hasattr(instrument, 'disconnect'):
+                instrument.disconnect()
+
+
+class HeaterStation:
+    """
+    Temperature loops sharing a Telemetrix board, controlled from another thread.
+
+    :param com_port: Serial port of the board, None for auto-detection.
+    :param ip_port: IP port of the board.
+    :param control_period: Period of the control loops in s.
+    :param simulated: If True, the loops use a SimulatedTelemetrix board of their own, with a thermal zone per
+        loop (see Simulated_Telemetrix_Board). The other instruments of the process are not affected.
+    """
+
+    def __init__(self, com_port=None, ip_port=31335, control_period=0.5, simulated=False):
+        self.com_port = com_port
+        self.ip_port = ip_port
+        self.control_period = control_period
+        self.loops = {}
+        self._lock = threading.Lock()  # Serializes the control steps and the setpoint changes
+        self._models = {}
+        self.simulated_board = None
+        self.board_factory = None  # Factory given to the instruments, None for the real board
+        if simulated:
+            from Simulated_Telemetrix_Board import SimulatedTelemetrix
+            self.simulated_board = SimulatedTelemetrix()
+            self.board_factory = self.simulated_board.open
+            self.simulated_board.start()
+        self.scheduler = ControlScheduler()
+        self.scheduler.start()
+
+    def get_model(self, file_path, ref_R, resistance_col_label):
+        """Thermistor model shared by the loops using the same table (and their conversion tables)."""
+        key = (file_path, ref_R, resistance_col_label)
+        if key not in self._models:
+            model = ThermistorModel(file_path, ref_R=ref_R, resistance_col_label=resistance_col_label)
+            if model.temp_from_resistance is None:
+                raise ValueError(f"Could not load the {resistance_col_label} column of the R(T) table {file_path}.")
+            self._models[key] = model
+        return self._models[key]
+
+    def add_loop(self, name, thR_model, thermistor_pin, output_pin, series_resistor=1e4,
+                 series_mode='VCC_Rth_R_GND', output_type='pwm', window=10.0, controller_type=ControllerType.HEATER,
+                 kp=0.1, ki=0.0, kd=0.0, sample_filter=None):
+        """
+        Create the instruments of a loop, its output staying off until set_setpoint().
+
+        :param output_type: One of OUTPUT_TYPES: hardware PWM, or time-proportioning of a digital pin (relays)
+            over windows of `window` seconds.
+        :return: The TemperatureLoop.
+        """
+        if name in self.loops:
+            raise ValueError(f"A loop named {name} already exists.")
+        if output_type not in OUTPUT_TYPES:
+            raise ValueError(f"Unknown output type: {output_type}. Valid types: {OUTPUT_TYPES}.")
+        for loop in self.loops.values():
+            if thermistor_pin == loop.reader.pin or output_pin == loop.output_pin:
+                raise ValueError(f"Pins {thermistor_pin}/{output_pin} already used by loop {loop.name}.")
+        instruments = []
+        try:
+            reader = ThermistorReader(thermistor_pin, thR_model, self.com_port, self.ip_port,
+                                      series_mode=series_mode, series_resistor=series_resistor,
+                                      sample_filter=sample_filter, board_factory=self.board_factory)
+            instruments.append(reader)
+            pin_controller = None
+            if output_type == 'pwm':
+                output = PWM_PinController(output_pin, self.com_port, self.ip_port, board_factory=self.board_factory)
+            else:
+                pin_controller = Digital_PinController(output_pin, self.com_port, self.ip_port,
+                                                       board_factory=self.board_factory)
+                instruments.append(pin_controller)
+                output = TimeProportional_PinController(pin_controller, window=window)
+            instruments.append(output)
+            pid = PIDTemperatureController(reader, output, 0.0, controller_type, kp, ki, kd, name=name)
+        except Exception:
+            for instrument in instruments:
+                if hasattr(instrument, 'disconnect'):
+                    instrument.disconnect()
+            raise
+        if self.simulated_board is not None:
+            # Wired once the instruments exist, so that a failed loop leaves nothing on the board
+            self.simulated_board.add_zone(name, **SIMULATED_ZONE)
+            self.simulated_board.add_thermistor(thermistor_pin, name, thR_model, series_resistor, series_mode)
+            power = SIMULATED_POWER if controller_type == ControllerType.HEATER else -SIMULATED_POWER
+            self.simulated_board.add_actuator(output_pin, name, power)
+        output.turn_off()
+        loop = self.loops[name] = TemperatureLoop(name, reader, output, output_pin, pid, pin_controller)
+        return loop
+
+    def remove_loop(self, name):
+        """Stop a loop and release its instruments, the other loops keeping the board."""
+        self.disable(name)
+        self.loops.pop(name).close()
+
+    def _control(self, loop, now):
+        with self._lock:
+            if loop.enabled:  # A step may be due while the loop is being disabled
+                loop.pid.control(now)
+
+    def get_temperature(self, name):
+        """Last temperature of a loop in °C, NaN if undefined (no serial I/O)."""
+        temperature = self.loops[name].reader.get_temperature()
+        return math.nan if temperature is None else temperature
+
+    def get_setpoint(self, name):
+        loop = self.loops[name]
+        return loop.pid.setpoint if loop.enabled else None
+
+    def set_setpoint(self, name, setpoint):
+        """Regulate a loop to a setpoint in °C, starting its control if needed."""
+        loop = self.loops[name]
+        with self._lock:
+            if loop.enabled:
+                loop.pid.set_setpoint(setpoint)
+                return
+            loop.pid.reset()
+            loop.pid.set_setpoint(setpoint, bumpless=False)
+            loop.enabled = True
+            control_target = loop.control_target = lambda now: self._control(loop, now)
+        self.scheduler.add(control_target, self.control_period, name=name)
+        logger.info(f"Loop {name} regulated to {setpoint}°C.")
+
+    def set_gains(self, name, kp, ki, kd):
+        """Change the PID gains of a loop, between two control steps."""
+        with self._lock:
+            self.loops[name].pid.set_gains(kp, ki, kd)
+
+    def hold(self, name):
+        """Regulate a loop to its current temperature, if defined."""
+        temperature = self.get_temperature(name)
+        if not math.isnan(temperature):
+            self.set_setpoint(name, temperature)
+
+    def disable(self, name):
+        """Stop the control of a loop and turn its output off."""
+        loop = self.loops[name]
+        with self._lock:
+            if not loop.enabled:
+                return
+            loop.enabled = False
+            loop.output.turn_off()
+            control_target, loop.control_target = loop.control_target, None
+        self.scheduler.remove(control_target)
+
+    def close(self):
+        """Stop the loops, turn the outputs off and release the board."""
+        self.scheduler.stop()
+        for loop in self.loops.values():
+            loop.close()
+        self.loops.clear()
+        if self.simulated_board is not None:
+            self.simulated_board.stop()
+            self.simulated_board = None
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Logging helpers for the hot paths of the instruments (telemetrix callbacks, control loops).
+
+The hardware modules never configure logging themselves: handlers and levels are left to the application
+(logging.basicConfig in the __main__ blocks, PyMODAQ...). Messages use the lazy %-style formatting of logging,
+so that they are only formatted when emitted, and the extra fields (pin, value...) are attached to the
+records as attributes for structured handlers.
+
+- SampledDebugLogger: per-sample debug messages, disabled by default. The hot paths test its `enabled`
+  attribute before calling it, so that they cost a single attribute lookup when disabled. Once enabled,
+  one call out of `every` is logged.
+- RateLimitedLogger: warnings that may be raised on every sample (undefined temperature...), logged at
+  most once per `interval` seconds per message and key (the pin...), with the number of messages suppressed
+  meanwhile.
+"""
+import time
+import logging
+import weakref
+
+
+class SampledDebugLogger:
+    """
+    Debug messages of a hot path, logged for one call out of `every` once enabled (counted per message).
+
+    Usage, in the hot path::
+
+        if sample_debug.enabled:
+            sample_debug('Received analog value %s', value, pin=pin)
+    """
+
+    _instances = weakref.WeakSet()
+
+    def __init__(self, logger, every=100):
+        self.logger = logger
+        self.every = every
+        self.enabled = False
+        self._calls = {}  # Format string -> calls since the last message logged
+        self._instances.add(self)
+
+    def enable(self, every=None):
+        if every is not None:
+            self.every = max(int(every), 1)
+        self._calls.clear()
+        # Not worth enabling if the debug messages would be discarded anyway
+        self.enabled = self.logger.isEnabledFor(logging.DEBUG)
+
+    def disable(self):
+        self.enabled = False
+
+    @classmethod
+    def enable_all(cls, every=None):
+        """Enable the sampled debug messages of all the hardware modules."""
+        for instance in list(cls._instances):
+            instance.enable(every)
+
+    @classmethod
+    def disable_all(cls):
+        for instance in list(cls._instances):
+            instance.disable()
+
+    def __call__(self, msg, *args, **fields):
+        calls = self._calls.get(msg, 0) + 1
+        if calls >= self.every:
+            calls = 0
+            self.logger.debug(msg, *args, extra=fields or None)
+        self._calls[msg] = calls
+
+
+class RateLimitedLogger:
+    """
+    Logs each message at most once per `interval` seconds.
+
+    A message is identified by its format string and by the optional `key` given when logging it, e.g. the pin
+    concerned, so that the messages of one pin do not suppress those of another. The key must be hashable and
+    take few values (not a time stamp or an exception). The number of occurrences suppressed since the last one
+    logged is appended to the message.
+
+    Usage::
+
+        rate_limited.warning('Temperature from thermistor on pin %s is undefined', pin, key=pin)
+    """
+
+    def __init__(self, logger, interval=10.0):
+        self.logger = logger
+        self.interval = interval
+        self._last = {}  # (format string, key) -> (time of the last message logged, occurrences suppressed since)
+
+    def log(self, level, msg, *args, key=None, **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        last_time, suppressed = self._last.get((msg, key), (None, 0))
+        if last_time is not None and now - last_time < self.interval:
+            self._last[msg, key] = (last_time, suppressed + 1)
+            return
+        self._last[msg, key] = (now, 0)
+        if suppressed:
+            msg = msg + ' (%d similar messages suppressed)'
+            args = args + (suppressed,)
+        self.logger.log(level, msg, *args, extra=fields or None)
+
+    def warning(self, msg, *args, key=None, **fields):
+        self.log(logging.WARNING, msg, *args, key=key, **fields)
+
+    def error(self, msg, *args, key=None, **fields):
+        self.log(logging.ERROR, msg, *args, key=key, **fields)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Latency probes of the acquisition -> control -> actuation pipeline.
+
+When enabled (latency_probes.enable()), the instruments time each sample through the stages of STAGES:
+
+- 'received': delay between the telemetrix time stamp of the analog report and the reader callback,
+  growing when the serial link or the telemetrix threads saturate. Not recorded for boards whose time stamps
+  are not wall-clock times (wall_clock_time_stamps = False, e.g. SimulatedTelemetrix).
+- 'filtered', 'converted': time from the callback to the end of the filtering and of the conversion.
+- 'control_decision': age of the sample used by a controller when it decides the output, including the
+  wait for the control loop in polled mode.
+- 'write_issued': age of that sample when the resulting write is sent to the board.
+
+Each stage feeds a LatencyHistogram with log-spaced bins. Recording only increments counters, without lock:
+each stage is normally recorded from a single thread, and a count lost to a concurrent update is harmless for
+statistics. When disabled, the hot paths only test latency_probes.enabled.
+"""
+import json
+import math
+import threading
+import time
+
+STAGES = ('received', 'filtered', 'converted', 'control_decision', 'write_issued')
+
+
+class LatencyHistogram:
+    """
+    Histogram of durations in s, with `bins_per_decade` log-spaced bins from `min_value` to `max_value`.
+
+    Quantiles are given with the resolution of the bins (about 12% with the default 20 bins per decade).
+    """
+
+    def __init__(self, min_value=1e-6, max_value=100.0, bins_per_decade=20):
+        self.min_value = min_value
+        self.bins_per_decade = bins_per_decade
+        self._scale = bins_per_decade / math.log(10)
+        # Bin 0 holds the values below min_value, the last bin those above max_value
+        self._size = int(math.ceil(math.log10(max_value / min_value) * bins_per_decade)) + 2
+        self.counts = [0] * self._size
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        if value < self.min_value:
+            index = 0
+        else:
+            index = min(int(math.log(value / self.min_value) * self._scale) + 1, self._size - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def upper_bound(self, index):
+        """Upper edge of a bin, in s."""
+        return self.min_value * 10 ** (index / self.bins_per_decade)
+
+    def quantile(self, q):
+        """Upper edge of the bin holding the q-quantile (capped by the maximum), None if empty."""
+        counts = list(self.counts)  # Snapshot, recording may go on in other threads
+        total = sum(counts)
+        if total == 0:
+            return None
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                return min(self.upper_bound(index), self.max)
+        return self.max
+
+    def get_statistics(self):
+        return {'count': self.count, 'mean': self.total / self.count if self.count else None,
+                'p50': self.quantile(0.5), 'p99': self.quantile(0.99), 'max': self.max if self.count else None}
+
+    def reset(self):
+        self.counts = [0] * self._size
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+class LatencyProbes:
+    """Histograms of the pipeline stages, shared by all the instruments of the process."""
+
+    def __init__(self, **histogram_kwargs):
+        self.enabled = False
+        self.histograms = {stage: LatencyHistogram(**histogram_kwargs) for stage in STAGES}
+        self._local = threading.local()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def record(self, stage, duration):
+        self.histograms[stage].record(duration)
+
+    def set_origin(self, received_time):
+        """
+        Called by a controller when it decides an output: record the age of its sample (time.perf_counter()
+        at reception) and make the writes issued from this thread record theirs, until clear_origin().
+        """
+        if received_time is None:
+            return
+        self.histograms['control_decision'].record(time.perf_counter() - received_time)
+        self._local.origin = received_time
+
+    def clear_origin(self):
+        self._local.origin = None
+
+    def record_write(self):
+        """Called by the output controllers after a write to the board."""
+        origin = getattr(self._local, 'origin', None)
+        if origin is not None:
+            self.histograms['write_issued'].record(time.perf_counter() - origin)
+
+    def get_statistics(self):
+        """Count, mean, p50, p99 and max in s of each stage."""
+        return {stage: histogram.get_statistics() for stage, histogram in self.histograms.items()}
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+    def dump(self, file_path):
+        """Write the statistics and the histograms (bin upper edges and counts) to a JSON file."""
+        content = {}
+        for stage, histogram in self.histograms.items():
+            counts = list(histogram.counts)
+            content[stage] = dict(histogram.get_statistics(),
+                                  bins=[histogram.upper_bound(index) for index in range(len(counts))],
+                                  counts=counts)
+        with open(file_path, 'w') as dump_file:
+            json.dump(content, dump_file, indent=2)
+
+
+# Probes of the hardware modules
+latency_probes = LatencyProbes()
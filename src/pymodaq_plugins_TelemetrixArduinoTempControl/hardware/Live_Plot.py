@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Live plot of TimeSeriesBuffers, redrawn at a capped frame rate with blitting.
+
+The plot only reads the buffers, so it runs in its own thread (the main one, as required by the GUI backends)
+while the control loops fill the buffers in another thread, and their timing does not depend on the plot.
+Only the lines are redrawn on each frame; the axes are redrawn when the data leaves the current limits, which
+are extended with a margin so that this happens rarely.
+"""
+import math
+import time
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+
+class LivePlot:
+    """
+    Lines following TimeSeriesBuffers on a matplotlib axes.
+
+    :param ax: Axes of the plot, whose static content (labels, legend, threshold lines...) is drawn once.
+    :param window: Time span displayed in s, None to display the whole buffers.
+    :param max_fps: Maximum number of frames per second.
+    :param max_points: Maximum number of points drawn per line, the buffers being decimated beyond.
+    :param margin: Fraction of the data range added to the axes limits when they are extended.
+    """
+
+    def __init__(self, ax, window=None, max_fps=5.0, max_points=1000, margin=0.1):
+        self.ax = ax
+        self.figure = ax.figure
+        self.canvas = self.figure.canvas
+        self.window = window
+        self.frame_period = 1.0 / max_fps
+        self.max_points = max_points
+        self.margin = margin
+        self._lines = []  # (buffer, line)
+        self._background = None
+        self.frames = 0
+        self.full_redraws = 0
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def add_line(self, buffer, **line_kwargs):
+        """Plot a TimeSeriesBuffer, with the given Line2D properties. Return the line."""
+        line, = self.ax.plot([], [], animated=True, **line_kwargs)
+        self._lines.append((buffer, line))
+        return line
+
+    def _on_draw(self, event):
+        # Full redraw (first draw, new limits, resize...): keep the static content for the next frames
+        self._background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self._draw_lines()
+
+    def _draw_lines(self):
+        for _, line in self._lines:
+            self.ax.draw_artist(line)
+
+    def _decimated(self, buffer):
+        # Consistent copies, since the buffers keep being written by the control loops
+        times, values = buffer.latest(copy=True) if self.window is None else buffer.window(self.window, copy=True)
+        step = max(1, math.ceil(len(times) / self.max_points))
+        return times[::step], values[::step]
+
+    def _limits_exceeded(self, data):
+        xmin, xmax = self.ax.get_xlim()
+        ymin, ymax = self.ax.get_ylim()
+        for times, values in data:
+            if len(times) == 0:
+                continue
+            if times[-1] > xmax or (self.window is None and times[0] < xmin):
+                return True
+            finite = values[np.isfinite(values)]
+            if len(finite) and (finite.min() < ymin or finite.max() > ymax):
+                return True
+        return False
+
+    def _update_limits(self, data):
+        times = np.concatenate([times for times, _ in data])
+        values = np.concatenate([values for _, values in data])
+        values = values[np.isfinite(values)]
+        if len(times) == 0:
+            return
+        span = self.window if self.window is not None else max(times.max() - times.min(), 1.0)
+        start = times.max() - span if self.window is not None else times.min()
+        self.ax.set_xlim(start, start + span * (1 + self.margin))
+        if len(values):
+            low, high = values.min(), values.max()
+            extra = max(high - low, 1.0) * self.margin
+            self.ax.set_ylim(low - extra, high + extra)
+
+    def update(self):
+        """Draw one frame."""
+        data = [self._decimated(buffer) for buffer, _ in self._lines]
+        for (_, line), (times, values) in zip(self._lines, data):
+            line.set_data(times, values)
+        if self._background is None or self._limits_exceeded(data):
+            self._update_limits(data)
+            self.full_redraws += 1
+            self.canvas.draw()  # Calls _on_draw
+        else:
+            self.canvas.restore_region(self._background)
+            self._draw_lines()
+            self.canvas.blit(self.figure.bbox)
+        self.canvas.flush_events()
+        self.frames += 1
+
+    def is_open(self):
+        return plt.fignum_exists(self.figure.number)
+
+    def run(self, stop_event=None):
+        """Redraw the plot until its window is closed or stop_event (threading.Event) is set."""
+        plt.show(block=False)
+        while self.is_open() and not (stop_event is not None and stop_event.is_set()):
+            frame_start = time.monotonic()
+            self.update()
+            remaining = self.frame_period - (time.monotonic() - frame_start)
+            # Process the GUI events until the next frame
+            self.canvas.start_event_loop(max(remaining, 0.001))
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Proportional drives of heaters and coolers: hardware PWM for SSR/MOSFET loads, and software
+time-proportioning of a digital pin for mechanical relays.
+
+Both controllers take duty-cycle commands in [0, 1] and also offer the turn_on/turn_off/is_on interface of
+Digital_PinController, so they can be used wherever a digital output is expected.
+"""
+import math
+import time
+import logging
+import threading
+
+from Base_Telemetrix_Instrument import Base_Telemetrix_Instrument
+from Digital_Output_Controller import Digital_PinController
+from Latency_Probes import latency_probes
+
+logger = logging.getLogger(__name__)
+
+ARDUINO_PWM_MAX = 255  # analog_write value for a 100% duty cycle (8-bit PWM)
+
+
+def _clip_duty_cycle(duty_cycle):
+    duty_cycle = float(duty_cycle)
+    if math.isnan(duty_cycle):
+        raise ValueError("duty_cycle must not be NaN.")
+    return min(max(duty_cycle, 0.0), 1.0)
+
+
+class PWM_PinController(Base_Telemetrix_Instrument):
+    """Drives a PWM capable pin (SSR, MOSFET...) with the hardware PWM of the Arduino."""
+
+    def __init__(self, pin, com_port=None, ip_port=31335, board_factory=None):
+        super().__init__(com_port, ip_port, board_factory)  # Call the parent constructor
+        self.pin = pin
+        self.duty_cycle = 0.0
+        self.writes_issued = 0  # Number of analog_write sent to the board
+        self.writes_suppressed = 0  # Number of redundant writes not sent
+        self._value = None  # Last PWM value written
+
+        logger.debug('Setting pin %s as PWM output.', self.pin)
+        self.board.set_pin_mode_analog_output(self.pin)
+        self.set_duty_cycle(0.0)
+
+    def set_duty_cycle(self, duty_cycle):
+        """Set the duty cycle in [0, 1], values outside being clipped.
+
+        :raises ValueError: If duty_cycle is NaN.
+        """
+        duty_cycle = _clip_duty_cycle(duty_cycle)
+        value = round(duty_cycle * ARDUINO_PWM_MAX)
+        self.duty_cycle = duty_cycle
+        if self.board is None:
+            logger.warning('Cannot set duty cycle: board is not connected.')
+            return
+        if value == self._value:
+            self.writes_suppressed += 1
+            return
+        logger.debug('Setting PWM pin %s to %d/%d.', self.pin, value, ARDUINO_PWM_MAX)
+        self.board.analog_write(self.pin, value)
+        if latency_probes.enabled:
+            latency_probes.record_write()
+        self._value = value
+        self.writes_issued += 1
+
+    def turn_on(self):
+        self.set_duty_cycle(1.0)
+
+    def turn_off(self):
+        self.set_duty_cycle(0.0)
+
+    def is_on(self):
+        return self.duty_cycle > 0
+
+    def get_write_statistics(self):
+        """Counts of the writes sent to the board and of the redundant ones suppressed."""
+        return {'issued': self.writes_issued, 'suppressed': self.writes_suppressed}
+
+
+class TimeProportional_PinController:
+    """
+    Time-proportioning drive of a Digital_PinController, for loads switched by mechanical relays.
+
+    Time is divided in windows of `window` seconds; the pin is on during the first duty_cycle * window
+    seconds of each window, so a relay switches at most twice per window. On or off pulses shorter than
+    `min_pulse` are not produced (the pin then stays on or off for the whole window).
+
+    update() applies the schedule and must be called regularly, either by the control loop or by the
+    internal thread started with start().
+    """
+
+    def __init__(self, pin_controller, window=10.0, min_pulse=0.0):
+        if not isinstance(pin_controller, Digital_PinController):
+            raise TypeError("pin_controller must be an instance of Digital_PinController.")
+        if window <= 0 or not 0 <= min_pulse <= window / 2:
+            raise ValueError("window must be positive and min_pulse in [0, window / 2].")
+        self.pin_controller = pin_controller
+        self.pin = pin_controller.pin
+        self.window = window
+        self.min_pulse = min_pulse
+        self.duty_cycle = 0.0
+        self._on_time = 0.0
+        self._window_start = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def set_duty_cycle(self, duty_cycle):
+        """
+        Set the duty cycle in [0, 1], values outside being clipped. It applies to the current window.
+
+        :raises ValueError: If duty_cycle is NaN.
+        """
+        duty_cycle = _clip_duty_cycle(duty_cycle)
+        on_time = duty_cycle * self.window
+        if on_time < self.min_pulse:
+            on_time = 0.0
+        elif self.window - on_time < self.min_pulse:
+            on_time = self.window
+        with self._lock:
+            self.duty_cycle = duty_cycle
+            self._on_time = on_time
+
+    def update(self, now=None):
+        """Switch the pin according to the position in the current window."""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            if self._window_start is None or now < self._window_start:
+                # First update, or a clock going backwards (another clock, a replay starting over)
+                self._window_start = now
+            elif now - self._window_start >= self.window:
+                # Keep the windows aligned on the first one, whatever the update jitter
+                self._window_start += self.window * ((now - self._window_start) // self.window)
+            state = self._on_time > 0 and now - self._window_start < self._on_time
+        self.pin_controller.set_state(state)
+
+    def turn_on(self):
+        self.set_duty_cycle(1.0)
+        self.update()
+
+    def turn_off(self):
+        self.set_duty_cycle(0.0)
+        self.pin_controller.set_state(False)
+
+    def is_on(self):
+        return self.pin_controller.is_on()
+
+    def start(self, resolution=0.1):
+        """Run update() every `resolution` seconds in a background thread."""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, args=(resolution,), daemon=True,
+                                        name=f'TimeProportional_pin{self.pin}')
+        self._thread.start()
+
+    def is_running(self):
+        """True if the background thread is running."""
+        return self._thread is not None
+
+    def stop(self):
+        """Stop the background thread, if any."""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self, resolution):
+        while not self._stop_event.wait(resolution):
+            self.update()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        self.turn_off()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    PWM_PIN = 5  # PWM capable pin driving an SSR
+    RELAY_PIN = 4  # Digital pin driving a mechanical relay
+
+    with PWM_PinController(PWM_PIN) as pwm_controller, \
+         Digital_PinController(RELAY_PIN) as relay_controller, \
+         TimeProportional_PinController(relay_controller, window=4.0, min_pulse=0.5) as relay_drive:
+        relay_drive.start()
+        try:
+            while True:
+                for duty_cycle in (0.0, 0.25, 0.5, 0.75, 1.0):
+                    logger.info(f"Duty cycle: {duty_cycle:.0%}")
+                    pwm_controller.set_duty_cycle(duty_cycle)
+                    relay_drive.set_duty_cycle(duty_cycle)
+                    time.sleep(8)
+        except KeyboardInterrupt:
+            logger.info("Session ended.")
+        finally:
+            pwm_controller.turn_off()
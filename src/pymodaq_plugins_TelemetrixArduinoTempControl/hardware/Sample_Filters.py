@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Cheap filters for the analog samples received in the telemetrix callback thread.
+
+The filters run in constant time per sample, except the median filter, in O(size) (see MedianFilter): its
+window size is capped by make_filter. Every filter exposes update(value, timestamp=None), returning the
+filtered value, a value attribute holding the last output (None before the first sample) and reset().
+"""
+import math
+import time
+from bisect import insort, bisect_left
+from collections import deque
+
+
+class SampleFilter:
+    """Base class of the sample filters: the identity filter."""
+
+    def __init__(self):
+        self.value = None
+
+    def update(self, value, timestamp=None):
+        self.value = value
+        return self.value
+
+    def reset(self):
+        self.value = None
+
+
+class MovingAverageFilter(SampleFilter):
+    """Average of the last `size` samples, updated with a running sum."""
+
+    def __init__(self, size=4):
+        super().__init__()
+        if size < 1:
+            raise ValueError("Moving average size must be at least 1.")
+        self.size = size
+        self._samples = deque(maxlen=size)
+        self._sum = 0
+
+    def update(self, value, timestamp=None):
+        if len(self._samples) == self.size:
+            self._sum -= self._samples[0]
+        self._samples.append(value)
+        # ADC counts are integers, so the running sum stays exact
+        self._sum += value
+        self.value = self._sum / len(self._samples)
+        return self.value
+
+    def reset(self):
+        super().reset()
+        self._samples.clear()
+        self._sum = 0
+
+
+class ExponentialMovingAverageFilter(SampleFilter):
+    """Exponential moving average with a fixed smoothing factor `alpha` in ]0, 1]."""
+
+    def __init__(self, alpha=0.25):
+        super().__init__()
+        if not 0 < alpha <= 1:
+            raise ValueError("EMA smoothing factor must be in ]0, 1].")
+        self.alpha = alpha
+
+    def update(self, value, timestamp=None):
+        if self.value is None:
+            self.value = float(value)
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+
+class MedianFilter(SampleFilter):
+    """
+    Median of the last `size` samples, kept in a ring buffer and a sorted window.
+
+    Not constant-time: the sorted list insertion and removal move O(size) items per sample. This is a
+    memmove, fast for the small windows used on ADC counts, hence the MAX_WINDOW_SIZE cap of make_filter.
+    """
+
+    def __init__(self, size=5):
+        super().__init__()
+        if size < 1:
+            raise ValueError("Median size must be at least 1.")
+        self.size = size
+        self._samples = deque(maxlen=size)
+        self._sorted = []
+
+    def update(self, value, timestamp=None):
+        if len(self._samples) == self.size:
+            del self._sorted[bisect_left(self._sorted, self._samples[0])]
+        self._samples.append(value)
+        insort(self._sorted, value)
+        n = len(self._sorted)
+        middle = n // 2
+        self.value = self._sorted[middle] if n % 2 else (self._sorted[middle - 1] + self._sorted[middle]) / 2
+        return self.value
+
+    def reset(self):
+        super().reset()
+        self._samples.clear()
+        self._sorted.clear()
+
+
+class LowPassFilter(SampleFilter):
+    """
+    First-order IIR low-pass filter with a time constant in seconds.
+
+    The smoothing factor is derived from the time elapsed since the previous sample, so the response does
+    not depend on the analog report rate. Without a timestamp, time.monotonic() is used.
+    """
+
+    def __init__(self, time_constant=1.0):
+        super().__init__()
+        if time_constant <= 0:
+            raise ValueError("Low-pass time constant must be positive.")
+        self.time_constant = time_constant
+        self._last_time = None
+
+    def update(self, value, timestamp=None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+        if self.value is None:
+            self.value = float(value)
+        else:
+            dt = max(timestamp - self._last_time, 0.0)
+            self.value += (1 - math.exp(-dt / self.time_constant)) * (value - self.value)
+        self._last_time = timestamp
+        return self.value
+
+    def reset(self):
+        super().reset()
+        self._last_time = None
+
+
+# Largest window (`size` argument) of the filters created by make_filter
+MAX_WINDOW_SIZE = 255
+
+# Filters selectable by name, e.g. from configuration parameters
+FILTER_TYPES = {
+    'none': SampleFilter,
+    'moving_average': MovingAverageFilter,
+    'ema': ExponentialMovingAverageFilter,
+    'median': MedianFilter,
+    'low_pass': LowPassFilter,
+}
+
+
+def make_filter(filter_type, **kwargs):
+    """Instantiate a filter from its FILTER_TYPES name and its constructor arguments."""
+    if filter_type not in FILTER_TYPES:
+        raise ValueError(f"Unknown filter type: {filter_type}. Valid types: {list(FILTER_TYPES)}.")
+    if kwargs.get('size', 0) > MAX_WINDOW_SIZE:
+        raise ValueError(f"Filter window size must be at most {MAX_WINDOW_SIZE}, got {kwargs['size']}.")
+    return FILTER_TYPES[filter_type](**kwargs)
@@ -12,6 +12,11 @@ from datetime import datetime
 from thermistor_model import ThermistorModel
 from Thermistor_Reader import ThermistorReader
 from Digital_Output_Controller import Digital_PinController
+from Control_Scheduler import ControlScheduler
+from Time_Series_Buffer import TimeSeriesBuffer
+from Telemetry_Logger import TelemetryWriter, TelemetryReader
+from Live_Plot import LivePlot
+from Analog_Replay import AnalogCapture
 import os
 from colorama import init, Fore
 
@@ -30,6 +35,9 @@ SERIES_RESISTOR_COOLER = 13000   # Series resistor for the cooler thermistor in
 THERMISTOR_25C = 10000           # Resistance of the thermistor at 25°C
 MIN_TIME = 5.0                   # Minimum time interval between pin state changes in seconds
 SLIDE_WINDOW_TIME = 300          # Sliding window time in seconds (5 minutes)
+CONTROL_PERIOD = 0.5             # Period of the control loops in seconds
+BUFFER_CAPACITY = 2 * int(SLIDE_WINDOW_TIME / CONTROL_PERIOD)  # Samples kept in memory per sensor
+PLOT_MAX_FPS = 5.0               # Maximum refresh rate of the live plot
 
 # Define a logger setup function
 def setup_logger(logger_name, log_file, level=logging.DEBUG):
@@ -81,14 +89,6 @@ thR_model = ThermistorModel(file_path, ref_R=THERMISTOR_25C, resistance_col_labe
 logger.info(f"Using a heater thermistor of type {resistance_column}, with ref resistance {THERMISTOR_25C} ohm, and series resistor {SERIES_RESISTOR_HEATER} ohm.")
 logger.info(f"Using a cooler thermistor of type {resistance_column}, with ref resistance {THERMISTOR_25C} ohm, and series resistor {SERIES_RESISTOR_COOLER} ohm.")
 
-# Initialize data lists for plotting (full dataset)
-full_times = {}
-full_temps = {}
-
-# Initialize data lists for real-time sliding window
-sensor_times = {}
-sensor_temps = {}
-
 # Define the sensor configurations (dynamically populated)
 sensors = {
     "heater": {
@@ -118,15 +118,21 @@ for sensor_name, config in sensors.items():
     controller = Digital_PinController(config['digital_pin'])
     sensor_readers_controllers[sensor_name] = (sensor_reader, controller)
 
+# Bounded in-memory time series for the real-time sliding window
+sensor_buffers = {sensor_name: TimeSeriesBuffer(BUFFER_CAPACITY) for sensor_name in sensors}
+
+# Full dataset, recorded as columns in an HDF5 file
+telemetry_file_path = log_file_path.replace(".log", ".h5")
+telemetry = TelemetryWriter(telemetry_file_path)
+
+# Raw analog reports, to replay the session offline (see Analog_Replay)
+capture = AnalogCapture(log_file_path.replace(".log", ".adc"))
+for sensor_reader, _ in sensor_readers_controllers.values():
+    capture.attach(sensor_reader)
+
 last_toggle_times = {sensor_name: 0 for sensor_name in sensors}
 start_time = time.time()
 
-# Generalized method to update the graph for any sensor
-def update_graph(sensor_name, times, temps, line):
-    line.set_data(times, temps)
-    ax.relim()
-    ax.autoscale_view()
-
 # Helper function to convert hex color to colorama-compatible format
 def hex_to_foreground_color(hex_color):
     """Convert hex color code to colorama foreground color."""
@@ -152,70 +158,77 @@ def hex_to_foreground_color(hex_color):
     else:
         return Fore.WHITE
 
+def control_sensor(sensor_name, config):
+    """
+    Read one sensor, record its temperature and apply the threshold control of its digital pin.
+    """
+    reader, controller = sensor_readers_controllers[sensor_name]
+    temp = reader.get_temperature()
+    if temp is not None:
+        current_time = time.time()
+        elapsed_time = current_time - start_time
+
+        # Record the data for the live plot
+        sensor_buffers[sensor_name].append(elapsed_time, temp)
+
+        # Log color formatting using colorama
+        color_code = config['line_color']
+        log_color = hex_to_foreground_color(color_code)
+        logger.info(f"{log_color}{config['name']} Temperature: {temp:.2f}°C")
+
+        # Update control logic for each sensor
+        if current_time - last_toggle_times[sensor_name] >= MIN_TIME:
+            if config['is_heater']:  # If it's a heater
+                if temp < config['temp_threshold'] and controller.is_on():
+                    controller.turn_off()
+                    logger.info(f"{config['name']} OFF")
+                    last_toggle_times[sensor_name] = current_time
+                elif temp >= config['temp_threshold'] and not controller.is_on():
+                    controller.turn_on()
+                    logger.info(f"{config['name']} ON")
+                    last_toggle_times[sensor_name] = current_time
+            else:  # If it's a cooler
+                if temp >= config['temp_threshold'] and controller.is_on():
+                    controller.turn_off()
+                    logger.info(f"{config['name']} OFF")
+                    last_toggle_times[sensor_name] = current_time
+                elif temp < config['temp_threshold'] and not controller.is_on():
+                    controller.turn_on()
+                    logger.info(f"{config['name']} ON")
+                    last_toggle_times[sensor_name] = current_time
+
+        telemetry.append(current_time, sensor_name, reader.get_analog_value(),
+                         reader.calculate_thermistor_resistance(), temp, controller.is_on())
+
 def monitor_temperatures():
     """
     Function to continuously monitor the temperatures, update the graph, and control the heater and cooler.
+
+    Each sensor loop runs on its own deadlines in a ControlScheduler, so the loop period does not drift
+    with the time spent in the loops. The loops run in a background thread, the main thread only
+    redrawing the live plot from the sensor buffers; once the plot is closed, they go on in the main thread.
     """
-    while True:
-        for sensor_name, config in sensors.items():
-            reader, controller = sensor_readers_controllers[sensor_name]
-            temp = reader.get_temperature()
-            if temp is not None:
-                current_time = time.time()
-                elapsed_time = current_time - start_time
-
-                # Update full data
-                full_times.setdefault(sensor_name, []).append(elapsed_time)
-                full_temps.setdefault(sensor_name, []).append(temp)
-
-                # Real-time sliding window data update
-                sensor_times.setdefault(sensor_name, []).append(elapsed_time)
-                sensor_temps.setdefault(sensor_name, []).append(temp)
-
-                if elapsed_time > SLIDE_WINDOW_TIME:
-                    # Remove old data (older than SLIDE_WINDOW_TIME)
-                    sensor_times[sensor_name].pop(0)
-                    sensor_temps[sensor_name].pop(0)
-
-                # Log color formatting using colorama
-                color_code = config['line_color']
-                log_color = hex_to_foreground_color(color_code)
-                logger.info(f"{log_color}{config['name']} Temperature: {temp:.2f}°C")
-
-                # Update control logic for each sensor
-                if current_time - last_toggle_times[sensor_name] >= MIN_TIME:
-                    if config['is_heater']:  # If it's a heater
-                        if temp < config['temp_threshold'] and controller.is_on():
-                            controller.turn_off()
-                            logger.info(f"{config['name']} OFF")
-                            last_toggle_times[sensor_name] = current_time
-                        elif temp >= config['temp_threshold'] and not controller.is_on():
-                            controller.turn_on()
-                            logger.info(f"{config['name']} ON")
-                            last_toggle_times[sensor_name] = current_time
-                    else:  # If it's a cooler
-                        if temp >= config['temp_threshold'] and controller.is_on():
-                            controller.turn_off()
-                            logger.info(f"{config['name']} OFF")
-                            last_toggle_times[sensor_name] = current_time
-                        elif temp < config['temp_threshold'] and not controller.is_on():
-                            controller.turn_on()
-                            logger.info(f"{config['name']} ON")
-                            last_toggle_times[sensor_name] = current_time
-
-
-                # Update the graph for the sensor
-                update_graph(sensor_name, sensor_times[sensor_name], sensor_temps[sensor_name], sensor_lines[sensor_name])
-
-        plt.pause(0.1)
-        time.sleep(0.5)
+    scheduler = ControlScheduler()
+    for sensor_name, config in sensors.items():
+        scheduler.add(lambda now, sensor_name=sensor_name, config=config: control_sensor(sensor_name, config),
+                      CONTROL_PERIOD, name=sensor_name)
+    try:
+        scheduler.start()
+        live_plot.run()
+        logger.info("Plot closed, monitoring goes on.")
+        scheduler.stop()
+        scheduler.run()
+    finally:
+        scheduler.stop()
+        logger.info(f"Plot statistics: {live_plot.frames} frames, {live_plot.full_redraws} full redraws.")
+        for statistics in scheduler.get_statistics():
+            logger.info(f"Loop statistics: {statistics}")
 
 try:
     # Set up live plotting
-    plt.ion()
     fig, ax = plt.subplots()
-    # sensor_lines = {sensor_name: ax.plot([], [], color=config['line_color'], label=f"{config['name']} Temp (°C)")[0] for sensor_name, config in sensors.items()}
-    sensor_lines = {sensor_name: ax.plot([], [], color=config['line_color'], marker='+', markersize=6, label=f"{config['name']} Temp (°C)")[0] for sensor_name, config in sensors.items()}
+    live_plot = LivePlot(ax, window=SLIDE_WINDOW_TIME, max_fps=PLOT_MAX_FPS)
+    sensor_lines = {sensor_name: live_plot.add_line(sensor_buffers[sensor_name], color=config['line_color'], marker='+', markersize=6, label=f"{config['name']} Temp (°C)") for sensor_name, config in sensors.items()}
     
     ax.set_title("Temperature Monitoring")
     ax.set_xlabel("Time (s)")
@@ -242,10 +255,14 @@ finally:
 
     logger.info("Script exited. All devices are turned off.")
 
-    # Save the plot with the full dataset
+    # Save the plot with the full dataset, read back from the telemetry file
+    capture.close()
+    telemetry.close()
+    with TelemetryReader(telemetry_file_path) as telemetry_reader:
+        full_data = {sensor_name: telemetry_reader.read(channel=sensor_name) for sensor_name in sensors}
     full_fig, full_ax = plt.subplots()
     full_sensor_lines = {
-        sensor_name: full_ax.plot(full_times[sensor_name], full_temps[sensor_name], color=config['line_color'], marker='+', markersize=6, label=f"{config['name']} Temp (°C)")[0]
+        sensor_name: full_ax.plot(full_data[sensor_name]['time'] - start_time, full_data[sensor_name]['temperature'], color=config['line_color'], marker='+', markersize=6, label=f"{config['name']} Temp (°C)")[0]
         for sensor_name, config in sensors.items()
     }
     full_ax.set_title("Full Temperature Data")
@@ -261,5 +278,4 @@ finally:
     graph_file_path = log_file_path.replace(".log", ".png")
     full_fig.savefig(graph_file_path)
     logger.info(f"Graph saved at {graph_file_path}.")
-    plt.ioff()
     plt.show()
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+Simulated Telemetrix board driving a lumped thermal model, to run the instruments and controllers without
+hardware.
+
+SimulatedTelemetrix implements the part of the telemetrix API used by the instruments (pin modes, analog
+callbacks, digital and PWM writes, scan interval). Heaters and coolers wired to its output pins heat or
+cool ThermalZones (lumped heat capacity with a thermal resistance to ambient), and the thermistors wired to
+its analog pins report the ADC counts given by the divider equations, with optional noise.
+
+The board runs on a simulated clock: advance() and run() go as fast as the computation allows, so that days
+of controller behavior take seconds, while start() follows the wall clock (optionally accelerated).
+Analog reports carry simulated time stamps, and run() paces a ControlScheduler built with clock=board.clock.
+
+Instruments use it when given its open method as board factory::
+
+    board = SimulatedTelemetrix()
+    board.add_zone('heater', heat_capacity=200.0, thermal_resistance=2.0)
+    board.add_thermistor(0, 'heater', thR_model, series_resistor=13000, series_mode='VCC_R_Rth_GND')
+    board.add_actuator(4, 'heater', power=20.0)
+    reader = ThermistorReader(0, thR_model, series_resistor=13000, series_mode='VCC_R_Rth_GND',
+                              board_factory=board.open)
+
+Standalone scripts may rather select it for all the instruments of the process with use_simulated_board(board).
+"""
+import math
+import time
+import random
+import logging
+import threading
+
+from telemetrix.private_constants import PrivateConstants
+
+from Base_Telemetrix_Instrument import Base_Telemetrix_Instrument
+from Thermistor_Reader import VCC, ARDUINO_ANALOG_MAX, SERIES_MODES
+from Proportional_Output_Controller import ARDUINO_PWM_MAX
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SCAN_INTERVAL = 19  # Analog scan interval of the Telemetrix4Arduino firmware at startup, in ms
+
+
+class ThermalZone:
+    """
+    Lumped-capacitance thermal zone: heat_capacity * dT/dt = power - (T - ambient) / thermal_resistance.
+
+    :param heat_capacity: Heat capacity in J/K.
+    :param thermal_resistance: Thermal resistance to ambient in K/W.
+    :param ambient: Ambient temperature in °C.
+    :param temperature: Initial temperature in °C, ambient by default.
+    """
+
+    def __init__(self, heat_capacity=100.0, thermal_resistance=2.0, ambient=20.0, temperature=None):
+        if heat_capacity <= 0 or thermal_resistance <= 0:
+            raise ValueError("heat_capacity and thermal_resistance must be positive.")
+        self.heat_capacity = heat_capacity
+        self.thermal_resistance = thermal_resistance
+        self.ambient = ambient
+        self.temperature = ambient if temperature is None else temperature
+        self.power = 0.0  # Net power applied by the actuators, in W
+
+    @property
+    def time_constant(self):
+        return self.heat_capacity * self.thermal_resistance
+
+    def step(self, dt):
+        """Advance by dt seconds, the power being constant (exact solution, stable for any dt)."""
+        equilibrium = self.ambient + self.power * self.thermal_resistance
+        self.temperature = equilibrium + (self.temperature - equilibrium) * math.exp(-dt / self.time_constant)
+
+
+class SimulatedThermistor:
+    """Thermistor of a ThermalZone read through a divider on an analog pin."""
+
+    def __init__(self, zone, thR_model, series_resistor, series_mode='VCC_Rth_R_GND', noise=0.0):
+        if series_mode not in SERIES_MODES:
+            raise ValueError(f"Unknown series mode: {series_mode}")
+        self.zone = zone
+        self.thR_model = thR_model
+        self.series_resistor = series_resistor
+        self.series_mode = series_mode
+        self.noise = noise  # Standard deviation of the ADC noise, in counts
+
+    def read(self, rng):
+        """ADC count for the current temperature of the zone."""
+        temperature = min(max(self.zone.temperature, self.thR_model.min_T), self.thR_model.max_T)
+        resistance = self.thR_model.get_resistance(temperature)
+        if self.series_mode == 'VCC_Rth_R_GND':
+            voltage = VCC * self.series_resistor / (self.series_resistor + resistance)
+        else:
+            voltage = VCC * resistance / (self.series_resistor + resistance)
+        count = voltage / VCC * ARDUINO_ANALOG_MAX
+        if self.noise:
+            count += rng.gauss(0.0, self.noise)
+        return min(max(int(round(count)), 0), ARDUINO_ANALOG_MAX)
+
+
+class SimulatedTelemetrix:
+    """
+    Stand-in for telemetrix.Telemetrix, coupled to ThermalZones.
+
+    :param com_port: Ignored, for compatibility with the Telemetrix constructor.
+    :param ip_port: Ignored, for compatibility with the Telemetrix constructor.
+    :param seed: Seed of the ADC noise generator, for reproducible runs.
+    """
+
+    wall_clock_time_stamps = False  # The analog reports are stamped with the simulated time
+
+    def __init__(self, com_port=None, ip_port=None, seed=None):
+        self.zones = {}
+        self._thermistors = {}  # Analog pin -> SimulatedThermistor
+        self._actuators = {}  # Output pin -> (zone, power, active_low)
+        self._analog_callbacks = {}  # Analog pin -> (callback, differential)
+        self._last_reports = {}  # Analog pin -> last count reported
+        self._outputs = {}  # Output pin -> level in [0, 1]
+        self._rng = random.Random(seed)
+        self._lock = threading.RLock()
+        self.time = 0.0  # Simulated time in s
+        self.epoch = time.time()  # Time stamp of the simulated time 0, for the analog reports
+        self.scan_interval = DEFAULT_SCAN_INTERVAL / 1000
+        self._next_scan = 0.0
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    # Simulation setup
+
+    def add_zone(self, name, **kwargs):
+        """Add a ThermalZone (see its parameters)."""
+        self.zones[name] = ThermalZone(**kwargs)
+        return self.zones[name]
+
+    def add_thermistor(self, pin, zone, thR_model, series_resistor, series_mode='VCC_Rth_R_GND', noise=0.0):
+        """Wire a thermistor of a zone to an analog pin (see SimulatedThermistor)."""
+        self._thermistors[pin] = SimulatedThermistor(self.zones[zone], thR_model, series_resistor, series_mode,
+                                                     noise)
+
+    def add_actuator(self, pin, zone, power, active_low=False):
+        """
+        Wire a heater (power > 0, in W) or a cooler (power < 0) of a zone to an output pin, driven by
+        digital_write (full power when on) or analog_write (power scaled by the duty cycle).
+
+        :param active_low: If True, the actuator is on when the pin is low (e.g. relay modules).
+        """
+        self._actuators[pin] = (self.zones[zone], power, active_low)
+        self._outputs.setdefault(pin, 0.0)
+        self._update_power()
+
+    def _update_power(self):
+        for zone in self.zones.values():
+            zone.power = 0.0
+        for pin, (zone, power, active_low) in self._actuators.items():
+            level = self._outputs.get(pin, 0.0)
+            zone.power += power * (1.0 - level if active_low else level)
+
+    # Telemetrix API
+
+    def set_pin_mode_analog_input(self, pin, differential=0, callback=None):
+        with self._lock:
+            self._analog_callbacks[pin] = (callback, differential)
+            self._last_reports.pop(pin, None)
+
+    def set_pin_mode_digital_output(self, pin):
+        with self._lock:
+            self._outputs.setdefault(pin, 0.0)
+
+    def set_pin_mode_analog_output(self, pin):
+        self.set_pin_mode_digital_output(pin)
+
+    def set_analog_scan_interval(self, interval):
+        if not 0 <= interval <= 255:
+            raise RuntimeError('Analog interval must be between 0 and 255')
+        with self._lock:
+            self.scan_interval = interval / 1000
+
+    def digital_write(self, pin, value):
+        with self._lock:
+            self._outputs[pin] = 1.0 if value else 0.0
+            self._update_power()
+
+    def analog_write(self, pin, value):
+        with self._lock:
+            self._outputs[pin] = min(max(value / ARDUINO_PWM_MAX, 0.0), 1.0)
+            self._update_power()
+
+    def shutdown(self):
+        """
+        Called by the connection pool when the last instrument using the board disconnects. The simulation
+        belongs to the code that created the board, which may still hold it or connect instruments again: its
+        background thread keeps running until that code calls stop().
+        """
+
+    def open(self, com_port=None, ip_port=None):
+        """Board factory returning this board whatever the port, for the board_factory of the instruments."""
+        return self
+
+    # Simulated time
+
+    def clock(self):
+        """Simulated time in s, e.g. the clock of a ControlScheduler paced by run()."""
+        return self.time
+
+    def _advance_to(self, target):
+        """Integrate the zones up to the simulated time `target`, reporting the analog scans on the way."""
+        while True:
+            with self._lock:
+                scan = self._next_scan <= target
+                next_time = self._next_scan if scan else target
+                dt = next_time - self.time
+                if dt > 0:
+                    for zone in self.zones.values():
+                        zone.step(dt)
+                    self.time = next_time
+                if not scan:
+                    return
+                # A null scan interval is approximated by 1 ms, to keep the simulation finite
+                self._next_scan += max(self.scan_interval, 1e-3)
+                reports = self._scan()
+            for callback, data in reports:  # Outside of the lock, the callbacks may write outputs
+                callback(data)
+
+    def _scan(self):
+        reports = []
+        for pin, (callback, differential) in self._analog_callbacks.items():
+            thermistor = self._thermistors.get(pin)
+            if callback is None or thermistor is None:
+                continue
+            count = thermistor.read(self._rng)
+            last = self._last_reports.get(pin)
+            if differential and last is not None and abs(count - last) < differential:
+                continue
+            self._last_reports[pin] = count
+            reports.append((callback, [PrivateConstants.ANALOG_REPORT, pin, count, self.epoch + self.time]))
+        return reports
+
+    def advance(self, duration):
+        """Advance the simulation by `duration` seconds, as fast as possible."""
+        self._advance_to(self.time + duration)
+
+    def run(self, duration, scheduler=None):
+        """
+        Advance the simulation by `duration` seconds as fast as possible, running the loops of a
+        ControlScheduler (created with clock=board.clock) on their simulated deadlines.
+        """
+        end = self.time + duration
+        self._advance_to(self.time)  # Scans due now come before the loops
+        while self.time < end:
+            target = end
+            if scheduler is not None:
+                wait = scheduler.run_pending()
+                if wait is not None:
+                    target = min(target, self.time + wait)
+            self._advance_to(target)
+        if scheduler is not None:
+            scheduler.run_pending()
+
+    def start(self, speed=1.0, resolution=0.01):
+        """Follow the wall clock, `speed` times faster, in a background thread."""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run_realtime, args=(speed, resolution), daemon=True,
+                                        name='SimulatedTelemetrix')
+        self._thread.start()
+
+    def _run_realtime(self, speed, resolution):
+        reference_wall, reference_time = time.monotonic(), self.time
+        while not self._stop_event.wait(resolution):
+            self._advance_to(reference_time + (time.monotonic() - reference_wall) * speed)
+
+    def stop(self):
+        """Stop the background thread, if any."""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+
+def use_simulated_board(board=None):
+    """
+    Make the instruments created without board_factory open `board` (a new SimulatedTelemetrix by default)
+    instead of a real board, whatever their com_port and ip_port, in the whole process. Return the board.
+
+    For standalone scripts: code sharing the process with other instruments passes board.open as their
+    board_factory instead.
+    """
+    board = SimulatedTelemetrix() if board is None else board
+    Base_Telemetrix_Instrument.set_board_factory(board.open)
+    return board
+
+
+if __name__ == '__main__':
+    from thermistor_model import ThermistorModel
+    from Thermistor_Reader import ThermistorReader
+    from Proportional_Output_Controller import PWM_PinController
+    from Temperature_Controller import PIDTemperatureController, ControllerType
+    from Control_Scheduler import ControlScheduler
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.WARNING)
+    SIMULATED_TIME = 24 * 3600  # One day
+
+    thR_model = ThermistorModel("../../../Thermistor_R_vs_T.csv", ref_R=10000, resistance_col_label='Type 8016')
+    board = SimulatedTelemetrix(seed=0)
+    board.add_zone('block', heat_capacity=500.0, thermal_resistance=2.0, ambient=20.0)
+    board.add_thermistor(0, 'block', thR_model, series_resistor=13000, series_mode='VCC_R_Rth_GND', noise=0.5)
+    board.add_actuator(5, 'block', power=30.0)
+    use_simulated_board(board)
+
+    with ThermistorReader(0, thR_model, series_resistor=13000, series_mode='VCC_R_Rth_GND',
+                          scan_interval=100) as reader, PWM_PinController(5) as heater:
+        pid = PIDTemperatureController(reader, heater, 50.0, ControllerType.HEATER, kp=0.1, ki=0.002,
+                                       history_size=0)
+        scheduler = ControlScheduler(clock=board.clock)
+        scheduler.add(pid, 1.0)
+        start = time.perf_counter()
+        board.run(SIMULATED_TIME, scheduler)
+        elapsed = time.perf_counter() - start
+        print(f"Simulated {SIMULATED_TIME / 3600:.0f} h in {elapsed:.1f} s ({SIMULATED_TIME / elapsed:.0f}x real "
+              f"time): temperature {board.zones['block'].temperature:.2f}°C, output {pid.output:.0%}.")
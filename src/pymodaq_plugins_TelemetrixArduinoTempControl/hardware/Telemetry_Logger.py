@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar telemetry of the temperature channels, stored in a chunked HDF5 table (PyTables).
+
+Each record holds the time, the channel name, the (filtered) raw ADC count, the thermistor resistance, the
+temperature and the output state or duty cycle of the channel. Records are accumulated in a NumPy batch and
+appended to the file in one operation, when the batch is full or every `flush_interval` seconds, so the data
+written before a crash is kept. The time column is indexed when the file is closed, so time ranges are read
+back without scanning the whole file.
+"""
+import time
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_NAME_SIZE = 16  # Maximum length of the channel names, in bytes
+
+TELEMETRY_DTYPE = np.dtype([
+    ('time', '<f8'),            # Time stamp, in s (time.time() unless given otherwise)
+    ('channel', f'S{CHANNEL_NAME_SIZE}'),
+    ('raw_adc', '<f8'),         # Filtered ADC count (fractional when averaged)
+    ('resistance', '<f8'),      # Thermistor resistance, in ohm
+    ('temperature', '<f8'),     # Temperature, in °C
+    ('output', '<f8'),          # Output state (0/1) or duty cycle in [0, 1]
+])
+
+TELEMETRY_TABLE = '/telemetry'
+
+
+def _undefined_to_nan(value):
+    return np.nan if value is None else value
+
+
+class TelemetryWriter:
+    """
+    Streaming writer of telemetry records to an HDF5 file.
+
+    append() may be called from several threads (control loops, telemetrix callbacks).
+
+    :param file_path: HDF5 file, overwritten.
+    :param batch_size: Number of records appended to the file at once, also the HDF5 chunk size.
+    :param flush_interval: Maximum time in s between two writes to the file, checked on append.
+    :param complevel: Compression level (0 to 9) of the Blosc compressor, 0 to disable it.
+    """
+
+    def __init__(self, file_path, batch_size=512, flush_interval=5.0, complevel=5):
+        import tables  # Only needed when telemetry is recorded
+
+        self.file_path = file_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._batch = np.zeros(batch_size, dtype=TELEMETRY_DTYPE)
+        self._count = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        filters = tables.Filters(complevel=complevel, complib='blosc') if complevel else None
+        self._file = tables.open_file(file_path, mode='w', title='Temperature telemetry')
+        self._table = self._file.create_table('/', TELEMETRY_TABLE.lstrip('/'), description=TELEMETRY_DTYPE,
+                                              filters=filters, chunkshape=(batch_size,))
+        self._table.autoindex = False  # Updating the index on each write would dominate its cost
+        self._channel_names = {}  # Validated channel names, encoded
+        self.records_written = 0
+
+    def append(self, timestamp, channel, raw_adc=None, resistance=None, temperature=None, output=None):
+        """
+        Add a record, undefined values (None) being stored as NaN.
+
+        :param channel: Channel name, at most CHANNEL_NAME_SIZE bytes in UTF-8.
+        """
+        name = self._channel_names.get(channel)
+        if name is None:
+            name = self._encode_channel(channel)
+        with self._lock:
+            if not self._file.isopen:
+                raise ValueError(f"Cannot append to the closed telemetry file {self.file_path}.")
+            self._batch[self._count] = (timestamp, name, _undefined_to_nan(raw_adc),
+                                        _undefined_to_nan(resistance), _undefined_to_nan(temperature),
+                                        _undefined_to_nan(output))
+            self._count += 1
+            if self._count == self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._write_batch()
+
+    def _encode_channel(self, channel):
+        name = channel.encode()
+        if len(name) > CHANNEL_NAME_SIZE:
+            raise ValueError(f"Channel name {channel!r} is longer than {CHANNEL_NAME_SIZE} bytes.")
+        self._channel_names[channel] = name
+        return name
+
+    def append_reader(self, channel, thermistor_reader, output=None, timestamp=None):
+        """Add a record with the current values of a ThermistorReader."""
+        self.append(time.time() if timestamp is None else timestamp, channel,
+                    thermistor_reader.get_analog_value(), thermistor_reader.calculate_thermistor_resistance(),
+                    thermistor_reader.get_temperature(), output)
+
+    def _write_batch(self):
+        if self._count:
+            self._table.append(self._batch[:self._count])
+            self._table.flush()
+            self.records_written += self._count
+            self._count = 0
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        """Write the pending records to the file."""
+        with self._lock:
+            if self._file.isopen:
+                self._write_batch()
+
+    def close(self):
+        with self._lock:
+            if not self._file.isopen:
+                return
+            self._write_batch()
+            self._table.cols.time.create_csindex()
+            self._file.close()
+        logger.info(f"Telemetry saved in {self.file_path} ({self.records_written} records).")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class TelemetryReader:
+    """
+    Reader of the files written by TelemetryWriter.
+
+    :param file_path: HDF5 telemetry file.
+    """
+
+    def __init__(self, file_path):
+        import tables
+
+        self.file_path = file_path
+        self._file = tables.open_file(file_path, mode='r')
+        self._table = self._file.get_node(TELEMETRY_TABLE)
+
+    def __len__(self):
+        return self._table.nrows
+
+    @property
+    def channels(self):
+        """Names of the channels present in the file."""
+        return sorted(channel.decode() for channel in np.unique(self._table.col('channel')))
+
+    def read(self, start=None, stop=None, channel=None):
+        """
+        Records with start <= time < stop, of all channels or of one, as a NumPy structured array.
+
+        Columns are accessed by name, e.g. records['temperature'].
+        """
+        conditions = []
+        if start is not None:
+            conditions.append('(time >= start)')
+        if stop is not None:
+            conditions.append('(time < stop)')
+        if channel is not None:
+            conditions.append('(channel == name)')
+        if not conditions:
+            return self._table.read()
+        condvars = {'start': start, 'stop': stop, 'name': None if channel is None else channel.encode()}
+        return self._table.read_where(' & '.join(conditions), condvars=condvars)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == '__main__':
+    import sys
+    import matplotlib.pyplot as plt
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    # Plot the temperatures of a telemetry file, e.g. written by Simple_Thermostat
+    with TelemetryReader(sys.argv[1]) as telemetry:
+        fig, ax = plt.subplots()
+        for channel in telemetry.channels:
+            records = telemetry.read(channel=channel)
+            ax.plot(records['time'] - records['time'][0], records['temperature'], label=channel)
+        ax.set_xlabel("Time (s)")
+        ax.set_ylabel("Temperature (°C)")
+        ax.legend()
+        ax.grid(True)
+        plt.show()
@@ -5,31 +5,54 @@ Created on Thu Nov  7 15:48:08 2024
 @author: gaignebet
 """
 
+import math
 import time
 import logging
+import numpy as np
 from datetime import datetime
 from thermistor_model import ThermistorModel
 from Thermistor_Reader import ThermistorReader
 from Digital_Output_Controller import Digital_PinController
+from Proportional_Output_Controller import PWM_PinController, TimeProportional_PinController
+from Latency_Probes import latency_probes
+from Instrument_Logging import SampledDebugLogger
 import os
 from enum import Enum
 
+logger = logging.getLogger(__name__)
+control_debug = SampledDebugLogger(logger)  # Per-step debug messages, see Instrument_Logging
+
 # Enum to define whether the controller is a HEATER or COOLER
 class ControllerType(Enum):
     HEATER = "Heater"
     COOLER = "Cooler"
 
+# Outputs accepting duty-cycle commands
+PROPORTIONAL_OUTPUTS = (PWM_PinController, TimeProportional_PinController)
+
 # Base class for temperature control (Heater and Cooler)
 class TemperatureController:
     heater_counter = 1  # Class variable to track heater instance count
     cooler_counter = 1  # Class variable to track cooler instance count
 
-    def __init__(self, thermistor_reader, controller, threshold, controller_type, name=None):
+    def __init__(self, thermistor_reader, controller, threshold, controller_type, name=None, proportional_band=None):
+        """
+        :param controller: Digital_PinController driven on/off, or a proportional output (PWM_PinController,
+            TimeProportional_PinController).
+        :param proportional_band: With a proportional output, temperature span in °C over which the duty
+            cycle goes from 0 to 1 when moving away from the threshold. None for on/off control.
+        """
         # Validate the instrument instances
         if not isinstance(thermistor_reader, ThermistorReader):
             raise TypeError("thermistor_reader must be an instance of ThermistorReader.")
-        if not isinstance(controller, Digital_PinController):
-            raise TypeError("controller must be an instance of Digital_PinController.")
+        if not isinstance(controller, (Digital_PinController,) + PROPORTIONAL_OUTPUTS):
+            raise TypeError("controller must be an instance of Digital_PinController, PWM_PinController "
+                            "or TimeProportional_PinController.")
+        if proportional_band is not None:
+            if not isinstance(controller, PROPORTIONAL_OUTPUTS):
+                raise TypeError("proportional_band requires a PWM_PinController or TimeProportional_PinController.")
+            if proportional_band <= 0:
+                raise ValueError("proportional_band must be positive.")
         
         # Assign a default name if none is provided
         if not name:
@@ -45,7 +68,10 @@ class TemperatureController:
         self.controller = controller
         self.threshold = threshold
         self.controller_type = controller_type
+        self.proportional_band = proportional_band
         self.last_toggle_time = 0
+        self._sample_subscription = None
+        self.event_min_time = None  # min_time of the event-driven control, None when polled
 
     def __enter__(self):
         # Initialize necessary resources
@@ -56,40 +82,258 @@ class TemperatureController:
     def __exit__(self, exc_type, exc_value, traceback):
         # Handle cleanup when exiting the context
         logger.info(f"Exiting {self.name}")
+        self.stop_event_driven()
         self.controller.turn_off()  # Ensure the controller is off when exiting the context
         if exc_type:
             logger.error(f"An error occurred in {self.name}: {exc_value}")
         return True  # Suppress exceptions
 
+    def start_event_driven(self, min_time=0.0):
+        """
+        Run control() on every new sample of the thermistor reader, from its callback thread, instead of
+        polling. The loop latency is then the analog report interval.
+        """
+        if self._sample_subscription is not None:
+            return
+        self.event_min_time = min_time
+        self._sample_subscription = lambda temperature: self.control(time.monotonic(), min_time)
+        self.thermistor_reader.subscribe(self._sample_subscription)
+
+    def stop_event_driven(self):
+        if self._sample_subscription is not None:
+            self.thermistor_reader.unsubscribe(self._sample_subscription)
+            self._sample_subscription = None
+            self.event_min_time = None
+
+    @property
+    def event_driven(self):
+        return self._sample_subscription is not None
+
     def control(self, current_time, min_time):
         temperature = self.thermistor_reader.get_temperature()
-        if temperature is not None:
-            logger.info(f"{self.name} - Temperature: {temperature:.2f}°C")
-            
-            if current_time - self.last_toggle_time >= min_time:
+        if temperature is not None and not math.isnan(temperature):
+            if latency_probes.enabled:
+                latency_probes.set_origin(self.thermistor_reader.sample_received_time)
+            if control_debug.enabled:
+                control_debug("%s - Temperature: %.2f°C", self.name, temperature, temperature=temperature)
+
+            if self.proportional_band is not None:
+                self._proportional_control(temperature)
+            elif current_time - self.last_toggle_time >= min_time:
                 # Control logic based on simple threshold
                 if self.controller_type == ControllerType.HEATER:
                     if temperature < self.threshold and not self.controller.is_on():  # Heater on when temperature is below threshold
                         self.controller.turn_on()
-                        logger.info(f"{self.name} - Heater ON")
+                        logger.debug("%s - Heater ON", self.name)
                         self.last_toggle_time = current_time
                     elif temperature >= self.threshold and self.controller.is_on():  # Heater off when temperature is above threshold
                         self.controller.turn_off()
-                        logger.info(f"{self.name} - Heater OFF")
+                        logger.debug("%s - Heater OFF", self.name)
                         self.last_toggle_time = current_time
 
                 elif self.controller_type == ControllerType.COOLER:
                     if temperature > self.threshold and not self.controller.is_on():  # Cooler on when temperature is above threshold
                         self.controller.turn_on()
-                        logger.info(f"{self.name} - Cooler ON")
+                        logger.debug("%s - Cooler ON", self.name)
                         self.last_toggle_time = current_time
                     elif temperature <= self.threshold and self.controller.is_on():  # Cooler off when temperature is below threshold
                         self.controller.turn_off()
-                        logger.info(f"{self.name} - Cooler OFF")
+                        logger.debug("%s - Cooler OFF", self.name)
                         self.last_toggle_time = current_time
 
+        self._update_output_schedule(current_time)
+        if latency_probes.enabled:
+            latency_probes.clear_origin()
+
+    def _update_output_schedule(self, now):
+        if isinstance(self.controller, TimeProportional_PinController) and not self.controller.is_running():
+            self.controller.update(now)  # Time-proportioning paced by the control loop, on its clock
+
+    def _proportional_control(self, temperature):
+        """Set the output duty cycle proportionally to the distance to the threshold."""
+        error = self.threshold - temperature
+        if self.controller_type == ControllerType.COOLER:
+            error = -error
+        duty_cycle = min(max(error / self.proportional_band, 0.0), 1.0)
+        self.controller.set_duty_cycle(duty_cycle)
+        if control_debug.enabled:
+            control_debug("%s - Duty cycle %.0f%%", self.name, 100 * duty_cycle, duty_cycle=duty_cycle)
+
+
+# Anti-windup strategies of the PID controller
+ANTI_WINDUP_MODES = ('back-calculation', 'clamping')
+
+# Fields of the PID controller history
+PID_HISTORY_DTYPE = np.dtype([('time', float), ('temperature', float), ('setpoint', float), ('output', float),
+                              ('p', float), ('i', float), ('d', float)])
+
+
+class PIDTemperatureController(TemperatureController):
+    """
+    PID temperature regulation driving a proportional output (PWM_PinController or TimeProportional_PinController).
+
+    The derivative acts on the low-pass filtered measurement (no derivative kick on setpoint changes), the
+    output is saturated to output_limits, and the integral is protected against windup either by
+    back-calculation or by conditional integration (clamping). Setpoint changes are bumpless: the integral
+    absorbs the jump of the proportional term. The last history_size control steps are kept in a
+    preallocated ring buffer (see get_history).
+    """
+
+    def __init__(self, thermistor_reader, controller, setpoint, controller_type, kp, ki=0.0, kd=0.0, name=None,
+                 output_limits=(0.0, 1.0), anti_windup='back-calculation', tracking_time=None,
+                 derivative_time_constant=None, history_size=1000):
+        """
+        :param setpoint: Target temperature in °C.
+        :param kp: Proportional gain, in output units per °C (the output being a duty cycle).
+        :param ki: Integral gain, in output units per °C.s.
+        :param kd: Derivative gain, in output units.s per °C.
+        :param output_limits: (min, max) output, within [0, 1].
+        :param anti_windup: One of ANTI_WINDUP_MODES.
+        :param tracking_time: Back-calculation time constant in s, by default sqrt(Ti * Td) or Ti without
+            derivative action (Ti = kp / ki, Td = kd / kp).
+        :param derivative_time_constant: Time constant in s of the derivative low-pass filter, by default Td / 10.
+        :param history_size: Number of control steps kept in the history.
+        """
+        if not isinstance(controller, PROPORTIONAL_OUTPUTS):
+            raise TypeError("controller must be an instance of PWM_PinController or TimeProportional_PinController.")
+        if anti_windup not in ANTI_WINDUP_MODES:
+            raise ValueError(f"Unknown anti-windup mode: {anti_windup}. Valid modes: {ANTI_WINDUP_MODES}.")
+        if not 0.0 <= output_limits[0] < output_limits[1] <= 1.0:
+            raise ValueError("output_limits must be an increasing pair within [0, 1].")
+        super().__init__(thermistor_reader, controller, setpoint, controller_type, name)
+
+        self.output_limits = output_limits
+        self.anti_windup = anti_windup
+        self.set_gains(kp, ki, kd, tracking_time, derivative_time_constant)
+
+        self._history = np.zeros(history_size, dtype=PID_HISTORY_DTYPE)
+        self._history_index = 0
+        self._history_count = 0
+        self.reset()
+
+    def set_gains(self, kp, ki=0.0, kd=0.0, tracking_time=None, derivative_time_constant=None):
+        """
+        Change the gains, recomputing the time constants derived from them unless given (see __init__).
+
+        Not thread-safe with control(): call it from the control thread or under the lock serializing the
+        control steps.
+
+        :raises ValueError: If a gain is negative or not finite (the controller direction is given by its
+            controller_type, not by the sign of the gains).
+        """
+        for gain_name, gain in (('kp', kp), ('ki', ki), ('kd', kd)):
+            if not 0 <= gain < math.inf:
+                raise ValueError(f"{gain_name} must be positive and finite, got {gain}.")
+        if tracking_time is None and ki > 0:
+            integral_time = kp / ki if kp > 0 else 1.0
+            tracking_time = np.sqrt(integral_time * kd / kp) if kd > 0 and kp > 0 else integral_time
+        if derivative_time_constant is None:
+            derivative_time_constant = kd / kp / 10 if kp > 0 else 0.0
+        self.kp, self.ki, self.kd = kp, ki, kd
+        self.tracking_time = tracking_time
+        self.derivative_time_constant = derivative_time_constant
+
+    @property
+    def setpoint(self):
+        return self.threshold
+
+    @setpoint.setter
+    def setpoint(self, value):
+        self.set_setpoint(value)
+
+    def set_setpoint(self, setpoint, bumpless=True):
+        """Change the setpoint, compensating the proportional jump in the integral if bumpless."""
+        if bumpless and self._last_temperature is not None:
+            self._integral += self.kp * self._direction * (self.threshold - setpoint)
+            self._integral = min(max(self._integral, self.output_limits[0]), self.output_limits[1])
+        self.threshold = setpoint
+
+    @property
+    def _direction(self):
+        return 1.0 if self.controller_type == ControllerType.HEATER else -1.0
+
+    def reset(self, output=None):
+        """Reset the controller state, starting from the given output (the lower limit by default)."""
+        self._integral = self.output_limits[0] if output is None else \
+            min(max(output, self.output_limits[0]), self.output_limits[1])
+        self._last_time = None
+        self._last_temperature = None
+        self._derivative = 0.0
+        self.output = self._integral
+
+    def control(self, current_time=None, min_time=None):
+        """
+        Compute and apply a new output from the current temperature.
+
+        :param current_time: Time in s of the control step, time.monotonic() by default.
+        :param min_time: Unused, kept for compatibility with TemperatureController.control.
+        :return: The applied output, or None if the temperature is undefined or NaN (thermistor out of the
+            model domain), the output being then left unchanged.
+        """
+        now = time.monotonic() if current_time is None else current_time
+        temperature = self.thermistor_reader.get_temperature()
+        if temperature is None or math.isnan(temperature):
+            self._update_output_schedule(now)
+            return None
+
+        direction = self._direction
+        error = direction * (self.threshold - temperature)
+        dt = 0.0 if self._last_time is None else now - self._last_time
+
+        if dt > 0:
+            # Derivative on the measurement, low-pass filtered
+            raw_derivative = -direction * (temperature - self._last_temperature) / dt
+            alpha = dt / (self.derivative_time_constant + dt)
+            self._derivative += alpha * (raw_derivative - self._derivative)
+
+        p_term = self.kp * error
+        d_term = self.kd * self._derivative
+        low, high = self.output_limits
+
+        if dt > 0 and self.ki != 0:
+            integral = self._integral + self.ki * error * dt
+            unsaturated = p_term + integral + d_term
+            saturated = min(max(unsaturated, low), high)
+            if self.anti_windup == 'back-calculation':
+                integral += (saturated - unsaturated) * dt / self.tracking_time
+            elif unsaturated != saturated and (unsaturated > high) == (error > 0):
+                integral = self._integral  # Clamping: no integration further into saturation
+            self._integral = min(max(integral, low), high)
+
+        output = min(max(p_term + self._integral + d_term, low), high)
+        if latency_probes.enabled:
+            latency_probes.set_origin(self.thermistor_reader.sample_received_time)
+        self.controller.set_duty_cycle(output)
+        self._update_output_schedule(now)
+        if latency_probes.enabled:
+            latency_probes.clear_origin()
+
+        self.output = output
+        self._last_time = now
+        self._last_temperature = temperature
+        self._record(now, temperature, output, p_term, self._integral, d_term)
+        if control_debug.enabled:
+            control_debug("%s - Temperature: %.2f°C, output %.0f%%", self.name, temperature, 100 * output,
+                          temperature=temperature, output=output)
+        return output
+
+    def _record(self, now, temperature, output, p_term, i_term, d_term):
+        if len(self._history) == 0:
+            return
+        self._history[self._history_index] = (now, temperature, self.threshold, output, p_term, i_term, d_term)
+        self._history_index = (self._history_index + 1) % len(self._history)
+        self._history_count = min(self._history_count + 1, len(self._history))
+
+    def get_history(self):
+        """Copy of the recorded control steps, oldest first, as a structured array (see PID_HISTORY_DTYPE)."""
+        if self._history_count < len(self._history):
+            return self._history[:self._history_count].copy()
+        return np.roll(self._history, -self._history_index)
+
 if __name__ == '__main__': 
     
+    from Control_Scheduler import ControlScheduler
+
     # Define constants 
     THERMISTOR_PIN_HEATER = 4        # Analog pin for the heater thermistor
     THERMISTOR_PIN_COOLER = 5        # Analog pin for the cooler thermistor (e.g., A0)
@@ -101,6 +345,7 @@ if __name__ == '__main__':
     SERIES_RESISTOR_COOLER = 10000   # Series resistor for the cooler thermistor in ohms
     THERMISTOR_25C = 10000           # Resistance of the thermistor at 25°C
     MIN_TIME = 5.0                   # Minimum time interval between pin state changes in seconds
+    CONTROL_PERIOD = 0.5             # Period of the control loops in seconds
     
     # Define a logger setup function
     def setup_logger(logger_name, log_file, level=logging.DEBUG):
@@ -160,12 +405,15 @@ if __name__ == '__main__':
             with TemperatureController(heater_reader, heater_controller, TEMP_THRESHOLD_HEATER, ControllerType.HEATER) as heater_controller_instance, \
                  TemperatureController(cooler_reader, cooler_controller, TEMP_THRESHOLD_COOLER, ControllerType.COOLER) as cooler_controller_instance:
                 
-                while True:
-                    current_time = time.time()
-                    heater_controller_instance.control(current_time, MIN_TIME)
-                    cooler_controller_instance.control(current_time, MIN_TIME)
-                    
-                    time.sleep(0.5)
+                # Run both loops on their own deadlines, without drift
+                scheduler = ControlScheduler()
+                scheduler.add(heater_controller_instance, CONTROL_PERIOD, MIN_TIME)
+                scheduler.add(cooler_controller_instance, CONTROL_PERIOD, MIN_TIME)
+                try:
+                    scheduler.run()
+                finally:
+                    for statistics in scheduler.get_statistics():
+                        logger.info(f"Loop statistics: {statistics}")
         
         except KeyboardInterrupt:
             logger.info("Script terminated by user.")
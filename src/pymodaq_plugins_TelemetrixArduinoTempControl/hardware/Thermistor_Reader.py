@@ -1,59 +1,307 @@
 import time
 import logging
-from telemetrix import telemetrix
+import threading
+import weakref
 from collections import deque
+from telemetrix import telemetrix
 from thermistor_model import ThermistorModel 
 import numpy as np 
 from Base_Telemetrix_Instrument import Base_Telemetrix_Instrument
+from Sample_Filters import MovingAverageFilter
+from Instrument_Logging import SampledDebugLogger, RateLimitedLogger
+from Latency_Probes import latency_probes
 
-# Setup logging
-logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
+sample_debug = SampledDebugLogger(logger)  # Per-sample debug messages, see Instrument_Logging
+rate_limited = RateLimitedLogger(logger)  # Warnings that may be raised on every sample
 
 # Arduino board constants
 VCC = 5.0  # Supply voltage (5V for Arduino)
 ARDUINO_ANALOG_PIN_VOLTAGE = 5  # Range of Arduino analog pin (5V)
 ARDUINO_ANALOG_BITS = 10  # Number of bits on analog pins
+ARDUINO_ANALOG_MAX = 2**ARDUINO_ANALOG_BITS - 1  # Highest ADC code
+
+# Divider configurations: order of the thermistor (Rth) and series resistor (R) between VCC and GND
+SERIES_MODES = ('VCC_Rth_R_GND', 'VCC_R_Rth_GND')
+
+# Range of the board analog scan interval, in ms (applies to all the analog pins of a board)
+ANALOG_SCAN_INTERVAL_RANGE = (0, 255)
+
+# Raw samples kept between two reads in lazy mode, older ones are dropped
+LAZY_PENDING_MAX = 1024
+
+
+class AdcTemperatureLUT:
+    """
+    Lookup table converting a (possibly averaged, hence fractional) ADC count into a temperature.
+
+    The table is computed once for a given (thermistor model, series resistor, series mode), so that the
+    conversion of a sample is a single interpolated lookup. Counts whose resistance falls outside the
+    model domain are stored as NaN.
+    """
+
+    # Tables shared by all the readers using the same model and divider, per model instance
+    _cache = weakref.WeakKeyDictionary()
+
+    def __init__(self, thR_model, series_resistor, series_mode, oversampling=1):
+        if series_mode not in SERIES_MODES:
+            raise ValueError(f"Unknown series mode: {series_mode}")
+        self.oversampling = int(oversampling)
+        self.counts = np.arange(ARDUINO_ANALOG_MAX * self.oversampling + 1) / self.oversampling
+
+        voltages = self.counts * (ARDUINO_ANALOG_PIN_VOLTAGE / ARDUINO_ANALOG_MAX)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if series_mode == 'VCC_Rth_R_GND':
+                self.resistances = series_resistor * ((VCC - voltages) / voltages)
+            else:
+                self.resistances = series_resistor * (voltages / (VCC - voltages))
+
+        self.temperatures = np.full(self.counts.shape, np.nan)
+        valid = np.isfinite(self.resistances) & (self.resistances > 0)
+        if thR_model.temp_from_resistance is not None:
+            try:
+                self.temperatures[valid] = thR_model.get_temperature(self.resistances[valid])
+            except ValueError:
+                # Part of the divider range is outside the model domain: convert count by count
+                for index in np.flatnonzero(valid):
+                    try:
+                        self.temperatures[index] = thR_model.get_temperature(float(self.resistances[index]))
+                    except ValueError:
+                        pass
+
+        self._values = self.temperatures.tolist()
+        self._last = len(self._values) - 1
+
+    @classmethod
+    def get(cls, thR_model, series_resistor, series_mode, oversampling=1):
+        """Return the shared table for these parameters, computing it on first use."""
+        tables = cls._cache.setdefault(thR_model, {})
+        key = (float(series_resistor), series_mode, int(oversampling))
+        if key not in tables:
+            tables[key] = cls(thR_model, series_resistor, series_mode, oversampling)
+        return tables[key]
+
+    def lookup(self, count):
+        """Temperature for an ADC count in [0, ARDUINO_ANALOG_MAX], NaN if undefined."""
+        position = count * self.oversampling
+        index = int(position)
+        if index >= self._last:
+            return self._values[self._last]
+        value = self._values[index]
+        return value + (position - index) * (self._values[index + 1] - value)
+
+
+def check_differential(differential):
+    """Analog differential as an int, checked to be positive (raises ValueError otherwise)."""
+    differential = int(differential)
+    if differential < 0:
+        raise ValueError(f"Differential must be positive, got {differential}.")
+    return differential
+
 
 class ThermistorReader(Base_Telemetrix_Instrument):
     
-    def __init__(self, pin, thR_model, com_port=None, ip_port=31335, buffer_size=4, series_mode='VCC_Rth_R_GND', series_resistor=1e4):
-        super().__init__(com_port, ip_port)  # Initialize the base class
+    def __init__(self, pin, thR_model, com_port=None, ip_port=31335, buffer_size=4, series_mode='VCC_Rth_R_GND', series_resistor=1e4,
+                 lut_oversampling=1, sample_filter=None, lazy=False, differential=0, scan_interval=None,
+                 board_factory=None):
+        """
+        :param lut_oversampling: Number of lookup table entries per ADC code (see AdcTemperatureLUT).
+        :param sample_filter: Filter applied to the raw ADC counts (see Sample_Filters), by default a moving
+            average over buffer_size samples.
+        :param lazy: If True, the callback only stores the raw samples, which are filtered and converted when
+            the temperature is read, at most once per new sample.
+        :param differential: Minimum change of the ADC count before the board reports a new value.
+        :param scan_interval: Analog scan interval of the board in ms, None to keep the board setting.
+            It is shared by all the analog pins of the board.
+        :param board_factory: Factory opening the board (see Base_Telemetrix_Instrument), None for the default.
+        """
+        super().__init__(com_port, ip_port, board_factory)  # Initialize the base class
         self.pin = pin
         self.thR_model = thR_model
         self.series_resistor = series_resistor
         self.series_mode = series_mode
-        self._buffer = deque(maxlen=buffer_size)
+        try:
+            self._lut = AdcTemperatureLUT.get(thR_model, series_resistor, series_mode, lut_oversampling)
+        except ValueError:
+            self.disconnect()
+            raise
+        self._filter = sample_filter if sample_filter is not None else MovingAverageFilter(buffer_size)
         self._temperature = None
-        self.board.set_pin_mode_analog_input(self.pin, callback=self._analog_callback)
+        self.lazy = lazy
+        self._pending = deque(maxlen=LAZY_PENDING_MAX)  # Raw (value, timestamp) samples not yet filtered
+        self._pending_lock = threading.Lock()  # Guards the pending samples and the filter state
+        self._sample_count = 0
+        self.sample_received_time = None  # time.perf_counter() at the last callback, when latency probes are enabled
+        # The 'received' latency compares the report time stamps with time.time(), meaningless for simulated boards
+        self._wall_clock_time_stamps = getattr(self.board, 'wall_clock_time_stamps', True)
+        self._raw_recorder = None
+        self._rate_reference = (time.monotonic(), 0)
+        self._subscribers = ()  # Replaced (never mutated) so that the callback thread iterates without lock
+        self._sample_condition = threading.Condition()
+        self._waiters = 0
+        self._notification_count = 0
+        self.differential = None
+        self.scan_interval = None
+        try:
+            self.differential = check_differential(differential)
+            if scan_interval is not None:
+                self.set_scan_interval(scan_interval)
+            self.board.set_pin_mode_analog_input(self.pin, differential=self.differential, callback=self._analog_callback)
+        except (TypeError, ValueError):
+            self.disconnect()
+            raise
+
+    def set_scan_interval(self, interval):
+        """Set the analog scan interval of the board, in ms."""
+        interval = int(interval)
+        if not ANALOG_SCAN_INTERVAL_RANGE[0] <= interval <= ANALOG_SCAN_INTERVAL_RANGE[1]:
+            # Checked here, since telemetrix shuts the (shared) board down on an invalid interval
+            raise ValueError(f"Analog scan interval must be in {ANALOG_SCAN_INTERVAL_RANGE} ms, got {interval}.")
+        self.board.set_analog_scan_interval(interval)
+        self.scan_interval = interval
+        logger.info(f"Analog scan interval set to {interval} ms.")
+
+    def set_differential(self, differential):
+        """Set the minimum change of the ADC count before the board reports a new value on this pin."""
+        differential = check_differential(differential)
+        self.board.set_pin_mode_analog_input(self.pin, differential=differential, callback=self._analog_callback)
+        self.differential = differential
+        logger.info(f"Analog differential of pin {self.pin} set to {differential}.")
+
+    def get_sample_rate(self):
+        """Effective rate of the analog reports received since the previous call, in Hz."""
+        now, count = time.monotonic(), self._sample_count
+        reference_time, reference_count = self._rate_reference
+        self._rate_reference = (now, count)
+        elapsed = now - reference_time
+        return (count - reference_count) / elapsed if elapsed > 0 else 0.0
+
+    def set_raw_recorder(self, recorder):
+        """
+        Call recorder(data) with the raw telemetrix report ([pin_type, pin, value, time_stamp]) of each sample,
+        from the callback thread (see Analog_Replay.AnalogCapture). None to stop recording.
+        """
+        self._raw_recorder = recorder
+
+    def subscribe(self, callback):
+        """
+        Call callback(temperature) after each new sample, from the telemetrix callback thread.
+
+        The temperature is None if undefined. In lazy mode, subscribing makes every sample be converted.
+        """
+        self._subscribers = self._subscribers + (callback,)
+
+    def unsubscribe(self, callback):
+        self._subscribers = tuple(subscriber for subscriber in self._subscribers if subscriber != callback)
+
+    def wait_for_sample(self, timeout=None):
+        """
+        Block until the next analog report is received.
+
+        :return: The resulting temperature, or None on timeout or if undefined.
+        """
+        with self._sample_condition:
+            self._waiters += 1
+            try:
+                count = self._notification_count
+                notified = self._sample_condition.wait_for(lambda: self._notification_count != count, timeout)
+            finally:
+                self._waiters -= 1
+        return self.get_temperature() if notified else None
+
+    def reset(self):
+        """Forget the samples received so far: filter state, pending samples and cached temperature."""
+        with self._pending_lock:
+            self._pending.clear()
+            self._filter.reset()
+            self._temperature = None
 
     def _analog_callback(self, data):
-        analog_value = data[2]
-        logger.debug(f"Received analog value: {analog_value}")
-        self._buffer.append(analog_value)
-        self._update_temperature()
+        self._sample_count += 1
+        if self._raw_recorder is not None:
+            self._raw_recorder(data)
+        probes = latency_probes.enabled
+        if probes:
+            self.sample_received_time = received_time = time.perf_counter()
+            if self._wall_clock_time_stamps:
+                latency_probes.record('received', time.time() - data[3])
+        if self.lazy:
+            self._pending.append((data[2], data[3]))
+        else:
+            if sample_debug.enabled:
+                sample_debug("Received analog value %s on pin %s", data[2], self.pin, pin=self.pin, value=data[2])
+            with self._pending_lock:  # Not updated while reset() clears the filter
+                self._filter.update(data[2], data[3])
+                if probes:
+                    latency_probes.record('filtered', time.perf_counter() - received_time)
+                self._update_temperature()
+            if probes:
+                latency_probes.record('converted', time.perf_counter() - received_time)
+        if self._subscribers or self._waiters:
+            self._notify_sample()
+
+    def _notify_sample(self):
+        if self._subscribers:
+            self._process_pending()
+            temperature = self._temperature
+            for callback in self._subscribers:
+                try:
+                    callback(temperature)
+                except Exception as e:
+                    rate_limited.error("Error in sample subscriber %s: %s", callback, e,
+                                       key=(self.pin, callback))
+        if self._waiters:
+            with self._sample_condition:
+                self._notification_count += 1
+                self._sample_condition.notify_all()
+
+    def _process_pending(self):
+        """In lazy mode, filter the samples received since the last read and convert the result once."""
+        if not self._pending:
+            return
+        with self._pending_lock:
+            if not self._pending:
+                return
+            while self._pending:
+                analog_value, timestamp = self._pending.popleft()
+                self._filter.update(analog_value, timestamp)
+            probes = latency_probes.enabled and self.sample_received_time is not None
+            if probes:
+                latency_probes.record('filtered', time.perf_counter() - self.sample_received_time)
+            self._update_temperature()
+            if probes:
+                latency_probes.record('converted', time.perf_counter() - self.sample_received_time)
 
     def _update_temperature(self):
-        resistance = self.calculate_thermistor_resistance()
-        if resistance is None:
-            logger.warning("No analog reading available.")
+        filtered_value = self._filter.value
+        if filtered_value is None:
+            rate_limited.warning("No analog reading available on pin %s.", self.pin, key=self.pin)
+            self._temperature = None
+            return
+        temperature = self._lut.lookup(filtered_value)
+        if temperature != temperature:  # NaN: resistance outside of the model domain
+            rate_limited.warning("Temperature calculation error on pin %s: analog reading outside of the thermistor "
+                                 "model domain.", self.pin, key=self.pin)
             self._temperature = None
         else:
-            try:
-                self._temperature = self.thR_model.get_temperature(resistance)
-                logger.debug(f"Calculated temperature: {self._temperature:.2f}°C")
-            except Exception as e:
-                logger.warning(f"Temperature calculation error: {e}")
-                self._temperature = None
+            self._temperature = temperature
+            if sample_debug.enabled:
+                sample_debug("Calculated temperature on pin %s: %.2f°C", self.pin, temperature,
+                             pin=self.pin, temperature=temperature)
+
+    def get_analog_value(self):
+        """Filtered ADC count, None before the first sample."""
+        self._process_pending()
+        return self._filter.value
 
     def calculate_thermistor_resistance(self):
-        if not self._buffer:
-            logger.warning("No data available for resistance calculation.")
+        self._process_pending()
+        avg_value = self._filter.value
+        if avg_value is None:
+            rate_limited.warning("No data available for resistance calculation on pin %s.", self.pin, key=self.pin)
             return None
         
-        avg_value = np.mean(self._buffer)
-        voltage = avg_value * (ARDUINO_ANALOG_PIN_VOLTAGE / (2**ARDUINO_ANALOG_BITS - 1))
+        voltage = avg_value * (ARDUINO_ANALOG_PIN_VOLTAGE / ARDUINO_ANALOG_MAX)
         
         try:
             if self.series_mode == 'VCC_Rth_R_GND':
@@ -62,20 +310,25 @@ class ThermistorReader(Base_Telemetrix_Instrument):
                 resistance = self.series_resistor * (voltage / (VCC - voltage))
             else:
                 raise ValueError(f"Unknown series mode: {self.series_mode}")
-            logger.debug(f"Analog avg: {avg_value}, Voltage: {voltage:.2f}V, Resistance: {resistance:.2f}Ω")
+            if sample_debug.enabled:
+                sample_debug("Analog avg: %s, Voltage: %.2fV, Resistance: %.2fΩ", avg_value, voltage, resistance,
+                             pin=self.pin, resistance=resistance)
             return resistance
         except ZeroDivisionError:
-            logger.error("Division by zero encountered during resistance calculation.")
+            rate_limited.error("Division by zero encountered during resistance calculation on pin %s.", self.pin,
+                               key=self.pin)
             return float('inf')
 
     def get_temperature(self):
+        self._process_pending()
         if self._temperature is None:
-            logger.warning('Temperature from thermistor is undefined')
+            rate_limited.warning('Temperature from thermistor on pin %s is undefined', self.pin, key=self.pin)
             return None
         else:
             return self._temperature
 
 if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
     THERMISTOR_PIN = 0  # Analog pin where thermistor is connected
     THERMISTOR_25C = 10000  # Resistance at 25°C
     SERIES_RESISTOR = 13000  # Known resistor in ohms
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded, NumPy-backed time series storage for long acquisitions.
+
+The samples are kept in a circular buffer written twice (at i and i + capacity), so that the last
+`capacity` samples are always contiguous in memory and any recent time window is returned as a view,
+without copy. Optionally, the samples are also appended in chunks to a binary file, so the whole history
+survives with a constant memory footprint.
+
+The buffer has a single writer thread. Views are only safe in that thread: other threads (e.g. a LivePlot)
+ask for copies (copy=True), taken under a sequence counter and retried if a sample was appended meanwhile,
+so that they never see a torn or wrapped series and the writer never waits for them.
+"""
+import time as _time
+
+import numpy as np
+
+# Record layout of the spill files
+SPILL_DTYPE = np.dtype([('time', '<f8'), ('value', '<f8')])
+
+
+class TimeSeriesBuffer:
+    """
+    Circular buffer of (time, value) samples, times being non-decreasing.
+
+    :param capacity: Number of samples kept in memory.
+    :param spill_path: Optional file where all the samples are appended (see load_spilled).
+    :param spill_chunk: Number of samples written at once to the spill file, at most capacity.
+    """
+
+    def __init__(self, capacity, spill_path=None, spill_chunk=256):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1.")
+        self.capacity = capacity
+        self._times = np.empty(2 * capacity)
+        self._values = np.empty(2 * capacity)
+        self._index = 0  # Position of the next sample in [0, capacity)
+        self._count = 0  # Number of valid samples, at most capacity
+        self._sequence = 0  # Odd while the writer updates the buffer
+        self.spill_path = spill_path
+        self.spill_chunk = min(spill_chunk, capacity)
+        self._unspilled = 0  # Samples in memory not yet written to the spill file
+        if spill_path is not None:
+            open(spill_path, 'wb').close()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, time, value):
+        self._sequence += 1
+        i = self._index
+        self._times[i] = self._times[i + self.capacity] = time
+        self._values[i] = self._values[i + self.capacity] = value
+        self._index = (i + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+        self._sequence += 1
+        if self.spill_path is not None:
+            self._unspilled += 1
+            if self._unspilled >= self.spill_chunk:
+                self.flush()
+
+    def _contiguous(self, n):
+        """Slice of the mirrored arrays holding the last n samples in chronological order."""
+        end = self._index + self.capacity
+        return slice(end - n, end)
+
+    def _consistent(self, read):
+        """Result of read() (which must copy) not interleaved with an append, retried otherwise."""
+        while True:
+            sequence = self._sequence
+            if not sequence & 1:
+                result = read()
+                if self._sequence == sequence:
+                    return result
+            _time.sleep(0)  # Let the writer finish its append
+
+    def latest(self, n=None, copy=False):
+        """
+        Times and values of the last n samples (all of them by default).
+
+        :param copy: False for views, valid in the writer thread only; True for consistent copies, from any
+            thread.
+        """
+        if copy:
+            return self._consistent(lambda: tuple(array.copy() for array in self.latest(n)))
+        n = self._count if n is None else min(n, self._count)
+        window = self._contiguous(n)
+        return self._times[window], self._values[window]
+
+    def window(self, duration, copy=False):
+        """Times and values of the samples within `duration` of the last one (see latest for copy)."""
+        if copy:
+            return self._consistent(lambda: tuple(array.copy() for array in self.window(duration)))
+        times, values = self.latest()
+        if len(times) == 0:
+            return times, values
+        start = np.searchsorted(times, times[-1] - duration, side='left')
+        return times[start:], values[start:]
+
+    @property
+    def last(self):
+        """Last (time, value) sample, or None if empty."""
+        if self._count == 0:
+            return None
+        i = self._index - 1 + self.capacity
+        return self._times[i], self._values[i]
+
+    def flush(self):
+        """Append the samples not yet spilled to the spill file."""
+        if self.spill_path is None or self._unspilled == 0:
+            return
+        times, values = self.latest(self._unspilled)
+        records = np.empty(len(times), dtype=SPILL_DTYPE)
+        records['time'] = times
+        records['value'] = values
+        with open(self.spill_path, 'ab') as spill_file:
+            records.tofile(spill_file)
+        self._unspilled = 0
+
+    def clear(self):
+        self.flush()
+        self._sequence += 1
+        self._index = 0
+        self._count = 0
+        self._sequence += 1
+
+
+def load_spilled(spill_path):
+    """Read back all the samples of a spill file, as (times, values) arrays."""
+    records = np.fromfile(spill_path, dtype=SPILL_DTYPE)
+    return records['time'], records['value']
@@ -5,52 +5,173 @@ Created on Thu Oct 31 16:14:05 2024
 @author: gaignebet
 """
 
-import pandas as pd
+import math
+from bisect import bisect_right
 import numpy as np
-from scipy.interpolate import Rbf
-import matplotlib.pyplot as plt
 import logging
 
-# Setup logging
-logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s')
+# pandas (table loading) and scipy (PCHIP tables) are imported on demand, so that processes
+# only converting with a FittedThermistorModel built from known coefficients do not pay for them.
+
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 # Constants for column names
 TEMP_COLUMN = 'T (C)'
 RESISTANCE_COL_LABEL = 'Type 8016'
 REF_R = 10000
+KELVIN_OFFSET = 273.15
+REF_T = 25.0  # Reference temperature of the resistance ratios, in °C
+
+# Available interpolation modes for the conversion tables
+INTERPOLATION_MODES = ('linear', 'log-linear', 'pchip')
+
+# Available closed-form equations for the fitted models
+FITTED_EQUATIONS = ('steinhart-hart', 'beta')
+# Valid domain in °C of a FittedThermistorModel built from coefficients only, the usual NTC range
+DEFAULT_FITTED_RANGE = (-40.0, 125.0)
+
+
+def load_thermistor_table(file_path, ref_R, resistance_col_label=RESISTANCE_COL_LABEL):
+    """
+    Load the temperature and resistance columns of a thermistor table, skipping missing entries.
+
+    :param file_path: Path to the CSV file containing thermistor data.
+    :param ref_R: Resistance of the thermistor at 25°C, in ohms.
+    :param resistance_col_label: Name of the column containing the resistance ratio data (R/R(25°C)).
+    :return: (temperatures in °C, resistances in ohms) as float arrays.
+    """
+    import pandas as pd
+
+    data = pd.read_csv(file_path, sep='\t')
+    data = data[[TEMP_COLUMN, resistance_col_label]].dropna()
+    temperatures = data[TEMP_COLUMN].values.astype(float)
+    resistances = data[resistance_col_label].values * ref_R
+
+    # Ensure the data is not empty
+    if len(temperatures) == 0 or len(resistances) == 0:
+        raise ValueError("Loaded data columns are empty.")
+    return temperatures, resistances
+
+
+class PiecewiseTable:
+    """
+    Piecewise polynomial lookup table built once from tabulated knots.
+
+    Every segment stores the coefficients of c0*dx**3 + c1*dx**2 + c2*dx + c3, so linear segments
+    (c0 = c1 = 0) and PCHIP segments share a single evaluation path: a binary search on the sorted
+    knots followed by a Horner evaluation.
+
+    :param x: Knot abscissas (any order).
+    :param y: Knot ordinates.
+    :param mode: 'linear' or 'pchip'.
+    :param log_x: If True, the table is built and evaluated in log(x) space.
+    :param log_y: If True, log(y) is interpolated and its exponential is returned.
+    """
+
+    def __init__(self, x, y, mode='linear', log_x=False, log_y=False):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        order = np.argsort(x)
+        x, y = x[order], y[order]
+        if np.any(np.diff(x) <= 0):
+            raise ValueError("Knot abscissas must be unique.")
+
+        self.log_x = log_x
+        self.log_y = log_y
+        self.x_min = float(x[0])
+        self.x_max = float(x[-1])
+
+        xs = np.log(x) if log_x else x
+        ys = np.log(y) if log_y else y
+        if mode == 'linear':
+            coeffs = np.zeros((4, len(xs) - 1))
+            coeffs[2] = np.diff(ys) / np.diff(xs)
+            coeffs[3] = ys[:-1]
+        elif mode == 'pchip':
+            from scipy.interpolate import PchipInterpolator
+            coeffs = PchipInterpolator(xs, ys).c
+        else:
+            raise ValueError(f"Unknown table mode: {mode}")
+
+        # Array copies for the vectorized path, plain lists for the scalar path
+        self._knots = xs
+        self._coeffs = coeffs
+        self._knot_list = xs.tolist()
+        self._segments = [tuple(c) for c in coeffs.T.tolist()]
+        self._last_segment = len(self._segments) - 1
+
+    def __call__(self, x):
+        if isinstance(x, (float, int)):
+            return self.evaluate_scalar(x)
+        x = np.asarray(x, dtype=float)
+        if x.ndim == 0:
+            return self.evaluate_scalar(x.item())
+        return self.evaluate_array(x)
+
+    def evaluate_scalar(self, x):
+        """Evaluate the table for a single float, without any numpy overhead."""
+        u = math.log(x) if self.log_x else x
+        i = bisect_right(self._knot_list, u) - 1
+        if i < 0:
+            i = 0
+        elif i > self._last_segment:
+            i = self._last_segment
+        c0, c1, c2, c3 = self._segments[i]
+        dx = u - self._knot_list[i]
+        y = ((c0 * dx + c1) * dx + c2) * dx + c3
+        return math.exp(y) if self.log_y else y
+
+    def evaluate_array(self, x):
+        """Evaluate the table for an array, fully vectorized."""
+        u = np.log(x) if self.log_x else x
+        i = np.searchsorted(self._knots, u, side='right') - 1
+        np.clip(i, 0, self._last_segment, out=i)
+        dx = u - self._knots[i]
+        c = self._coeffs[:, i]
+        y = ((c[0] * dx + c[1]) * dx + c[2]) * dx + c[3]
+        return np.exp(y) if self.log_y else y
+
 
 class ThermistorModel:
-    def __init__(self, file_path, ref_R, resistance_col_label=RESISTANCE_COL_LABEL):
+    def __init__(self, file_path, ref_R, resistance_col_label=RESISTANCE_COL_LABEL, interpolation='linear'):
         """
         Initialize the ThermistorModel with data from the specified file.
 
+        The conversion tables are built once here, so that get_temperature and get_resistance
+        only perform a binary search and a polynomial evaluation.
+
         :param file_path: Path to the CSV file containing thermistor data.
         :param resistance_col_label: Name of the column containing the resistance ratio data (R/R(25°C)).
+        :param interpolation: One of INTERPOLATION_MODES:
+            'linear' interpolates T vs R and R vs T (same curve as the former linear Rbf),
+            'log-linear' interpolates T vs log(R) and log(R) vs T,
+            'pchip' uses a monotonic cubic (PCHIP) interpolation in the same log space.
         """
+        self.interpolation = interpolation
         try:
+            if interpolation not in INTERPOLATION_MODES:
+                raise ValueError(f"Unknown interpolation mode: {interpolation}. "
+                                 f"Valid modes: {INTERPOLATION_MODES}.")
+
             # Load the CSV file
-            data = pd.read_csv(file_path, sep='\t')
+            self.temperatures, self.resistances = load_thermistor_table(file_path, ref_R, resistance_col_label)
 
-            # Extract temperature and resistance ratio columns
-            self.temperatures = data[TEMP_COLUMN].values
-            resistance_ratios = data[resistance_col_label].values
-            self.resistances = resistance_ratios* ref_R
+            # Cache the valid domains
+            self.min_R = float(np.min(self.resistances))
+            self.max_R = float(np.max(self.resistances))
+            self.min_T = float(np.min(self.temperatures))
+            self.max_T = float(np.max(self.temperatures))
 
-            # Ensure the data is not empty
-            if len(self.temperatures) == 0 or len(self.resistances) == 0:
-                raise ValueError("Loaded data columns are empty.")
+            # Create the lookup tables for temperature and resistance
+            table_mode = 'linear' if interpolation in ('linear', 'log-linear') else 'pchip'
+            use_log = interpolation != 'linear'
+            self._temp_table = PiecewiseTable(self.resistances, self.temperatures, table_mode, log_x=use_log)
+            self._resistance_table = PiecewiseTable(self.temperatures, self.resistances, table_mode, log_y=use_log)
 
-            # Create interpolation models for temperature and resistance ratio
-            temp_rbf = Rbf(self.resistances, self.temperatures, function='linear')
-            resistance_rbf = Rbf(self.temperatures, self.resistances, function='linear')
-            
-            # Wrapping with lambdas to match input type
-            self.temp_from_resistance = lambda r: temp_rbf(r).item() if np.isscalar(r) else temp_rbf(r)
-            self.resistance_from_temp = lambda t: resistance_rbf(t).item() if np.isscalar(t) else resistance_rbf(t)
+            self.temp_from_resistance = self._temp_table
+            self.resistance_from_temp = self._resistance_table
 
-            logger.info("Interpolation model initialized successfully.")
+            logger.info(f"Interpolation model ({interpolation}) initialized successfully.")
 
         except FileNotFoundError:
             logger.error(f"File not found: {file_path}")
@@ -69,54 +190,248 @@ class ThermistorModel:
         """
         Get the temperature corresponding to a given resistance ratio.
 
-        :param resistance: The resistance value.
+        :param resistance: The resistance value (scalar or array).
         :return: Estimated temperature or raises an error if out of bounds.
         """
         if self.temp_from_resistance is None:
             raise ValueError("Model not initialized.")
 
-        # Check bounds and raise a clear error message if out of range
-        if np.any(resistance < np.min(self.resistances)) or np.any(resistance > np.max(self.resistances)):
-            min_R = np.min(self.resistances)
-            max_R = np.max(self.resistances)
-            
-            # Generate an appropriate error message depending on array or single value
-            if np.isscalar(resistance):
+        # Fast path for plain floats, as provided by the thermistor readers
+        if isinstance(resistance, (float, int)):
+            if not self.min_R <= resistance <= self.max_R:
                 raise ValueError(f"Input resistance ratio ({resistance:.2e}) is out of bounds. "
-                                 f"Valid domain: [{min_R:.2e}:{max_R:.2e}].")
-            else:
-                raise ValueError(f"One or more input resistance ratios are out of bounds. "
-                             f"Valid domain: [{min_R:.2e}:{max_R:.2e}].")
+                                 f"Valid domain: [{self.min_R:.2e}:{self.max_R:.2e}].")
+            return self._temp_table.evaluate_scalar(resistance)
+
+        resistance = np.asarray(resistance, dtype=float)
+        if resistance.ndim == 0:
+            return self.get_temperature(resistance.item())
+        if resistance.size == 0:
+            return np.empty_like(resistance)
 
-        return self.temp_from_resistance(resistance)
+        # Check bounds and raise a clear error message if out of range
+        if resistance.min() < self.min_R or resistance.max() > self.max_R:
+            raise ValueError(f"One or more input resistance ratios are out of bounds. "
+                             f"Valid domain: [{self.min_R:.2e}:{self.max_R:.2e}].")
+
+        return self._temp_table.evaluate_array(resistance)
 
     def get_resistance(self, temperature):
         """
         Get the resistance ratio corresponding to a given temperature.
 
-        :param temperature: The temperature in °C.
+        :param temperature: The temperature in °C (scalar or array).
         :return: Estimated resistance ratio or raises an error if out of bounds.
         """
         if self.resistance_from_temp is None:
             raise ValueError("Model not initialized.")
 
-        # Check bounds and raise a clear error message if out of range
-        if np.any(temperature < np.min(self.temperatures)) or np.any(temperature > np.max(self.temperatures)):
-            min_temp = np.min(self.temperatures)
-            max_temp = np.max(self.temperatures)
-            
-            # Generate an appropriate error message depending on array or single value
-            if np.isscalar(temperature):
+        if isinstance(temperature, (float, int)):
+            if not self.min_T <= temperature <= self.max_T:
                 raise ValueError(f"Input temperature ({temperature:.2f}°C) is out of bounds. "
-                                 f"Valid domain: [{min_temp:.2f}°C:{max_temp:.2f}°C].")
-            else:
-                raise ValueError(f"One or more input temperatures are out of bounds. "
-                                 f"Valid domain: [{min_temp:.2f}°C:{max_temp:.2f}°C].")
-        
+                                 f"Valid domain: [{self.min_T:.2f}°C:{self.max_T:.2f}°C].")
+            return self._resistance_table.evaluate_scalar(temperature)
+
+        temperature = np.asarray(temperature, dtype=float)
+        if temperature.ndim == 0:
+            return self.get_resistance(temperature.item())
+        if temperature.size == 0:
+            return np.empty_like(temperature)
+
+        # Check bounds and raise a clear error message if out of range
+        if temperature.min() < self.min_T or temperature.max() > self.max_T:
+            raise ValueError(f"One or more input temperatures are out of bounds. "
+                             f"Valid domain: [{self.min_T:.2f}°C:{self.max_T:.2f}°C].")
+
+        return self._resistance_table.evaluate_array(temperature)
+
+class FittedThermistorModel(ThermistorModel):
+    """
+    Thermistor model using a closed-form equation instead of table interpolation.
+
+    The Steinhart-Hart equation 1/T = A + B*ln(R) + C*ln(R)**3 (T in K) is least-squares fitted on the
+    table (the Beta equation is the same with C = 0), then T(R) and R(T) are evaluated in a few flops.
+    Contrary to the interpolated models, the conversion extends smoothly beyond the table edges.
+    """
+
+    def __init__(self, file_path=None, ref_R=REF_R, resistance_col_label=RESISTANCE_COL_LABEL,
+                 equation='steinhart-hart', coefficients=None, fit_range=None):
+        """
+        Fit the model on the specified file, or build it from known coefficients.
+
+        :param file_path: Path to the CSV file containing thermistor data (unused if coefficients are given).
+        :param ref_R: Resistance of the thermistor at 25°C, in ohms.
+        :param resistance_col_label: Name of the column containing the resistance ratio data (R/R(25°C)).
+        :param equation: One of FITTED_EQUATIONS.
+        :param coefficients: Optional (A, B, C) Steinhart-Hart coefficients, skipping the table and the fit.
+        :param fit_range: Optional (T_min, T_max) range in °C restricting the table points used by the fit.
+        """
+        self.interpolation = equation
+        self.equation = equation
+        self.temperatures = None
+        self.resistances = None
+        self.residuals = None
+        self.temp_from_resistance = None
+        self.resistance_from_temp = None
+        try:
+            if equation not in FITTED_EQUATIONS:
+                raise ValueError(f"Unknown equation: {equation}. Valid equations: {FITTED_EQUATIONS}.")
+
+            if coefficients is None:
+                self.temperatures, self.resistances = load_thermistor_table(file_path, ref_R, resistance_col_label)
+                coefficients = self.fit(self.temperatures, self.resistances, equation, fit_range)
+            self.A, self.B, self.C = (float(c) for c in coefficients)
+            if equation == 'beta' and self.C != 0:
+                raise ValueError("Beta equation requires C = 0.")
+
+            self._set_domain(fit_range)
+            if self.temperatures is not None:
+                self.residuals = self.get_temperature(self.resistances) - self.temperatures
+                logger.info(f"{equation} model fitted: A={self.A:.6e}, B={self.B:.6e}, C={self.C:.6e}, "
+                            f"max residual {np.max(np.abs(self.residuals)):.3f}°C, "
+                            f"rms residual {np.sqrt(np.mean(self.residuals**2)):.3f}°C.")
+
+            self.temp_from_resistance = self.get_temperature
+            self.resistance_from_temp = self.get_resistance
+
+        except FileNotFoundError:
+            logger.error(f"File not found: {file_path}")
+        except ValueError as ve:
+            logger.error(f"Value error: {ve}")
+        except Exception as e:
+            logger.error(f"Error fitting thermistor data: {e}")
+
+    @staticmethod
+    def fit(temperatures, resistances, equation='steinhart-hart', fit_range=None):
+        """
+        Least-squares fit of the equation coefficients on tabulated data.
+
+        :param temperatures: Temperatures in °C.
+        :param resistances: Resistances in ohms.
+        :param equation: One of FITTED_EQUATIONS.
+        :param fit_range: Optional (T_min, T_max) range in °C of the points used by the fit.
+        :return: (A, B, C) Steinhart-Hart coefficients (C = 0 for the Beta equation).
+        """
+        temperatures = np.asarray(temperatures, dtype=float)
+        resistances = np.asarray(resistances, dtype=float)
+        if fit_range is not None:
+            mask = (temperatures >= fit_range[0]) & (temperatures <= fit_range[1])
+            temperatures, resistances = temperatures[mask], resistances[mask]
+
+        log_R = np.log(resistances)
+        if equation == 'steinhart-hart':
+            design = np.column_stack((np.ones_like(log_R), log_R, log_R**3))
+        elif equation == 'beta':
+            design = np.column_stack((np.ones_like(log_R), log_R))
+        else:
+            raise ValueError(f"Unknown equation: {equation}. Valid equations: {FITTED_EQUATIONS}.")
+        if len(log_R) < design.shape[1]:
+            raise ValueError(f"Not enough table points to fit the {equation} equation.")
+
+        solution = np.linalg.lstsq(design, 1 / (temperatures + KELVIN_OFFSET), rcond=None)[0]
+        A, B = solution[0], solution[1]
+        C = solution[2] if equation == 'steinhart-hart' else 0.0
+        return A, B, C
+
+    def _set_domain(self, fit_range):
+        """Cache the valid domains (min_T, max_T, min_R, max_R), those of the fitted table points."""
+        if self.temperatures is not None:
+            temperatures = self.temperatures
+            if fit_range is not None:
+                temperatures = temperatures[(temperatures >= fit_range[0]) & (temperatures <= fit_range[1])]
+            self.min_T, self.max_T = float(np.min(temperatures)), float(np.max(temperatures))
+        else:
+            self.min_T, self.max_T = (float(t) for t in (fit_range or DEFAULT_FITTED_RANGE))
+        resistances = (self.get_resistance(self.min_T), self.get_resistance(self.max_T))
+        self.min_R, self.max_R = min(resistances), max(resistances)
+
+    @property
+    def beta(self):
+        """Beta parameter (in K) equivalent to the B coefficient."""
+        return 1 / self.B
+
+    @property
+    def ref_resistance(self):
+        """Resistance at REF_T given by the model, in ohms."""
+        return self.get_resistance(REF_T)
+
+    def get_temperature(self, resistance):
+        """
+        Get the temperature corresponding to a given resistance.
+
+        :param resistance: The resistance value in ohms (scalar or array), strictly positive and finite.
+        :return: Temperature in °C.
+        """
+        if isinstance(resistance, (float, int)):
+            if not 0 < resistance < math.inf:
+                raise ValueError(f"Input resistance ({resistance:.2e}) must be positive and finite.")
+            log_R = math.log(resistance)
+            return 1 / (self.A + (self.B + self.C * log_R * log_R) * log_R) - KELVIN_OFFSET
+
+        resistance = np.asarray(resistance, dtype=float)
+        if resistance.ndim == 0:
+            return self.get_temperature(resistance.item())
+        if not np.all((resistance > 0) & np.isfinite(resistance)):
+            raise ValueError("One or more input resistances are not positive and finite.")
+        log_R = np.log(resistance)
+        return 1 / (self.A + (self.B + self.C * log_R * log_R) * log_R) - KELVIN_OFFSET
+
+    def get_resistance(self, temperature):
+        """
+        Get the resistance corresponding to a given temperature, by inverting the equation in closed form.
+
+        :param temperature: The temperature in °C (scalar or array), above absolute zero.
+        :return: Resistance in ohms.
+        """
+        if isinstance(temperature, (float, int)):
+            if not temperature > -KELVIN_OFFSET:
+                raise ValueError(f"Input temperature ({temperature:.2f}°C) is below absolute zero.")
+            inv_T = 1 / (temperature + KELVIN_OFFSET)
+            if self.C == 0:
+                return math.exp((inv_T - self.A) / self.B)
+            # Cardano's formula for x**3 + p*x + q = 0, with x = ln(R), p = B/C and q = (A - 1/T)/C
+            p = self.B / self.C
+            q = (self.A - inv_T) / self.C
+            discriminant = (p / 3)**3 + q * q / 4
+            if discriminant >= 0:
+                y = math.sqrt(discriminant)
+                u, v = y - q / 2, y + q / 2
+                return math.exp(math.copysign(abs(u)**(1 / 3), u) - math.copysign(abs(v)**(1 / 3), v))
+            # Three real roots (C < 0): the physical one is the closest to the Beta equation solution
+            radius = 2 * math.sqrt(-p / 3)
+            angle = math.acos(min(max(3 * q / (2 * p) * math.sqrt(-3 / p), -1.0), 1.0)) / 3
+            beta_log_R = (inv_T - self.A) / self.B
+            return math.exp(min((radius * math.cos(angle - 2 * math.pi * k / 3) for k in range(3)),
+                                key=lambda root: abs(root - beta_log_R)))
+
+        temperature = np.asarray(temperature, dtype=float)
+        if temperature.ndim == 0:
+            return self.get_resistance(temperature.item())
+        if not np.all(temperature > -KELVIN_OFFSET):
+            raise ValueError("One or more input temperatures are below absolute zero.")
+        inv_T = 1 / (temperature + KELVIN_OFFSET)
+        if self.C == 0:
+            return np.exp((inv_T - self.A) / self.B)
+        p = self.B / self.C
+        q = (self.A - inv_T) / self.C
+        discriminant = (p / 3)**3 + q * q / 4
+        y = np.sqrt(np.maximum(discriminant, 0.0))
+        log_R = np.cbrt(y - q / 2) - np.cbrt(y + q / 2)
+        three_roots = discriminant < 0
+        if np.any(three_roots):
+            q = q[three_roots]
+            radius = 2 * np.sqrt(-p / 3)
+            angle = np.arccos(np.clip(3 * q / (2 * p) * np.sqrt(-3 / p), -1.0, 1.0)) / 3
+            roots = radius * np.cos(angle[:, None] - 2 * np.pi * np.arange(3) / 3)
+            beta_log_R = (inv_T[three_roots] - self.A) / self.B
+            log_R[three_roots] = roots[np.arange(len(q)), np.argmin(np.abs(roots - beta_log_R[:, None]), axis=1)]
+        return np.exp(log_R)
 
-        return self.resistance_from_temp(temperature)
 
 if __name__ == '__main__':
+    import matplotlib.pyplot as plt
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.DEBUG)
     file_path = r"../../../Thermistor_R_vs_T.csv"
 
     # Initialize the ThermistorModel
@@ -127,9 +442,7 @@ if __name__ == '__main__':
         logger.info("Thermistor model is ready for use.")
         
         # Get the original data for comparison:
-        data = pd.read_csv(file_path, sep='\t')
-        temperatures = data[TEMP_COLUMN].values  # Extract the temperature and resistance ratio columns
-        resistances = data[RESISTANCE_COL_LABEL].values*REF_R
+        temperatures, resistances = load_thermistor_table(file_path, REF_R, RESISTANCE_COL_LABEL)
             
         # Create a log-spaced array for resistance ratios
         resistance_min = np.min(resistances)
@@ -141,11 +454,15 @@ if __name__ == '__main__':
 
         # Calculate temperature from the model for each resistance ratio in the range
         try:
-            temperatures_from_interpolation = thermistor_model.get_temperature(resistance_range)
-
-            # Plot the results
+            # Plot the results for every interpolation mode
             plt.figure(figsize=(10, 5))
-            plt.plot(resistance_range, temperatures_from_interpolation, '.g', label='Interpolation Model', ms=2)
+            for mode, fmt in zip(INTERPOLATION_MODES, ('.g', '.r', '.k')):
+                mode_model = ThermistorModel(file_path, ref_R=REF_R, resistance_col_label=RESISTANCE_COL_LABEL,
+                                             interpolation=mode)
+                temperatures_from_interpolation = mode_model.get_temperature(resistance_range)
+                plt.plot(resistance_range, temperatures_from_interpolation, fmt, label=f'Interpolation Model ({mode})', ms=2)
+            fitted_model = FittedThermistorModel(file_path, ref_R=REF_R, resistance_col_label=RESISTANCE_COL_LABEL)
+            plt.plot(resistance_range, fitted_model.get_temperature(resistance_range), '-m', label='Steinhart-Hart Fit', lw=1)
             plt.scatter(resistances, temperatures, label='Original Data Points', color='blue', s=10)
             plt.xscale('log')  # Set x-axis to logarithmic scale for better visualization
             plt.xlabel('Resistance Ratio (R/R(25°C))')
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Behaviour of the asyncio instruments, run against a fake telemetrix_aio board.
+"""
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('telemetrix_aio')
+
+HARDWARE_PATH = Path(__file__).parent.parent.joinpath('src', 'pymodaq_plugins_TelemetrixArduinoTempControl',
+                                                       'hardware')
+sys.path.insert(0, str(HARDWARE_PATH))
+
+import Async_Telemetrix_Instruments
+from Async_Telemetrix_Instruments import AsyncBase_Telemetrix_Instrument, AsyncThermistorReader, \
+    AsyncDigital_PinController, AsyncPWM_PinController, AsyncTemperatureController
+from thermistor_model import ThermistorModel
+from Thermistor_Reader import AdcTemperatureLUT
+from Temperature_Controller import ControllerType
+
+TABLE_PATH = Path(__file__).parent.parent.joinpath('Thermistor_R_vs_T.csv')
+SERIES_RESISTOR = 13000
+SERIES_MODE = 'VCC_R_Rth_GND'
+ANALOG_REPORT = 3
+
+
+class FakeTelemetrixAIO:
+    """Stand-in for telemetrix_aio.TelemetrixAIO, recording the pin modes and writes."""
+
+    def __init__(self, com_port=None, ip_port=None, autostart=True, loop=None, close_loop_on_shutdown=True,
+                 **kwargs):
+        self.loop = loop
+        self.started = False
+        self.shut_down = False
+        self.analog_callbacks = {}
+        self.writes = []
+
+    async def start_aio(self):
+        self.started = True
+
+    async def set_pin_mode_analog_input(self, pin, differential=0, callback=None):
+        self.analog_callbacks[pin] = callback
+
+    async def set_pin_mode_digital_output(self, pin):
+        pass
+
+    async def set_pin_mode_analog_output(self, pin):
+        pass
+
+    async def set_analog_scan_interval(self, interval):
+        pass
+
+    async def digital_write(self, pin, value):
+        self.writes.append((pin, value))
+
+    async def analog_write(self, pin, value):
+        self.writes.append((pin, value))
+
+    async def shutdown(self):
+        self.shut_down = True
+
+    async def report(self, pin, value):
+        """Send an analog report to the callback of a pin."""
+        await self.analog_callbacks[pin]([ANALOG_REPORT, pin, value, time.time()])
+
+
+@pytest.fixture(autouse=True)
+def fake_board(monkeypatch):
+    monkeypatch.setattr(Async_Telemetrix_Instruments.telemetrix_aio, 'TelemetrixAIO', FakeTelemetrixAIO)
+
+
+@pytest.fixture(scope='module')
+def thermistor_model():
+    return ThermistorModel(str(TABLE_PATH), ref_R=10000, resistance_col_label='Type 8016')
+
+
+def make_reader(thermistor_model):
+    return AsyncThermistorReader(0, thermistor_model, series_resistor=SERIES_RESISTOR, series_mode=SERIES_MODE,
+                                 buffer_size=1)
+
+
+def test_instruments_share_the_board(thermistor_model):
+    async def scenario():
+        async with make_reader(thermistor_model) as reader, AsyncDigital_PinController(4) as heater:
+            assert reader.board is heater.board
+            assert reader.connection_manager is heater.connection_manager
+            assert reader.board.started and reader.board.loop is asyncio.get_running_loop()
+            return reader.board
+
+    board = asyncio.run(scenario())
+    assert board.shut_down
+    assert AsyncBase_Telemetrix_Instrument._connection_managers == {}
+
+
+def test_last_disconnect_releases_the_manager():
+    async def scenario():
+        first, second = AsyncDigital_PinController(4), AsyncDigital_PinController(5)
+        await first.connect()
+        await second.connect()
+        manager, board = first.connection_manager, first.board
+        await first.disconnect()
+        assert not board.shut_down
+        await second.disconnect()
+        assert board.shut_down
+        assert manager not in AsyncBase_Telemetrix_Instrument._connection_managers.values()
+        # The next instrument opens the board again
+        async with AsyncDigital_PinController(4) as third:
+            assert third.connection_manager is not manager
+            assert third.board is not board
+
+    asyncio.run(scenario())
+
+
+def test_successive_event_loops():
+    async def scenario():
+        async with AsyncPWM_PinController(3) as heater:
+            await heater.set_duty_cycle(0.5)
+            return heater.board
+
+    boards = [asyncio.run(scenario()) for _ in range(2)]
+    assert boards[0] is not boards[1]
+    assert boards[1].writes == [(3, 0), (3, 128)]
+
+
+def test_analog_callbacks(thermistor_model):
+    lut = AdcTemperatureLUT.get(thermistor_model, SERIES_RESISTOR, SERIES_MODE)
+
+    async def scenario():
+        async with make_reader(thermistor_model) as reader:
+            assert reader.get_temperature() is None
+            pending_read = asyncio.ensure_future(reader.read_temperature(timeout=1.0))
+            await asyncio.sleep(0)
+            await reader.board.report(0, 500)
+            assert await pending_read == pytest.approx(lut.lookup(500))
+            await reader.board.report(0, 0)  # Outside of the model domain
+            assert reader.get_temperature() is None
+
+    asyncio.run(scenario())
+
+
+def test_threshold_control(thermistor_model):
+    lut = AdcTemperatureLUT.get(thermistor_model, SERIES_RESISTOR, SERIES_MODE)
+
+    async def scenario():
+        async with make_reader(thermistor_model) as reader, AsyncDigital_PinController(4) as heater:
+            controller = AsyncTemperatureController(reader, heater, lut.lookup(500), ControllerType.HEATER)
+            await reader.board.report(0, 600)  # Colder than the threshold: the thermistor is to the ground
+            await controller.control(0.0)
+            assert heater.is_on()
+            await reader.board.report(0, 400)
+            await controller.control(0.5, min_time=1.0)  # Too early to toggle
+            assert heater.is_on()
+            await controller.control(1.0, min_time=1.0)
+            assert not heater.is_on()
+            assert heater.board.writes == [(4, 1), (4, 0)]
+
+    asyncio.run(scenario())
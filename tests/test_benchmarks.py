@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the hot paths of the hardware modules, run against the simulated telemetrix board.
+
+The relative checks compare timings measured in the same process (lookup table conversion against the former
+Rbf interpolation, filter update against window size), so they do not depend on the machine, but they do depend
+on its load: like the benchmarks, they are skipped if pytest-benchmark is not installed, and also in the workers
+of pytest-xdist, whose parallel tests disturb the timings. Run them alone with
+
+    pytest tests/test_benchmarks.py
+
+The benchmarks only measure by default. Baselines depend on the machine, so none is stored in the repository:
+save one locally with
+
+    pytest tests/test_benchmarks.py --benchmark-save=baseline
+
+and compare later runs on the same machine with it when needed:
+
+    pytest tests/test_benchmarks.py --benchmark-compare --benchmark-compare-fail=median:30%
+
+The benchmarks are skipped if pytest-benchmark is not installed.
+"""
+import importlib.util
+import os
+import sys
+import time
+import timeit
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+pytest.importorskip('telemetrix')
+
+HARDWARE_PATH = Path(__file__).parent.parent.joinpath('src', 'pymodaq_plugins_TelemetrixArduinoTempControl',
+                                                       'hardware')
+sys.path.insert(0, str(HARDWARE_PATH))
+
+from Base_Telemetrix_Instrument import Base_Telemetrix_Instrument as BaseInstrument
+from thermistor_model import ThermistorModel, FittedThermistorModel
+from Thermistor_Reader import ThermistorReader, AdcTemperatureLUT
+from Digital_Output_Controller import Digital_PinController
+from Proportional_Output_Controller import PWM_PinController
+from Temperature_Controller import TemperatureController, PIDTemperatureController, ControllerType
+from Sample_Filters import make_filter, MAX_WINDOW_SIZE
+from Simulated_Telemetrix_Board import SimulatedTelemetrix
+
+TABLE_PATH = Path(__file__).parent.parent.joinpath('Thermistor_R_vs_T.csv')
+THERMISTOR_25C = 10000
+SERIES_RESISTOR = 13000
+
+requires_benchmark = pytest.mark.skipif(importlib.util.find_spec('pytest_benchmark') is None,
+                                        reason='pytest-benchmark is not installed')
+requires_quiet_run = pytest.mark.skipif(importlib.util.find_spec('pytest_benchmark') is None
+                                        or 'PYTEST_XDIST_WORKER' in os.environ,
+                                        reason='timing checks need pytest-benchmark and no pytest-xdist workers')
+
+
+def best_time(func, *args, number=1000):
+    """Best time of a call to func(*args) over a few repeats, in s: the least disturbed by the machine load."""
+    return min(timeit.repeat(lambda: func(*args), number=number, repeat=5)) / number
+
+
+@pytest.fixture
+def board(thermistor_model):
+    """Simulated board with the thermistor of a zone on pin 0, and its outputs on pins 4 (digital) and 5 (PWM)."""
+    board = SimulatedTelemetrix(seed=0)
+    board.add_zone('zone')
+    board.add_thermistor(0, 'zone', thermistor_model, SERIES_RESISTOR)
+    board.add_actuator(4, 'zone', 30.0)
+    board.add_actuator(5, 'zone', 30.0)
+    return board
+
+
+@pytest.fixture(scope='module')
+def thermistor_model():
+    return ThermistorModel(str(TABLE_PATH), ref_R=THERMISTOR_25C, resistance_col_label='Type 8016')
+
+
+@pytest.fixture
+def thermistor_reader(board, thermistor_model):
+    reader = ThermistorReader(0, thermistor_model, series_resistor=SERIES_RESISTOR, board_factory=board.open)
+    reader._analog_callback([2, 0, 512, time.time()])
+    yield reader
+    reader.disconnect()
+
+
+# Relative checks
+
+@requires_quiet_run
+@pytest.mark.parametrize('interpolation', ['linear', 'pchip'])
+def test_lut_faster_than_rbf(interpolation):
+    Rbf = pytest.importorskip('scipy.interpolate').Rbf
+
+    model = ThermistorModel(str(TABLE_PATH), ref_R=THERMISTOR_25C, resistance_col_label='Type 8016',
+                            interpolation=interpolation)
+    lut = AdcTemperatureLUT(model, SERIES_RESISTOR, 'VCC_Rth_R_GND')
+    # The per-sample conversion replaced by the lookup tables
+    rbf = Rbf(model.resistances, model.temperatures, function='linear')
+    resistance = float(lut.resistances[512])
+    assert lut.lookup(512) == pytest.approx(float(rbf(resistance)), abs=0.1)
+    assert best_time(lut.lookup, 512) * 10 <= best_time(rbf, resistance, number=100)
+
+
+@requires_quiet_run
+@pytest.mark.parametrize('filter_type', ['none', 'moving_average', 'ema', 'low_pass'])
+def test_filter_update_independent_of_window(filter_type):
+    def update_time(size):
+        kwargs = {'size': size} if filter_type == 'moving_average' else {}
+        sample_filter = make_filter(filter_type, **kwargs)
+        for count in range(size):  # Full window
+            sample_filter.update(count, float(count))
+        return best_time(sample_filter.update, 512, 1e6, number=10000)
+
+    # Generous bound: only a cost growing with the window would fail
+    assert update_time(MAX_WINDOW_SIZE) < 3 * update_time(2)
+
+
+# Benchmarks
+
+@requires_benchmark
+def test_model_scalar(benchmark, thermistor_model):
+    temperature = benchmark(thermistor_model.get_temperature, 12000.0)
+    assert 20 < temperature < 25
+
+
+@requires_benchmark
+def test_model_array(benchmark, thermistor_model):
+    resistances = np.geomspace(thermistor_model.min_R, thermistor_model.max_R, 10**6)
+    temperatures = benchmark(thermistor_model.get_temperature, resistances)
+    assert temperatures.shape == resistances.shape
+
+
+@requires_benchmark
+def test_fitted_model_scalar(benchmark):
+    model = FittedThermistorModel(str(TABLE_PATH), ref_R=THERMISTOR_25C, resistance_col_label='Type 8016')
+    temperature = benchmark(model.get_temperature, 12000.0)
+    assert 20 < temperature < 25
+
+
+@requires_benchmark
+def test_reader_callback(benchmark, thermistor_reader):
+    data = [2, 0, 512, time.time()]
+    benchmark(thermistor_reader._analog_callback, data)
+    assert thermistor_reader.get_temperature() is not None
+
+
+@requires_benchmark
+def test_threshold_control_step(benchmark, board, thermistor_reader):
+    output = Digital_PinController(4, board_factory=board.open)
+    controller = TemperatureController(thermistor_reader, output, 25.0, ControllerType.HEATER)
+    benchmark(controller.control, time.monotonic(), 0.0)
+    output.disconnect()
+
+
+@requires_benchmark
+def test_pid_control_step(benchmark, board, thermistor_reader):
+    output = PWM_PinController(5, board_factory=board.open)
+    controller = PIDTemperatureController(thermistor_reader, output, 25.0, ControllerType.HEATER, kp=0.2, ki=0.01)
+    assert benchmark(controller.control) is not None
+    output.disconnect()
+
+
+@requires_benchmark
+def test_connection_acquire_release(benchmark, board):
+    # One instrument holds the board, as in a running application
+    holder = Digital_PinController(4, board_factory=board.open)
+    manager = BaseInstrument.get_connection_manager(None, 31335, board.open)
+
+    def acquire_release():
+        manager.connect()
+        manager.disconnect()
+
+    benchmark(acquire_release)
+    assert manager.reference_count == 1
+    holder.disconnect()
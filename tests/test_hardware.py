@@ -0,0 +1,660 @@
+# -*- coding: utf-8 -*-
+"""
+Behaviour of the hardware modules, run on a SimulatedTelemetrix board (no Arduino needed).
+"""
+import logging
+import math
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+pytest.importorskip('telemetrix')
+
+HARDWARE_PATH = Path(__file__).parent.parent.joinpath('src', 'pymodaq_plugins_TelemetrixArduinoTempControl',
+                                                       'hardware')
+sys.path.insert(0, str(HARDWARE_PATH))
+
+from Base_Telemetrix_Instrument import Base_Telemetrix_Instrument as BaseInstrument
+from thermistor_model import ThermistorModel, FittedThermistorModel, DEFAULT_FITTED_RANGE
+from Sample_Filters import make_filter, FILTER_TYPES, MAX_WINDOW_SIZE
+from Thermistor_Reader import ThermistorReader, AdcTemperatureLUT, ARDUINO_ANALOG_MAX
+from Digital_Output_Controller import Digital_PinController, DigitalOutputGroup
+from Proportional_Output_Controller import PWM_PinController, TimeProportional_PinController
+from Temperature_Controller import TemperatureController, PIDTemperatureController, ControllerType, \
+    ANTI_WINDUP_MODES
+from Control_Scheduler import ControlScheduler
+from Simulated_Telemetrix_Board import SimulatedTelemetrix, use_simulated_board
+from Analog_Replay import AnalogCapture, AnalogReplay, DECISION_DTYPE
+from Heater_Station import HeaterStation
+from Instrument_Logging import RateLimitedLogger
+from Time_Series_Buffer import TimeSeriesBuffer, load_spilled
+from Telemetry_Logger import TelemetryWriter, TelemetryReader
+from Latency_Probes import LatencyHistogram, latency_probes
+
+TABLE_PATH = Path(__file__).parent.parent.joinpath('Thermistor_R_vs_T.csv')
+THERMISTOR_25C = 10000
+SERIES_RESISTOR = 13000
+SERIES_MODE = 'VCC_R_Rth_GND'
+
+
+@pytest.fixture(scope='module')
+def thermistor_model():
+    return ThermistorModel(str(TABLE_PATH), ref_R=THERMISTOR_25C, resistance_col_label='Type 8016')
+
+
+@pytest.fixture
+def board(thermistor_model):
+    """Simulated board with a zone at 20°C, its thermistor on pin 0 and a 30 W heater on pin 4."""
+    board = SimulatedTelemetrix(seed=0)
+    board.add_zone('zone', heat_capacity=50.0, thermal_resistance=2.0, ambient=20.0)
+    board.add_thermistor(0, 'zone', thermistor_model, SERIES_RESISTOR, SERIES_MODE)
+    board.add_actuator(4, 'zone', 30.0)
+    return board
+
+
+@pytest.fixture
+def reader(board, thermistor_model):
+    reader = ThermistorReader(0, thermistor_model, series_resistor=SERIES_RESISTOR, series_mode=SERIES_MODE,
+                              sample_filter=make_filter('none'), board_factory=board.open)
+    yield reader
+    reader.disconnect()
+
+
+# Sample filters
+
+def test_moving_average_keeps_last_samples():
+    sample_filter = make_filter('moving_average', size=3)
+    for value in (1, 2, 3, 4, 5):
+        sample_filter.update(value)
+    assert sample_filter.value == 4
+
+
+def test_ema_smoothing():
+    sample_filter = make_filter('ema', alpha=0.5)
+    assert sample_filter.update(10) == 10
+    assert sample_filter.update(20) == 15
+
+
+def test_median_rejects_spike():
+    sample_filter = make_filter('median', size=3)
+    for value in (10, 10, 1000, 10):
+        sample_filter.update(value)
+    assert sample_filter.value == 10
+
+
+def test_low_pass_follows_time_constant():
+    sample_filter = make_filter('low_pass', time_constant=2.0)
+    sample_filter.update(0, timestamp=0.0)
+    assert sample_filter.update(1, timestamp=2.0) == pytest.approx(1 - math.exp(-1))
+
+
+@pytest.mark.parametrize('filter_type', list(FILTER_TYPES))
+def test_filter_reset(filter_type):
+    sample_filter = make_filter(filter_type)
+    sample_filter.update(100, timestamp=0.0)
+    sample_filter.reset()
+    assert sample_filter.value is None
+    assert sample_filter.update(50, timestamp=1.0) == 50
+
+
+def test_unknown_filter():
+    with pytest.raises(ValueError):
+        make_filter('kalman')
+
+
+@pytest.mark.parametrize('filter_type', ['moving_average', 'median'])
+def test_filter_window_size_capped(filter_type):
+    assert make_filter(filter_type, size=MAX_WINDOW_SIZE).size == MAX_WINDOW_SIZE
+    with pytest.raises(ValueError):
+        make_filter(filter_type, size=MAX_WINDOW_SIZE + 1)
+
+
+# ADC lookup table
+
+def test_lut_matches_model(thermistor_model):
+    lut = AdcTemperatureLUT(thermistor_model, SERIES_RESISTOR, SERIES_MODE)
+    for count in (300, 512, 700):
+        voltage_ratio = count / ARDUINO_ANALOG_MAX
+        resistance = SERIES_RESISTOR * voltage_ratio / (1 - voltage_ratio)
+        assert lut.lookup(count) == pytest.approx(thermistor_model.get_temperature(resistance))
+    # Fractional counts are interpolated between the entries
+    assert lut.lookup(512.5) == pytest.approx((lut.lookup(512) + lut.lookup(513)) / 2)
+
+
+def test_model_empty_arrays(thermistor_model):
+    assert thermistor_model.get_temperature(np.array([])).shape == (0,)
+    assert thermistor_model.get_resistance([]).shape == (0,)
+
+def test_lut_outside_model_domain(thermistor_model):
+    lut = AdcTemperatureLUT(thermistor_model, SERIES_RESISTOR, SERIES_MODE)
+    assert math.isnan(lut.lookup(0))
+    assert math.isnan(lut.lookup(ARDUINO_ANALOG_MAX))
+
+
+def test_lut_shared_per_model(thermistor_model):
+    lut = AdcTemperatureLUT.get(thermistor_model, SERIES_RESISTOR, SERIES_MODE)
+    assert AdcTemperatureLUT.get(thermistor_model, float(SERIES_RESISTOR), SERIES_MODE) is lut
+    assert AdcTemperatureLUT.get(thermistor_model, SERIES_RESISTOR, 'VCC_Rth_R_GND') is not lut
+
+
+def test_reader_converts_board_samples(board, reader):
+    board.zones['zone'].temperature = 42.0
+    board.advance(0.1)
+    assert reader.get_temperature() == pytest.approx(42.0, abs=0.2)
+
+
+# Fitted thermistor model
+
+@pytest.mark.parametrize('differential', [-1, None])
+def test_reader_rejects_invalid_differential(board, thermistor_model, differential):
+    with pytest.raises((TypeError, ValueError)):
+        ThermistorReader(0, thermistor_model, series_resistor=SERIES_RESISTOR, differential=differential,
+                         board_factory=board.open)
+    assert not BaseInstrument._connection_managers  # The board is released
+
+
+def test_reader_reset(board, reader):
+    board.advance(0.1)
+    assert reader.get_temperature() is not None
+    reader.reset()
+    assert reader.get_temperature() is None and reader.get_analog_value() is None
+    board.advance(0.1)
+    assert reader.get_temperature() == pytest.approx(20.0, abs=0.2)
+
+def test_lazy_reader_converts_on_read(board, thermistor_model):
+    reader = ThermistorReader(0, thermistor_model, series_resistor=SERIES_RESISTOR, series_mode=SERIES_MODE,
+                              sample_filter=make_filter('moving_average', size=4), lazy=True,
+                              board_factory=board.open)
+    board.advance(0.2)
+    assert reader._filter.value is None  # Samples only queued by the callback
+    assert reader.get_temperature() == pytest.approx(20.0, abs=0.2)
+    assert not reader._pending
+    reader.disconnect()
+
+def test_fitted_model_round_trip():
+    fitted = FittedThermistorModel(str(TABLE_PATH), ref_R=THERMISTOR_25C, resistance_col_label='Type 8016')
+    assert fitted.get_temperature(fitted.get_resistance(37.0)) == pytest.approx(37.0)
+    assert fitted.min_R < fitted.get_resistance(37.0) < fitted.max_R
+    with pytest.raises(ValueError):
+        fitted.get_temperature(0.0)
+
+
+def test_fitted_model_negative_c():
+    fitted = FittedThermistorModel(str(TABLE_PATH), ref_R=THERMISTOR_25C, resistance_col_label='Type 8016')
+    fitted = FittedThermistorModel(coefficients=(fitted.A, fitted.B, -abs(fitted.C)))
+    assert (fitted.min_T, fitted.max_T) == DEFAULT_FITTED_RANGE
+    temperatures = np.array([0.0, 25.0, 80.0])
+    assert fitted.get_temperature(fitted.get_resistance(temperatures)) == pytest.approx(temperatures)
+
+
+# Time-proportioning output
+
+@pytest.fixture
+def relay(board):
+    relay = Digital_PinController(4, board_factory=board.open)
+    yield relay
+    relay.disconnect()
+
+
+def test_time_proportioning_window(relay):
+    drive = TimeProportional_PinController(relay, window=10.0)
+    drive.set_duty_cycle(0.3)
+    states = []
+    for now in np.arange(0.0, 20.0, 0.5):
+        drive.update(now)
+        states.append(relay.is_on())
+    # On during the first 3 s of each window, windows aligned on the first update
+    assert states == ([True] * 6 + [False] * 14) * 2
+
+
+def test_time_proportioning_mixed_clocks(board, reader, relay):
+    drive = TimeProportional_PinController(relay, window=10.0)
+    controller = TemperatureController(reader, drive, 40.0, ControllerType.HEATER, proportional_band=5.0)
+    board.advance(0.1)
+    with controller:
+        controller.control(1e9, 0)  # Wall-clock time stamps, far ahead of time.monotonic()
+        assert relay.is_on()
+    # turn_off() on exit switches the relay off whatever the window position
+    assert drive.duty_cycle == 0.0 and not relay.is_on()
+    # A clock going backwards restarts the window instead of driving the pin at duty 0
+    drive.update(0.0)
+    assert not relay.is_on()
+    drive.set_duty_cycle(0.5)
+    drive.update(1e9)
+    drive.update(2.0)
+    assert relay.is_on()
+    drive.update(7.0)
+    assert not relay.is_on()
+
+@pytest.mark.parametrize('duty_cycle, state', [(0.05, False), (0.95, True)])
+def test_time_proportioning_min_pulse(relay, duty_cycle, state):
+    drive = TimeProportional_PinController(relay, window=10.0, min_pulse=1.0)
+    drive.set_duty_cycle(duty_cycle)
+    for now in np.arange(0.0, 10.0, 0.25):
+        drive.update(now)
+        assert relay.is_on() == state  # No pulse shorter than min_pulse
+
+
+# PID
+
+@pytest.fixture
+def pwm(board):
+    # Not wired to the zone: the temperature only changes when the test sets it
+    pwm = PWM_PinController(5, board_factory=board.open)
+    yield pwm
+    pwm.disconnect()
+
+
+@pytest.mark.parametrize('anti_windup', ANTI_WINDUP_MODES)
+def test_pid_anti_windup(board, reader, pwm, anti_windup):
+    pid = PIDTemperatureController(reader, pwm, 80.0, ControllerType.HEATER, kp=0.05, ki=0.01,
+                                   anti_windup=anti_windup)
+    board.advance(0.1)
+    for step in range(100):
+        assert pid.control(float(step), None) == 1.0
+    assert pid._integral <= 1.0
+    # Once the setpoint is overshot, the output leaves saturation at the next step
+    board.zones['zone'].temperature = 81.0
+    board.advance(0.1)
+    assert pid.control(100.0, None) < 1.0
+
+
+@pytest.mark.parametrize('bumpless, change', [(True, 0.0), (False, 0.1)])
+def test_pid_setpoint_change(board, reader, pwm, bumpless, change):
+    pid = PIDTemperatureController(reader, pwm, 25.0, ControllerType.HEATER, kp=0.05, ki=0.01)
+    pid.reset(output=0.5)
+    board.advance(0.1)
+    output = pid.control(0.0, None)
+    pid.set_setpoint(27.0, bumpless=bumpless)
+    assert pid.control(0.0, None) == pytest.approx(output + change)
+
+
+def test_pid_set_gains_recomputes_time_constants(board, reader, pwm):
+    pid = PIDTemperatureController(reader, pwm, 30.0, ControllerType.HEATER, kp=0.1)
+    pid.set_gains(0.1, ki=0.01, kd=1.0)
+    assert pid.tracking_time == pytest.approx(math.sqrt(10 * 10))
+    assert pid.derivative_time_constant == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize('gains', [(-0.1, 0.0, 0.0), (0.1, -0.01, 0.0), (0.1, 0.0, -1.0), (0.1, math.nan, 0.0),
+                                   (math.inf, 0.0, 0.0)])
+def test_pid_rejects_invalid_gains(board, reader, pwm, gains):
+    with pytest.raises(ValueError):
+        PIDTemperatureController(reader, pwm, 30.0, ControllerType.HEATER, *gains)
+    pid = PIDTemperatureController(reader, pwm, 30.0, ControllerType.HEATER, kp=0.1)
+    with pytest.raises(ValueError):
+        pid.set_gains(*gains)
+    assert (pid.kp, pid.ki, pid.kd) == (0.1, 0.0, 0.0)
+
+
+def test_pwm_rejects_nan_duty_cycle(pwm):
+    pwm.set_duty_cycle(0.5)
+    with pytest.raises(ValueError):
+        pwm.set_duty_cycle(math.nan)
+    assert pwm.duty_cycle == 0.5
+
+
+def test_pid_holds_output_on_nan_temperature(board, reader, pwm, monkeypatch):
+    pid = PIDTemperatureController(reader, pwm, 30.0, ControllerType.HEATER, kp=0.05, ki=0.01)
+    board.advance(0.1)
+    output = pid.control(0.0, None)
+    monkeypatch.setattr(reader, 'get_temperature', lambda: math.nan)
+    assert pid.control(1.0, None) is None
+    assert pid.output == output and pwm.duty_cycle == output
+
+def test_pid_time_proportioning_on_simulated_clock(board, reader, monkeypatch):
+    relay = Digital_PinController(4, board_factory=board.open)
+    drive = TimeProportional_PinController(relay, window=10.0)
+    # Saturated at 30% far below the setpoint: 3 s on, 7 s off per window
+    pid = PIDTemperatureController(reader, drive, 80.0, ControllerType.HEATER, kp=1.0, output_limits=(0.0, 0.3))
+    edges = []
+    digital_write = board.digital_write
+
+    def record_write(pin, value):
+        if not edges or edges[-1][1] != value:
+            edges.append((board.time, value))
+        digital_write(pin, value)
+
+    monkeypatch.setattr(board, 'digital_write', record_write)
+    scheduler = ControlScheduler(clock=board.clock)
+    scheduler.add(pid, 0.1)
+    board.run(60.0, scheduler)
+    relay.disconnect()
+
+    rising = [t for t, value in edges if value]
+    falling = [t for t, value in edges if not value]
+    assert len(rising) == 6
+    assert np.diff(rising) == pytest.approx(10.0, abs=0.15)
+    assert np.subtract(falling[:len(rising)], rising[:len(falling)]) == pytest.approx(3.0, abs=0.15)
+
+
+# Control scheduler
+
+class FakeClock:
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+def test_scheduler_deadlines_on_period_grid():
+    clock = FakeClock()
+    scheduler = ControlScheduler(clock=clock)
+    runs = []
+    task = scheduler.add(runs.append, 1.0)
+    scheduler.run_pending()
+    clock.time = 1.3  # Late start: the next deadline stays on the grid
+    assert scheduler.run_pending() == pytest.approx(0.7)
+    assert runs == [0.0, 1.3]
+    assert task.next_deadline == 2.0
+    assert task.max_jitter == pytest.approx(0.3)
+
+
+def test_scheduler_overrun_skips_missed_periods():
+    clock = FakeClock()
+    scheduler = ControlScheduler(clock=clock)
+
+    def slow_loop(now):
+        clock.time += 2.5
+
+    task = scheduler.add(slow_loop, 1.0)
+    scheduler.run_pending()
+    assert task.overruns == 2
+    assert task.next_deadline == 3.0
+
+
+def test_scheduler_remove():
+    clock = FakeClock()
+    scheduler = ControlScheduler(clock=clock)
+    runs = []
+
+    def loop(now):
+        runs.append(now)
+
+    scheduler.add(loop, 1.0)
+    scheduler.remove(loop)
+    assert scheduler.run_pending() is None
+    assert runs == []
+
+
+# Connection pool
+
+def test_pool_shares_and_releases_board(board):
+    first = Digital_PinController(4, board_factory=board.open)
+    second = Digital_PinController(5, board_factory=board.open)
+    assert first.connection_manager is second.connection_manager
+    assert first.board is second.board is board
+    first.disconnect()
+    second.disconnect()
+    assert first.connection_manager not in BaseInstrument._connection_managers.values()
+    third = Digital_PinController(4, board_factory=board.open)
+    assert third.connection_manager is not first.connection_manager
+    third.disconnect()
+
+
+def test_pool_per_board_factory():
+    first_board, second_board = SimulatedTelemetrix(), SimulatedTelemetrix()
+    first = Digital_PinController(4, board_factory=first_board.open)
+    second = Digital_PinController(5, board_factory=second_board.open)
+    assert first.board is first_board
+    assert second.board is second_board
+    first.disconnect()
+    assert second.connection_manager in BaseInstrument._connection_managers.values()
+    second.disconnect()
+
+
+def test_default_board_factory():
+    board = use_simulated_board()
+    try:
+        instrument = Digital_PinController(4)
+        assert instrument.board is board
+        instrument.disconnect()
+    finally:
+        BaseInstrument.set_board_factory(None)
+    # Instruments given a factory ignore the default one
+    instrument = Digital_PinController(4, board_factory=board.open)
+    assert instrument.board is board
+    instrument.disconnect()
+
+
+def test_pool_release_keeps_simulation_running(board):
+    board.start()
+    try:
+        instrument = Digital_PinController(4, board_factory=board.open)
+        instrument.disconnect()  # Last instrument: the pool shuts the board down
+        assert board._thread is not None and board._thread.is_alive()
+    finally:
+        board.stop()
+    assert board._thread is None
+
+def test_simulated_stations_keep_their_board(thermistor_model):
+    first, second = HeaterStation(simulated=True), HeaterStation(simulated=True)
+    try:
+        first.add_loop('first', thermistor_model, thermistor_pin=0, output_pin=3)
+        second.add_loop('second', thermistor_model, thermistor_pin=0, output_pin=3)
+        assert first.loops['first'].reader.board is first.simulated_board
+        assert second.loops['second'].reader.board is second.simulated_board
+        assert BaseInstrument.board_factory is None
+    finally:
+        first.close()  # Closed in creation order
+        second.close()
+    assert BaseInstrument.board_factory is None
+
+
+# Digital output group
+
+def test_failed_loop_leaves_simulated_board_unchanged(thermistor_model):
+    station = HeaterStation(simulated=True)
+    try:
+        with pytest.raises(ValueError):
+            station.add_loop('bad', thermistor_model, thermistor_pin=0, output_pin=3, kp=-1.0)
+        assert 'bad' not in station.simulated_board.zones
+        assert station.simulated_board._actuators == {}
+        loop = station.add_loop('good', thermistor_model, thermistor_pin=0, output_pin=3)
+        assert station.simulated_board._actuators[3][0] is station.simulated_board.zones['good']
+        assert loop.reader.pin == 0
+    finally:
+        station.close()
+
+def test_output_group_flush(board):
+    heater = Digital_PinController(4, board_factory=board.open)
+    fan = Digital_PinController(6, board_factory=board.open)
+    group = DigitalOutputGroup([heater, fan])
+    group.turn_on(heater)
+    group.turn_off(fan)
+    assert group.flush() == 2
+    assert board._outputs[4] == 1.0
+    group.set_all(False)
+    group.set_all(True)  # Coalesced with the previous request
+    assert group.flush() == 1  # The heater is already on
+    with group:
+        group.turn_on(fan)
+    assert group.flush() == 0
+    # A state due for a refresh is written again
+    heater.refresh_interval = 0.0
+    group.turn_on(heater)
+    assert group.flush() == 1
+    heater.disconnect()
+    fan.disconnect()
+
+
+# Capture and replay
+
+def test_replay_reproduces_event_driven_control(tmp_path, board, thermistor_model):
+    board.add_thermistor(0, 'zone', thermistor_model, SERIES_RESISTOR, SERIES_MODE, noise=0.5)
+    reader = ThermistorReader(0, thermistor_model, series_resistor=SERIES_RESISTOR, series_mode=SERIES_MODE,
+                              board_factory=board.open)
+    heater = Digital_PinController(4, board_factory=board.open)
+    controller = TemperatureController(reader, heater, 30.0, ControllerType.HEATER)
+    capture = AnalogCapture(str(tmp_path.joinpath('capture.adc')))
+    capture.attach(reader)
+    board.run(5.0)
+    controller.start_event_driven(min_time=0.0)
+    live = []
+    subscription = lambda temperature: live.append(heater.is_on())
+    reader.subscribe(subscription)
+    board.run(120.0)
+    reader.unsubscribe(subscription)
+    capture.close()
+
+    decisions = AnalogReplay(capture.file_path).run([reader], [controller])
+    assert controller.event_driven and controller.event_min_time == 0.0
+    assert len(decisions) == capture.records_written  # A control step per sample
+    assert np.count_nonzero(np.diff(decisions['output'])) == np.count_nonzero(np.diff(np.array(live, float)))
+    assert np.count_nonzero(np.diff(decisions['output'])) > 0
+    controller.stop_event_driven()
+    reader.disconnect()
+    heater.disconnect()
+
+
+def test_replay_periodic_control(tmp_path, board, reader):
+    heater = Digital_PinController(4, board_factory=board.open)
+    controller = TemperatureController(reader, heater, 30.0, ControllerType.HEATER, name='thermostat')
+    with AnalogCapture(str(tmp_path.joinpath('capture.adc'))) as capture:
+        capture.attach(reader)
+        board.run(10.0)
+
+    decisions = AnalogReplay(capture.file_path).run([reader], [controller], control_period=1.0)
+    assert np.array_equal(np.floor(decisions['time']), np.arange(len(decisions)))  # Steps on the 1 s grid
+    assert set(decisions['controller']) == {b'thermostat'}
+    assert math.isnan(decisions['temperature'][0])  # No sample yet at the first control step
+    assert decisions['temperature'][1:] == pytest.approx(20.0, abs=0.2)
+    assert decisions['output'][-1] == 1.0  # Below the threshold: heating
+    heater.disconnect()
+
+
+def test_replay_independent_of_history(tmp_path, board, thermistor_model):
+    board.add_thermistor(0, 'zone', thermistor_model, SERIES_RESISTOR, SERIES_MODE, noise=0.5)
+    reader = ThermistorReader(0, thermistor_model, series_resistor=SERIES_RESISTOR, series_mode=SERIES_MODE,
+                              board_factory=board.open)
+    heater = PWM_PinController(4, board_factory=board.open)
+    pid = PIDTemperatureController(reader, heater, 40.0, ControllerType.HEATER, kp=0.1, ki=0.01, name='pid')
+    scheduler = ControlScheduler(clock=board.clock)
+    scheduler.add(pid, 1.0)
+    with AnalogCapture(str(tmp_path.joinpath('capture.adc'))) as capture:
+        capture.attach(reader)
+        board.run(60.0, scheduler)
+    board.run(30.0, scheduler)  # The live run goes on after the capture
+
+    replay = AnalogReplay(capture.file_path)
+    decisions = replay.run([reader], [pid])
+    assert decisions['output'][-1] > 0
+    fresh_pid = PIDTemperatureController(reader, heater, 40.0, ControllerType.HEATER, kp=0.1, ki=0.01, name='pid')
+    for other_decisions in (replay.run([reader], [pid]), replay.run([reader], [fresh_pid])):
+        for field in DECISION_DTYPE.names:
+            assert np.array_equal(other_decisions[field], decisions[field], equal_nan=field != 'controller')
+    reader.disconnect()
+    heater.disconnect()
+
+
+# Time series buffer
+
+def test_time_series_buffer_wraps_contiguously():
+    buffer = TimeSeriesBuffer(4)
+    for t in range(6):
+        buffer.append(float(t), 10.0 * t)
+    times, values = buffer.latest()
+    assert times.tolist() == [2.0, 3.0, 4.0, 5.0]
+    assert values.tolist() == [20.0, 30.0, 40.0, 50.0]
+    assert buffer.latest(2)[0].tolist() == [4.0, 5.0]
+    assert buffer.window(1.5)[0].tolist() == [4.0, 5.0]
+    assert buffer.last == (5.0, 50.0)
+    times, _ = buffer.latest(copy=True)
+    buffer.append(6.0, 60.0)
+    assert times.tolist() == [2.0, 3.0, 4.0, 5.0]  # Copies are not affected by later samples
+
+
+def test_time_series_buffer_spills_whole_history(tmp_path):
+    spill_path = str(tmp_path.joinpath('history.bin'))
+    buffer = TimeSeriesBuffer(4, spill_path=spill_path, spill_chunk=3)
+    for t in range(10):
+        buffer.append(float(t), -t)
+    buffer.flush()
+    times, values = load_spilled(spill_path)
+    assert times.tolist() == [float(t) for t in range(10)]
+    assert values.tolist() == [-t for t in range(10)]
+    assert len(buffer) == 4
+
+
+# Telemetry
+
+def test_telemetry_round_trip(tmp_path):
+    pytest.importorskip('tables')
+    file_path = str(tmp_path.joinpath('telemetry.h5'))
+    with TelemetryWriter(file_path, batch_size=4) as writer:
+        for t in range(10):
+            writer.append(float(t), 'heater', raw_adc=500 + t, temperature=20.0 + t, output=t % 2)
+            writer.append(float(t), 'cooler', temperature=None)
+    with pytest.raises(ValueError):
+        writer.append(10.0, 'heater')
+    with TelemetryReader(file_path) as reader:
+        assert len(reader) == 20
+        assert reader.channels == ['cooler', 'heater']
+        records = reader.read(start=2.0, stop=5.0, channel='heater')
+        assert records['time'].tolist() == [2.0, 3.0, 4.0]
+        assert records['temperature'].tolist() == [22.0, 23.0, 24.0]
+        assert np.isnan(reader.read(channel='cooler')['temperature']).all()
+
+
+def test_telemetry_rejects_long_channel_names(tmp_path):
+    pytest.importorskip('tables')
+    with TelemetryWriter(str(tmp_path.joinpath('telemetry.h5'))) as writer:
+        with pytest.raises(ValueError):
+            writer.append(0.0, 'a channel name too long')
+
+
+# Latency probes
+
+def test_latency_histogram_quantiles():
+    histogram = LatencyHistogram()
+    for value in [1e-3] * 99 + [1e-1]:
+        histogram.record(value)
+    statistics = histogram.get_statistics()
+    assert statistics['count'] == 100
+    assert statistics['p50'] == pytest.approx(1e-3, rel=0.13)
+    assert statistics['max'] == 1e-1
+
+
+def test_latency_probes_record_pipeline(board, reader, pwm):
+    pid = PIDTemperatureController(reader, pwm, 80.0, ControllerType.HEATER, kp=0.1)
+    latency_probes.reset()
+    latency_probes.enable()
+    try:
+        board.advance(0.1)
+        pid.control(0.0)
+    finally:
+        latency_probes.disable()
+    statistics = latency_probes.get_statistics()
+    latency_probes.reset()
+    assert statistics['received']['count'] == 0  # Simulated time stamps are not wall-clock times
+    assert statistics['filtered']['count'] == statistics['converted']['count'] > 0
+    assert statistics['control_decision']['count'] == statistics['write_issued']['count'] == 1
+
+
+# Logging
+
+def test_rate_limited_logger_per_key(caplog):
+    rate_limited = RateLimitedLogger(logging.getLogger('test_rate_limited'), interval=60.0)
+    with caplog.at_level(logging.WARNING, logger='test_rate_limited'):
+        for _ in range(3):
+            for pin in (0, 1):
+                rate_limited.warning('Pin %s out of range', pin, key=pin)
+    assert [record.getMessage() for record in caplog.records] == ['Pin 0 out of range', 'Pin 1 out of range']
+
+
+def test_rate_limited_logger_counts_suppressed(caplog, monkeypatch):
+    rate_limited = RateLimitedLogger(logging.getLogger('test_rate_limited'), interval=10.0)
+    now = [0.0]
+    monkeypatch.setattr('Instrument_Logging.time.monotonic', lambda: now[0])
+    with caplog.at_level(logging.WARNING, logger='test_rate_limited'):
+        for now[0] in (0.0, 1.0, 2.0, 3.0, 10.0):
+            rate_limited.warning('Pin %s out of range', 0, key=0)
+        rate_limited.warning('Pin %s out of range', 1, key=1)  # Not counted with pin 0
+        now[0] = 20.0
+        rate_limited.warning('Pin %s out of range', 0, key=0)
+    assert [record.getMessage() for record in caplog.records] == [
+        'Pin 0 out of range', 'Pin 0 out of range (3 similar messages suppressed)', 'Pin 1 out of range',
+        'Pin 0 out of range']
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Behaviour of the PyMoDAQ plugins on the simulated board (Simulated setting), without Arduino nor display.
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+pytest.importorskip('pymodaq')
+pytest.importorskip('telemetrix')
+QtWidgets = pytest.importorskip('qtpy.QtWidgets')
+
+from pymodaq.utils.data import DataActuator
+
+PLUGINS_PATH = Path(__file__).parent.parent.joinpath('src', 'pymodaq_plugins_TelemetrixArduinoTempControl')
+sys.path.insert(0, str(PLUGINS_PATH.joinpath('daq_move_plugins')))
+sys.path.insert(0, str(PLUGINS_PATH.joinpath('daq_viewer_plugins', 'plugins_0D')))
+
+from daq_move_Heater import DAQ_Move_Heater
+from daq_0Dviewer_TelemetrixThermistors import DAQ_0DViewer_TelemetrixThermistors
+from Base_Telemetrix_Instrument import Base_Telemetrix_Instrument
+
+SAMPLE_WAIT = 0.3  # Wall-clock time for the simulated boards to report a few samples, in s
+
+
+@pytest.fixture(scope='module', autouse=True)
+def qapp():
+    yield QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+@pytest.fixture
+def heater():
+    actuator = DAQ_Move_Heater(None, None)
+    actuator.settings.child('board', 'simulated').setValue(True)
+    info, initialized = actuator.ini_stage()
+    assert initialized, info
+    yield actuator
+    actuator.close()
+    assert Base_Telemetrix_Instrument.board_factory is None
+
+
+def slave_heater(axis, thermistor_pin, output_pin):
+    actuator = DAQ_Move_Heater(None, None)
+    actuator.settings.child('multiaxes', 'multi_status').setValue('Slave')
+    actuator.settings.child('multiaxes', 'axis').setValue(axis)
+    actuator.settings.child('thermistor', 'pin').setValue(thermistor_pin)
+    actuator.settings.child('output', 'pin').setValue(output_pin)
+    return actuator
+
+
+def test_heater_bad_table():
+    actuator = DAQ_Move_Heater(None, None)
+    actuator.settings.child('board', 'simulated').setValue(True)
+    actuator.settings.child('thermistor', 'table').setValue('missing_table.csv')
+    info, initialized = actuator.ini_stage()
+    assert not initialized
+    assert 'missing_table.csv' in info
+    # The station is released: no control thread nor simulated board left running
+    assert actuator.controller.scheduler._thread is None
+    assert actuator.controller.simulated_board is None
+
+
+def test_heater_reads_simulated_temperature(heater):
+    time.sleep(SAMPLE_WAIT)
+    assert heater.get_actuator_value().value() == pytest.approx(20.0, abs=0.5)
+
+
+def test_heater_move_sets_setpoint(heater):
+    heater.move_abs(DataActuator(data=40.0))
+    assert heater.controller.get_setpoint('Zone1') == 40.0
+    heater.move_home()
+    assert heater.controller.get_setpoint('Zone1') == heater.settings['home_setpoint']
+
+
+def test_heater_settles_after_dwell_time(heater):
+    time.sleep(SAMPLE_WAIT)
+    heater.settings.child('settling', 'dwell_time').setValue(0.0)
+    heater.controller.set_setpoint('Zone1', heater.controller.get_temperature('Zone1'))
+    assert heater.user_condition_to_reach_target()
+    heater.controller.set_setpoint('Zone1', 60.0)
+    assert not heater.user_condition_to_reach_target()
+
+
+def test_heater_dwell_restarts_after_overshoot(heater):
+    time.sleep(SAMPLE_WAIT)
+    heater.settings.child('settling', 'dwell_time').setValue(SAMPLE_WAIT)
+    temperature = heater.controller.get_temperature('Zone1')
+    heater.controller.set_setpoint('Zone1', temperature)
+    assert not heater.user_condition_to_reach_target()  # Dwell time started
+    time.sleep(2 * SAMPLE_WAIT)
+    # Polls out of the settle band (also out of epsilon, so PyMoDAQ does not call the condition)
+    heater.controller.set_setpoint('Zone1', temperature + 5.0)
+    heater.get_actuator_value()
+    heater.controller.set_setpoint('Zone1', temperature)
+    assert not heater.user_condition_to_reach_target()  # Back in the band: the dwell time starts over
+    time.sleep(2 * SAMPLE_WAIT)
+    assert heater.user_condition_to_reach_target()
+
+
+def test_heater_gain_change(heater):
+    heater.settings.child('pid', 'ki').setValue(0.01)
+    heater.commit_settings(heater.settings.child('pid', 'ki'))
+    assert heater.controller.loops['Zone1'].pid.ki == 0.01
+
+
+def test_heater_slave_zones(heater):
+    slave = slave_heater('Zone2', thermistor_pin=1, output_pin=5)
+    info, initialized = slave.ini_stage(heater.controller)
+    assert initialized, info
+    assert list(heater.controller.loops) == ['Zone1', 'Zone2']
+    # The pins of a zone cannot be reused by another one
+    info, initialized = slave_heater('Zone3', thermistor_pin=0, output_pin=6).ini_stage(heater.controller)
+    assert not initialized
+    assert 'already used' in info
+    slave.close()
+    assert list(heater.controller.loops) == ['Zone1']
+
+
+@pytest.fixture
+def thermistors():
+    viewer = DAQ_0DViewer_TelemetrixThermistors(None, None)
+    viewer.settings.child('board', 'simulated').setValue(True)
+    viewer.settings.child('pins').setValue('0, 1, 3')
+    yield viewer
+    viewer.close()
+    assert Base_Telemetrix_Instrument.board_factory is None
+
+
+def test_thermistors_grab(thermistors):
+    info, initialized = thermistors.ini_detector()
+    assert initialized, info
+    time.sleep(SAMPLE_WAIT)
+    grabs = []
+    thermistors.dte_signal.connect(grabs.append)
+    thermistors.grab_data()
+    data = grabs[-1][0]
+    assert data.labels == ['Pin 0', 'Pin 1', 'Pin 3']
+    # The simulated zones are warmer with the pin number
+    assert [channel[0] for channel in data.data] == pytest.approx([20.0, 25.0, 35.0], abs=0.5)
+
+
+def test_thermistors_bad_table(thermistors):
+    thermistors.settings.child('thermistor', 'table').setValue('missing_table.csv')
+    info, initialized = thermistors.ini_detector()
+    assert not initialized
+    assert 'missing_table.csv' in info
+
+
+@pytest.mark.parametrize('pins', ['', '0, a'])
+def test_thermistors_bad_pins(thermistors, pins):
+    thermistors.settings.child('pins').setValue(pins)
+    info, initialized = thermistors.ini_detector()
+    assert not initialized
+    assert thermistors._simulated_board is None
+
+
+def test_thermistors_reader_failure(thermistors):
+    thermistors.settings.child('thermistor', 'filter').setValue('unknown')
+    info, initialized = thermistors.ini_detector()
+    assert not initialized
+    assert 'Could not create' in info
+    # The viewer is released: no reader nor simulated board left running
+    assert thermistors.controller == []
+    assert thermistors._simulated_board is None
+
+
+def test_simulated_viewers_closed_in_creation_order():
+    viewers = [DAQ_0DViewer_TelemetrixThermistors(None, None) for _ in range(2)]
+    for viewer in viewers:
+        viewer.settings.child('board', 'simulated').setValue(True)
+        info, initialized = viewer.ini_detector()
+        assert initialized, info
+    assert viewers[0].controller[0].board is not viewers[1].controller[0].board
+    for viewer in viewers:
+        viewer.close()
+    assert Base_Telemetrix_Instrument.board_factory is None